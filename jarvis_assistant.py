@@ -6,30 +6,33 @@ import pyttsx3
 import threading
 import json
 import os
+import sys
 import datetime
 import webbrowser
 import random
 import subprocess
+import shutil
 import platform
 import logging
 import pickle
-import requests
+import importlib
+import zlib
+import sqlite3
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import re
 import base64
 import hashlib
+import hmac
+import bisect
+import heapq
+import math
+from collections import OrderedDict
+from abc import ABC, abstractmethod
 import time
 import unittest
 import wave
-import pyaudio
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from PIL import Image, ImageTk, ImageDraw, ImageFilter, ImageEnhance
-from telethon import TelegramClient, events, sync
-from telethon.tl.types import InputPeerUser
-from cryptography.fernet import Fernet
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
 # Set up logging
 logging.basicConfig(
@@ -39,20 +42,412 @@ logging.basicConfig(
 )
 logger = logging.getLogger('JarvisAssistant')
 
+class LazyImport:
+    # Placeholder for a heavy module (or one of its attributes) that is only
+    # imported the first time it is actually used
+    loaded = {}
+    
+    def __init__(self, module_name, attribute=None):
+        self._module_name = module_name
+        self._attribute = attribute
+        self._target = None
+    
+    def _load(self):
+        if self._target is None:
+            start = time.perf_counter()
+            module = importlib.import_module(self._module_name)
+            self._target = getattr(module, self._attribute) if self._attribute else module
+            if self._module_name not in LazyImport.loaded:
+                LazyImport.loaded[self._module_name] = time.perf_counter() - start
+                logger.info(f"Loaded {self._module_name} on demand in {LazyImport.loaded[self._module_name]:.3f}s")
+        return self._target
+    
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+    
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+# Heavy dependencies, loaded by whichever component needs them first
+requests = LazyImport("requests")
+pyaudio = LazyImport("pyaudio")
+plt = LazyImport("matplotlib.pyplot")
+FigureCanvasTkAgg = LazyImport("matplotlib.backends.backend_tkagg", "FigureCanvasTkAgg")
+Image = LazyImport("PIL.Image")
+ImageTk = LazyImport("PIL.ImageTk")
+ImageDraw = LazyImport("PIL.ImageDraw")
+ImageFilter = LazyImport("PIL.ImageFilter")
+ImageEnhance = LazyImport("PIL.ImageEnhance")
+# telethon.sync patches the client with the blocking API used below
+TelegramClient = LazyImport("telethon.sync", "TelegramClient")
+events = LazyImport("telethon.events")
+InputPeerUser = LazyImport("telethon.tl.types", "InputPeerUser")
+Fernet = LazyImport("cryptography.fernet", "Fernet")
+MultiFernet = LazyImport("cryptography.fernet", "MultiFernet")
+hashes = LazyImport("cryptography.hazmat.primitives.hashes")
+PBKDF2HMAC = LazyImport("cryptography.hazmat.primitives.kdf.pbkdf2", "PBKDF2HMAC")
+
+# Records keep times as integer microseconds since the epoch rather than
+# datetime objects or ISO strings
+EPOCH = datetime.datetime(1970, 1, 1)
+MISSING_TIME = -(2 ** 63)
+
+def to_micros(value):
+    if value is None:
+        return MISSING_TIME
+    return (value - EPOCH) // datetime.timedelta(microseconds=1)
+
+def from_micros(value):
+    if value == MISSING_TIME:
+        return None
+    return EPOCH + datetime.timedelta(microseconds=value)
+
+def iso_to_micros(value):
+    return to_micros(datetime.datetime.fromisoformat(value)) if value else MISSING_TIME
+
+def micros_to_iso(value):
+    return from_micros(value).isoformat() if value != MISSING_TIME else None
+
 class Contact:
+    # Slotted record. Phone and email share one optional tuple since most
+    # contacts have neither.
+    __slots__ = ("name", "telegram_username", "details", "last_contacted_micros", "contact_frequency")
+    
     def __init__(self, name, telegram_username=None, phone=None, email=None):
         self.name = name
         self.telegram_username = telegram_username
-        self.phone = phone
-        self.email = email
-        self.last_contacted = None
+        self.details = (phone, email) if phone is not None or email is not None else None
+        self.last_contacted_micros = MISSING_TIME
         self.contact_frequency = 0  # Number of times contacted
     
+    @property
+    def phone(self):
+        return self.details[0] if self.details else None
+    
+    @phone.setter
+    def phone(self, value):
+        email = self.email
+        self.details = (value, email) if value is not None or email is not None else None
+    
+    @property
+    def email(self):
+        return self.details[1] if self.details else None
+    
+    @email.setter
+    def email(self, value):
+        phone = self.phone
+        self.details = (phone, value) if phone is not None or value is not None else None
+    
+    @property
+    def last_contacted(self):
+        return from_micros(self.last_contacted_micros)
+    
+    @last_contacted.setter
+    def last_contacted(self, value):
+        self.last_contacted_micros = to_micros(value)
+    
+    def __getstate__(self):
+        return self.to_dict()
+    
+    def __setstate__(self, state):
+        # Also accepts the attribute dict pickled by older versions, with a datetime last_contacted
+        self.__init__(state["name"], state.get("telegram_username"), state.get("phone"), state.get("email"))
+        last_contacted = state.get("last_contacted")
+        if isinstance(last_contacted, str):
+            last_contacted = datetime.datetime.fromisoformat(last_contacted)
+        self.last_contacted = last_contacted
+        self.contact_frequency = state.get("contact_frequency", 0)
+    
     def update_contact_time(self):
         self.last_contacted = datetime.datetime.now()
         self.contact_frequency += 1
+    
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "telegram_username": self.telegram_username,
+            "phone": self.phone,
+            "email": self.email,
+            "last_contacted": micros_to_iso(self.last_contacted_micros),
+            "contact_frequency": self.contact_frequency
+        }
+    
+    @classmethod
+    def from_dict(cls, fields):
+        contact = cls(fields["name"], fields["telegram_username"], fields["phone"], fields["email"])
+        contact.last_contacted_micros = iso_to_micros(fields["last_contacted"])
+        contact.contact_frequency = fields["contact_frequency"]
+        return contact
+
+class ContactIndex:
+    # Resolves spoken names to contacts. Each word of a contact's name is a
+    # token; a query word matches a token exactly, as a prefix (through a
+    # character trie, shortest completions first) or fuzzily (by character
+    # bigram overlap, which catches "jon" for "john"). Matching contacts are
+    # ranked by match quality, then by frecency: contact_frequency decayed by
+    # the time since last contacted. Bigram postings hold token ids and are
+    # counted with np.bincount, so fuzzy lookups stay fast with many tokens.
+    EXACT_SCORE = 1.0
+    PREFIX_SCORE = 0.8
+    FUZZY_SCORE = 0.6
+    MIN_SIMILARITY = 0.5
+    MAX_CANDIDATES = 256  # Contacts considered per query word, taken from the best tokens first
+    HALF_LIFE = 30 * 24 * 3600 * 1000000  # Frecency halves every 30 days, in micros
+    
+    def __init__(self, contacts):
+        self.contacts = contacts  # The profile's contact dict, keyed by lowercased name
+        self.token_keys = {}  # token -> keys of the contacts whose name contains it
+        self.key_tokens = {}  # key -> tokens of that contact
+        self.ranks = {}  # key -> frecency rank
+        self.trie = {}
+        self.token_ids = {}
+        self.id_tokens = []  # None where a removed token's id is free
+        self.free_ids = []
+        self.bigram_sizes = np.zeros(64, dtype=np.int32)  # token id -> size of its bigram set
+        self.bigram_postings = {}  # bigram -> ids of the tokens containing it
+        self.posting_arrays = {}  # bigram -> the same ids as an array, rebuilt after changes
+        for key, contact in contacts.items():
+            self.add(key, contact)
+    
+    @staticmethod
+    def tokenize(text):
+        return re.sub(r"[^\w\s]", " ", text.lower()).split()
+    
+    @staticmethod
+    def bigrams(token):
+        padded = f" {token} "
+        return {padded[i:i + 2] for i in range(len(padded) - 1)}
+    
+    def rank(self, contact):
+        # log2 of (1 + frequency) * 0.5 ** ((now - last_contacted) / HALF_LIFE), without
+        # the -now / HALF_LIFE term. That term is the same for every contact, so
+        # ranks never need refreshing as time passes.
+        if contact.last_contacted_micros == MISSING_TIME:
+            return contact.contact_frequency - 1e9
+        return math.log2(1 + contact.contact_frequency) + contact.last_contacted_micros / self.HALF_LIFE
+    
+    def touch(self, key):
+        # The contact's frequency or last contact time changed
+        if key in self.ranks:
+            self.ranks[key] = self.rank(self.contacts[key])
+    
+    def add(self, key, contact):
+        if key in self.key_tokens:
+            self.remove(key)
+        tokens = tuple(dict.fromkeys(self.tokenize(contact.name)))
+        self.key_tokens[key] = tokens
+        self.ranks[key] = self.rank(contact)
+        for token in tokens:
+            keys = self.token_keys.get(token)
+            if keys is None:
+                keys = self.token_keys[token] = set()
+                node = self.trie
+                for char in token:
+                    node = node.setdefault(char, {})
+                node[None] = token
+                self._add_bigrams(token)
+            keys.add(key)
+    
+    def remove(self, key):
+        self.ranks.pop(key, None)
+        for token in self.key_tokens.pop(key, ()):
+            keys = self.token_keys[token]
+            keys.discard(key)
+            if keys:
+                continue
+            # Last contact with this token: prune it from the trie and bigram postings
+            del self.token_keys[token]
+            self._remove_bigrams(token)
+            path = [self.trie]
+            for char in token:
+                path.append(path[-1][char])
+            del path[-1][None]
+            for depth in range(len(token), 0, -1):
+                if path[depth]:
+                    break
+                del path[depth - 1][token[depth - 1]]
+    
+    def _add_bigrams(self, token):
+        if self.free_ids:
+            token_id = self.free_ids.pop()
+            self.id_tokens[token_id] = token
+        else:
+            token_id = len(self.id_tokens)
+            self.id_tokens.append(token)
+            if token_id >= len(self.bigram_sizes):
+                self.bigram_sizes = np.concatenate([self.bigram_sizes, np.zeros_like(self.bigram_sizes)])
+        self.token_ids[token] = token_id
+        bigrams = self.bigrams(token)
+        self.bigram_sizes[token_id] = len(bigrams)
+        for bigram in bigrams:
+            self.bigram_postings.setdefault(bigram, set()).add(token_id)
+            self.posting_arrays.pop(bigram, None)
+    
+    def _remove_bigrams(self, token):
+        token_id = self.token_ids.pop(token)
+        self.id_tokens[token_id] = None
+        self.free_ids.append(token_id)
+        self.bigram_sizes[token_id] = 0
+        for bigram in self.bigrams(token):
+            postings = self.bigram_postings[bigram]
+            postings.discard(token_id)
+            if not postings:
+                del self.bigram_postings[bigram]
+            self.posting_arrays.pop(bigram, None)
+    
+    def _posting_array(self, bigram):
+        postings = self.posting_arrays.get(bigram)
+        if postings is None:
+            postings = np.fromiter(self.bigram_postings.get(bigram, ()), dtype=np.int64)
+            self.posting_arrays[bigram] = postings
+        return postings
+    
+    def _prefix_tokens(self, prefix):
+        # Breadth first, so shorter completions come first
+        node = self.trie
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        tokens = []
+        level = [node]
+        while level:
+            next_level = []
+            for node in level:
+                for char, child in node.items():
+                    if char is None:
+                        tokens.append(child)
+                    else:
+                        next_level.append(child)
+            if len(tokens) >= self.MAX_CANDIDATES:
+                break
+            level = next_level
+        return tokens
+    
+    def _fuzzy_tokens(self, term):
+        # Tokens whose bigram sets have a Dice coefficient of at least
+        # MIN_SIMILARITY with the term's, most similar first
+        term_bigrams = self.bigrams(term)
+        token_count = len(self.id_tokens)
+        if not token_count:
+            return []
+        shared = np.bincount(np.concatenate([self._posting_array(bigram) for bigram in term_bigrams]),
+                             minlength=token_count)
+        similarity = 2 * shared / (len(term_bigrams) + self.bigram_sizes[:token_count])
+        candidates = np.flatnonzero(similarity >= self.MIN_SIMILARITY)
+        candidates = candidates[np.argsort(-similarity[candidates], kind="stable")]
+        return [(self.id_tokens[token_id], float(similarity[token_id])) for token_id in candidates]
+    
+    def _match_term(self, term, fuzzy=True):
+        if term in self.token_keys:
+            matches = [(term, self.EXACT_SCORE)]
+        else:
+            matches = [(token, self.PREFIX_SCORE) for token in self._prefix_tokens(term)]
+            if not matches and fuzzy:
+                matches = [(token, self.FUZZY_SCORE * similarity) for token, similarity in self._fuzzy_tokens(term)]
+        
+        scores = {}
+        for token, score in matches:
+            if len(scores) >= self.MAX_CANDIDATES:
+                break
+            for key in self.token_keys[token]:
+                if score > scores.get(key, 0):
+                    scores[key] = score
+        return scores
+    
+    def search(self, query, limit=5, fuzzy=True):
+        # Without `fuzzy`, only contacts matching every word exactly or by prefix
+        terms = self.tokenize(query.lstrip('@'))
+        if not terms:
+            return []
+        
+        scores = {}
+        for index, term in enumerate(terms):
+            matched = self._match_term(term, fuzzy)
+            if not fuzzy:
+                if index:
+                    scores = {key: score for key, score in scores.items() if key in matched}
+                elif not matched:
+                    return []
+            for key, score in matched.items():
+                if fuzzy or not index or key in scores:
+                    scores[key] = scores.get(key, 0) + score
+        
+        # Quality first; frecency only orders contacts that match equally well
+        ranks = self.ranks
+        best = heapq.nlargest(limit, scores, key=lambda key: (round(scores[key], 6), ranks[key]))
+        return [self.contacts[key] for key in best]
+
+class CommandHistory:
+    # Fixed-capacity ring of history records. Appending past the capacity
+    # overwrites the oldest record instead of copying the list. Commands are
+    # interned (the same few recur) and timestamps are kept in an int64 array.
+    # Iterating and indexing yield the usual {"command", "timestamp"} dicts, oldest first.
+    def __init__(self, capacity=100, entries=()):
+        self.capacity = capacity
+        self.commands = [None] * capacity
+        self.timestamps = array('q', bytes(8 * capacity))
+        self.start = 0
+        self.size = 0
+        for entry in entries:
+            self.append(entry)
+    
+    @classmethod
+    def from_columns(cls, capacity, commands, timestamps):
+        history = cls(capacity)
+        for command, timestamp in zip(commands, timestamps):
+            history.add_micros(command, timestamp)
+        return history
+    
+    def add_micros(self, command, timestamp):
+        index = (self.start + self.size) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+        else:
+            self.start = (self.start + 1) % self.capacity
+        self.commands[index] = sys.intern(command) if command is not None else None
+        self.timestamps[index] = timestamp
+    
+    def add(self, command, timestamp):
+        self.add_micros(command, iso_to_micros(timestamp))
+    
+    def append(self, entry):
+        self.add(entry.get("command"), entry.get("timestamp"))
+    
+    def columns(self):
+        # Commands and micros timestamps, oldest first
+        order = [(self.start + i) % self.capacity for i in range(self.size)]
+        return [self.commands[i] for i in order], [self.timestamps[i] for i in order]
+    
+    def recent(self, count):
+        # Newest first
+        return [self[i] for i in range(self.size - 1, max(self.size - count, 0) - 1, -1)]
+    
+    def _entry(self, index):
+        return {"command": self.commands[index], "timestamp": micros_to_iso(self.timestamps[index])}
+    
+    def __len__(self):
+        return self.size
+    
+    def __iter__(self):
+        for i in range(self.size):
+            yield self._entry((self.start + i) % self.capacity)
+    
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(self.size))]
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError("command history index out of range")
+        return self._entry((self.start + key) % self.capacity)
+    
+    def __eq__(self, other):
+        return list(self) == list(other)
 
 class UserProfile:
+    HISTORY_CAPACITY = 100  # Commands kept in memory; older ones are read from the store's archive
+    
     def __init__(self, name="", location=""):
         self.name = name
         self.location = location
@@ -64,46 +459,175 @@ class UserProfile:
             "frequent_commands": {},
             "feedback_ratings": []
         }
-        self.command_history = []
+        self.command_history = CommandHistory(self.HISTORY_CAPACITY)
         self.learning_data = {}
         self.contacts = {}  # Dictionary of Contact objects
         self.telegram_session = None
         self.authenticated = False
         self.auth_token = None
         self.auth_expiry = None
+        self.auth_verifier = None  # Salted PBKDF2 verifier of the profile password
+        self.journal_seq = 0  # Sequence number of the last journaled change applied
+        self.pending_changes = []  # Changes not yet written to the journal
+        self.snapshot_needed = False  # Set when fields were edited without a journaled change
+        self.changes_lock = threading.Lock()
+        self.backing = None  # Store that pages in history and contacts not held in memory
+        self.contacts_complete = True
+        self.contact_index = None  # Built on the first fuzzy lookup
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for transient in ("pending_changes", "snapshot_needed", "changes_lock", "backing", "contacts_complete",
+                          "contact_index"):
+            state.pop(transient, None)
+        return state
+    
+    def __setstate__(self, state):
+        # Profiles pickled by older versions lack the journal fields and keep history in a list
+        history = state.pop("command_history", None)
+        self.__dict__.update(state)
+        if history is not None:
+            self.command_history = history
+        self.__dict__.setdefault("journal_seq", 0)
+        self.__dict__.setdefault("auth_verifier", None)
+        self.pending_changes = []
+        self.snapshot_needed = False
+        self.changes_lock = threading.Lock()
+        self.backing = None
+        self.contacts_complete = True
+        self.contact_index = None
+    
+    @property
+    def command_history(self):
+        return self._command_history
+    
+    @command_history.setter
+    def command_history(self, entries):
+        if not isinstance(entries, CommandHistory):
+            entries = CommandHistory(self.HISTORY_CAPACITY, entries)
+        self._command_history = entries
+    
+    def _record(self, *change):
+        # Every mutation goes through apply_change so the journal can replay it
+        change = list(change)
+        with self.changes_lock:
+            self.apply_change(change)
+            self.pending_changes.append(change)
+    
+    def take_pending_changes(self):
+        with self.changes_lock:
+            changes = self.pending_changes
+            self.pending_changes = []
+        return changes
+    
+    def restore_pending_changes(self, changes, snapshot=False):
+        # A failed write puts back what it took, ahead of anything recorded since
+        with self.changes_lock:
+            self.pending_changes = changes + self.pending_changes
+            self.snapshot_needed = self.snapshot_needed or snapshot
+    
+    def mark_dirty(self):
+        # For callers that edit fields directly; the next save writes a full snapshot
+        self.snapshot_needed = True
+    
+    def is_dirty(self):
+        return self.snapshot_needed or bool(self.pending_changes)
+    
+    def apply_change(self, change):
+        op, args = change[0], change[1:]
+        if op == "history":
+            command, timestamp = args
+            self.command_history.add(command, timestamp)
+        elif op == "frequent_command":
+            command_type, = args
+            frequent_commands = self.preferences["frequent_commands"]
+            frequent_commands[command_type] = frequent_commands.get(command_type, 0) + 1
+        elif op == "feedback":
+            rating, comment, timestamp = args
+            # Stored as [rating, comment or None, micros] rather than a dict
+            self.preferences["feedback_ratings"].append([rating, comment or None, iso_to_micros(timestamp)])
+        elif op == "add_favorite_app":
+            app_name, = args
+            if app_name not in self.preferences["favorite_apps"]:
+                self.preferences["favorite_apps"].append(app_name)
+        elif op == "remove_favorite_app":
+            app_name, = args
+            if app_name in self.preferences["favorite_apps"]:
+                self.preferences["favorite_apps"].remove(app_name)
+        elif op == "learning":
+            command, response, success = args
+            if command not in self.learning_data:
+                self.learning_data[command] = {
+                    "responses": {},
+                    "total_uses": 0,
+                    "successful_uses": 0
+                }
+            entry = self.learning_data[command]
+            entry["total_uses"] += 1
+            if success:
+                entry["successful_uses"] += 1
+            entry["responses"][response] = entry["responses"].get(response, 0) + 1
+        elif op == "add_contact":
+            fields, = args
+            contact = Contact.from_dict(fields)
+            self.contacts[contact.name.lower()] = contact
+            if self.contact_index is not None:
+                self.contact_index.add(contact.name.lower(), contact)
+        elif op == "remove_contact":
+            name, = args
+            self.contacts.pop(name.lower(), None)
+            if self.contact_index is not None:
+                self.contact_index.remove(name.lower())
+        elif op == "contacted":
+            name, timestamp = args
+            contact = self.contacts.get(name.lower())
+            if contact:
+                contact.last_contacted = datetime.datetime.fromisoformat(timestamp)
+                contact.contact_frequency += 1
+                if self.contact_index is not None:
+                    self.contact_index.touch(name.lower())
+        elif op == "telegram_session":
+            self.telegram_session, = args
+        elif op == "auth":
+            token, expiry = args
+            self.authenticated = token is not None
+            self.auth_token = token
+            self.auth_expiry = datetime.datetime.fromisoformat(expiry) if expiry else None
+        elif op == "auth_verifier":
+            self.auth_verifier, = args
+        else:
+            raise ValueError(f"Unknown profile change: {op}")
     
     def add_command_to_history(self, command):
-        self.command_history.append({
-            "command": command,
-            "timestamp": datetime.datetime.now().isoformat()
-        })
-        # Keep only the last 100 commands
-        if len(self.command_history) > 100:
-            self.command_history = self.command_history[-100:]
+        self._record("history", command, datetime.datetime.now().isoformat())
     
     def update_frequent_commands(self, command_type):
-        if command_type in self.preferences["frequent_commands"]:
-            self.preferences["frequent_commands"][command_type] += 1
-        else:
-            self.preferences["frequent_commands"][command_type] = 1
+        self._record("frequent_command", command_type)
+    
+    def get_feedback(self):
+        entries = []
+        for entry in self.preferences["feedback_ratings"]:
+            if isinstance(entry, dict):
+                # Pickled by an older version
+                entries.append(entry)
+            else:
+                rating, comment, timestamp = entry
+                entries.append({"rating": rating, "comment": comment or "", "timestamp": micros_to_iso(timestamp)})
+        return entries
     
     def add_feedback(self, rating, comment=""):
-        self.preferences["feedback_ratings"].append({
-            "rating": rating,
-            "comment": comment,
-            "timestamp": datetime.datetime.now().isoformat()
-        })
+        self._record("feedback", rating, comment, datetime.datetime.now().isoformat())
     
     def get_favorite_apps(self):
         return self.preferences.get("favorite_apps", [])
     
     def add_favorite_app(self, app_name):
         if app_name not in self.preferences["favorite_apps"]:
-            self.preferences["favorite_apps"].append(app_name)
+            self._record("add_favorite_app", app_name)
     
     def remove_favorite_app(self, app_name):
         if app_name in self.preferences["favorite_apps"]:
-            self.preferences["favorite_apps"].remove(app_name)
+            self._record("remove_favorite_app", app_name)
     
     def get_most_frequent_commands(self, limit=5):
         sorted_commands = sorted(
@@ -114,58 +638,115 @@ class UserProfile:
         return sorted_commands[:limit]
     
     def update_learning_data(self, command, response, success):
-        if command not in self.learning_data:
-            self.learning_data[command] = {
-                "responses": {},
-                "total_uses": 0,
-                "successful_uses": 0
-            }
-        
-        self.learning_data[command]["total_uses"] += 1
-        if success:
-            self.learning_data[command]["successful_uses"] += 1
-        
-        if response in self.learning_data[command]["responses"]:
-            self.learning_data[command]["responses"][response] += 1
-        else:
-            self.learning_data[command]["responses"][response] = 1
+        self._record("learning", command, response, success)
     
     def add_contact(self, contact):
-        self.contacts[contact.name.lower()] = contact
+        self._record("add_contact", contact.to_dict())
     
     def get_contact(self, name):
-        return self.contacts.get(name.lower())
+        contact = self.contacts.get(name.lower())
+        if contact is None and not self.contacts_complete:
+            # Store-backed profiles only hold the contacts used so far
+            contact = self.backing.find_contact(self.name, name)
+            if contact:
+                self.contacts[contact.name.lower()] = contact
+        return contact
+    
+    def resident_size(self):
+        # Bytes held by this profile's own data; the backing store is shared. The
+        # walk takes no lock, so changes recorded meanwhile are not held up; one
+        # that resizes a container mid-walk just means walking again.
+        for _ in range(3):
+            try:
+                return estimate_size([value for attribute, value in list(self.__dict__.items())
+                                      if attribute not in ("backing", "changes_lock")])
+            except RuntimeError:
+                continue
+        return 0
+    
+    def find_contacts(self, query, limit=5, fuzzy=True):
+        # Prefix and fuzzy matches, best first
+        if self.contact_index is None or self.contact_index.contacts is not self.contacts:
+            self.get_all_contacts()
+            self.contact_index = ContactIndex(self.contacts)
+        return self.contact_index.search(query, limit, fuzzy)
+    
+    def resolve_contact(self, query):
+        # (contact, certain). An exact name, an @username or a prefix only one
+        # contact has is certain; otherwise the best-ranked near match, which
+        # the caller should confirm before acting on it
+        if query.startswith("@"):
+            username = query.lower()
+            for contact in self.get_all_contacts():
+                if contact.telegram_username and "@" + contact.telegram_username.lower().lstrip("@") == username:
+                    return contact, True
+            return None, True
+        
+        contact = self.get_contact(query)
+        if contact is not None:
+            return contact, True
+        matches = self.find_contacts(query, 2, fuzzy=False)
+        if len(matches) == 1:
+            return matches[0], True
+        if not matches:
+            matches = self.find_contacts(query, 1)
+        return (matches[0], False) if matches else (None, False)
     
     def remove_contact(self, name):
-        if name.lower() in self.contacts:
-            del self.contacts[name.lower()]
+        if self.get_contact(name):
+            self._record("remove_contact", name)
             return True
         return False
     
+    def mark_contacted(self, name):
+        if self.get_contact(name):
+            self._record("contacted", name, datetime.datetime.now().isoformat())
+    
     def get_all_contacts(self):
+        if not self.contacts_complete:
+            for contact in self.backing.all_contacts(self.name):
+                self.contacts.setdefault(contact.name.lower(), contact)
+            self.contacts_complete = True
         return list(self.contacts.values())
     
+    def get_contacts_page(self, offset=0, limit=50):
+        if not self.contacts_complete:
+            return self.backing.contacts_page(self.name, offset, limit)
+        return list(self.contacts.values())[offset:offset + limit]
+    
+    def get_history_page(self, offset=0, limit=50):
+        # Newest first. Pages beyond the in-memory window come from the backing store.
+        recent = self.command_history.recent(offset + limit)[offset:]
+        if self.backing is None or len(recent) == limit:
+            return recent
+        with self.changes_lock:
+            unsaved = sum(1 for change in self.pending_changes if change[0] == "history")
+        older = self.backing.history_page(self.name, max(offset + len(recent) - unsaved, 0), limit - len(recent))
+        return recent + older
+    
+    def get_recent_commands(self, count):
+        return [entry["command"] for entry in self.get_history_page(0, count)]
+    
+    def get_history_range(self, start, end):
+        # Commands run between two datetimes, oldest first
+        if self.backing is not None:
+            return self.backing.history_range(self.name, start, end)
+        start, end = start.isoformat(), end.isoformat()
+        return [entry for entry in self.command_history if start <= entry["timestamp"] < end]
+    
     def set_telegram_session(self, session_name):
-        self.telegram_session = session_name
+        self._record("telegram_session", session_name)
     
-    def authenticate(self, password):
-        # Simple authentication mechanism
-        # In a real application, use a more secure method
-        salt = b'jarvis_salt'  # Should be stored securely
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=100000,
-        )
-        key = base64.urlsafe_b64encode(kdf.derive(password.encode()))
-        
+    def set_password_verifier(self, verifier):
+        self._record("auth_verifier", verifier)
+    
+    def start_session(self):
+        # Called by AuthManager once the password has been verified.
         # Generate a token that expires in 24 hours
-        self.auth_token = hashlib.sha256(os.urandom(32)).hexdigest()
-        self.auth_expiry = datetime.datetime.now() + datetime.timedelta(hours=24)
-        self.authenticated = True
-        
-        return self.auth_token
+        token = hashlib.sha256(os.urandom(32)).hexdigest()
+        expiry = datetime.datetime.now() + datetime.timedelta(hours=24)
+        self._record("auth", token, expiry.isoformat())
+        return token
     
     def is_authenticated(self, token=None):
         if not self.authenticated or not self.auth_expiry:
@@ -180,99 +761,1804 @@ class UserProfile:
         
         return True
     
-    def logout(self):
-        self.authenticated = False
-        self.auth_token = None
-        self.auth_expiry = None
+    def logout(self):
+        self._record("auth", None, None)
+
+class LatencyHistogram:
+    # Log-spaced latency buckets, from 0.1 ms up to a few minutes
+    def __init__(self, min_latency=0.0001, growth=1.25, buckets=64):
+        self.bounds = [min_latency * growth ** i for i in range(buckets)]
+        self.counts = [0] * (buckets + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+    
+    def record(self, seconds):
+        index = bisect.bisect_left(self.bounds, seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+    
+    def percentile(self, percent):
+        # Upper bound of the bucket holding the requested rank
+        with self.lock:
+            if not self.count:
+                return None
+            rank = max(1, int(round(self.count * percent / 100.0)))
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank:
+                    return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+        return self.max
+    
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max if self.count else None
+        }
+
+# Stages of the command pipeline, from the microphone to the spoken reply.
+# "response" runs from the end of speech (or a typed command) until the
+# reply starts being spoken.
+PIPELINE_STAGES = ("listen", "recognize", "parse", "predict", "queue", "handler", "learn", "save", "response", "speak")
+
+class StageTimings:
+    # A LatencyHistogram per pipeline stage, shown in settings and written to
+    # logs/pipeline_timings.json on exit. Buckets start at 10 us, since parsing
+    # and routing take well under a millisecond.
+    def __init__(self, stages=PIPELINE_STAGES):
+        self.histograms = {stage: self._histogram() for stage in stages}
+        self.lock = threading.Lock()
+    
+    def record(self, stage, seconds):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, self._histogram())
+        histogram.record(seconds)
+    
+    @staticmethod
+    def _histogram():
+        return LatencyHistogram(min_latency=0.00001, buckets=96)
+    
+    def since(self, stage, start):
+        # Records the time since a perf_counter() reading and returns the new reading
+        now = time.perf_counter()
+        self.record(stage, now - start)
+        return now
+    
+    def summary(self):
+        with self.lock:
+            histograms = list(self.histograms.items())
+        return {stage: histogram.summary() for stage, histogram in histograms}
+    
+    def report(self):
+        lines = [f"{'stage':10s} {'count':>6s} {'p50':>9s} {'p95':>9s} {'p99':>9s} {'max':>9s}"]
+        for stage, stats in self.summary().items():
+            if not stats["count"]:
+                lines.append(f"{stage:10s} {0:6d} {'-':>9s} {'-':>9s} {'-':>9s} {'-':>9s}")
+                continue
+            lines.append(f"{stage:10s} {stats['count']:6d} " + " ".join(
+                f"{stats[key] * 1000:7.2f}ms" for key in ("p50", "p95", "p99", "max")))
+        return "\n".join(lines)
+    
+    def dump(self, path):
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = path + ".tmp"
+            with open(temp_path, "w") as f:
+                json.dump({"written": datetime.datetime.now().isoformat(), "stages": self.summary()}, f, indent=2)
+            os.replace(temp_path, path)
+            logger.info(f"Pipeline timings written to {path}")
+            return True
+        except Exception as e:
+            logger.error(f"Error writing pipeline timings: {e}")
+            return False
+
+class AuthManager:
+    # Password verification for profiles. Keys are derived with PBKDF2 whose
+    # iteration count is calibrated to a target latency on this machine, and
+    # checked against a salted verifier stored in the profile.
+    MIN_ITERATIONS = 100000
+    MAX_ITERATIONS = 5000000
+    CALIBRATION_ITERATIONS = 20000
+    
+    def __init__(self, target_latency=0.3, min_iterations=MIN_ITERATIONS):
+        self.target_latency = target_latency
+        self.min_iterations = min_iterations
+        self.calibrated_iterations = None
+        self.session_nonce = os.urandom(32)
+        self.session_keys = {}  # Profile name -> (password fingerprint, derived key)
+        self.latency_histogram = LatencyHistogram()
+        self.cache_hits = 0
+    
+    @staticmethod
+    def derive_key(password, salt, iterations):
+        kdf = PBKDF2HMAC(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=salt,
+            iterations=iterations,
+        )
+        return kdf.derive(password.encode())
+    
+    def calibrate(self):
+        # Iterations that take roughly target_latency here, never fewer than min_iterations
+        if self.calibrated_iterations is None:
+            start = time.perf_counter()
+            self.derive_key("calibration", os.urandom(16), self.CALIBRATION_ITERATIONS)
+            elapsed = max(time.perf_counter() - start, 1e-6)
+            iterations = int(self.CALIBRATION_ITERATIONS * self.target_latency / elapsed)
+            self.calibrated_iterations = min(max(iterations, self.min_iterations), self.MAX_ITERATIONS)
+            logger.info(f"Calibrated PBKDF2 to {self.calibrated_iterations} iterations")
+        return self.calibrated_iterations
+    
+    def _fingerprint(self, profile, password):
+        # Cheap per-process check used to reuse a key derived earlier in this session
+        return hmac.new(self.session_nonce, f"{profile.name}\0{password}".encode(), hashlib.sha256).digest()
+    
+    def set_password(self, profile, password):
+        salt = os.urandom(16)
+        iterations = self.calibrate()
+        key = self.derive_key(password, salt, iterations)
+        profile.set_password_verifier({
+            "algorithm": "pbkdf2-sha256",
+            "salt": base64.b64encode(salt).decode(),
+            "iterations": iterations,
+            "verifier": hashlib.sha256(key).hexdigest()
+        })
+        self.session_keys[profile.name] = (self._fingerprint(profile, password), key)
+        return key
+    
+    def verify_password(self, profile, password):
+        verifier = profile.auth_verifier
+        if verifier is None:
+            return False
+        fingerprint = self._fingerprint(profile, password)
+        cached = self.session_keys.get(profile.name)
+        if cached and hmac.compare_digest(cached[0], fingerprint):
+            self.cache_hits += 1
+            return True
+        
+        key = self.derive_key(password, base64.b64decode(verifier["salt"]), verifier["iterations"])
+        if not hmac.compare_digest(hashlib.sha256(key).hexdigest(), verifier["verifier"]):
+            return False
+        self.session_keys[profile.name] = (fingerprint, key)
+        return True
+    
+    def authenticate(self, profile, password):
+        # Blocking; returns a session token, or None if the password is wrong.
+        # Profiles without a password refuse every one until set_password is called.
+        start = time.perf_counter()
+        try:
+            if profile.auth_verifier is None:
+                logger.warning(f"Refused authentication for profile {profile.name}: no password set")
+                return None
+            if not self.verify_password(profile, password):
+                return None
+            return profile.start_session()
+        finally:
+            self.latency_histogram.record(time.perf_counter() - start)
+    
+    def authenticate_async(self, profile, password, callback):
+        # Runs the key derivation on a worker thread and passes the token (or None) to callback
+        def worker():
+            try:
+                token = self.authenticate(profile, password)
+            except Exception as e:
+                logger.error(f"Error authenticating profile {profile.name}: {e}")
+                token = None
+            callback(token)
+        
+        threading.Thread(target=worker, daemon=True).start()
+    
+    def get_session_key(self, name):
+        cached = self.session_keys.get(name)
+        return cached[1] if cached else None
+    
+    def forget_session(self, name):
+        self.session_keys.pop(name, None)
+
+# On-disk profile formats, detected from the first bytes of the file
+PROFILE_FORMAT_PICKLE = 0  # Unencrypted pickle written by early versions
+PROFILE_FORMAT_FERNET_PICKLE = 1  # Fernet-encrypted pickle
+PROFILE_FORMAT_BINARY = 2  # ProfileCodec: magic header, then encrypted binary payload
+PROFILE_HEADER_SIZE = 16
+PROFILE_MAGIC = b"JRVP"
+PROFILE_FLAG_COMPRESSED = 0x01
+
+def detect_profile_format(header):
+    if header.startswith(PROFILE_MAGIC):
+        return PROFILE_FORMAT_BINARY
+    # Fernet tokens are urlsafe base64 of a 0x80 version byte, so they start with "gAAAAA"
+    if header.startswith(b"gAAAAA"):
+        return PROFILE_FORMAT_FERNET_PICKLE
+    if header[:1] == b"\x80":
+        return PROFILE_FORMAT_PICKLE
+    return None
+
+def _write_varint(buffer, value):
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+def _write_block(buffer, data):
+    _write_varint(buffer, len(data))
+    buffer += data
+
+def _read_block(data, pos):
+    length, pos = _read_varint(data, pos)
+    return data[pos:pos + length], pos + length
+
+def _pack_array(typecode, values):
+    packed = array(typecode, values)
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return packed.tobytes()
+
+def _unpack_array(typecode, data):
+    unpacked = array(typecode)
+    unpacked.frombytes(data)
+    if sys.byteorder != "little":
+        unpacked.byteswap()
+    return unpacked
+
+class ProfileCodec:
+    # Versioned, schema-driven binary encoding of UserProfile and its contacts.
+    # Every field is written as (field id, length, body), so fields that a later
+    # version adds are skipped by older readers and fields it drops keep their
+    # constructor defaults. History and contacts are stored column by column.
+    VERSION = 2
+    
+    PROFILE_FIELDS = [
+        (1, "name", "json"),
+        (2, "location", "json"),
+        (3, "preferences", "json"),
+        (4, "command_history", "history"),
+        (5, "learning_data", "json"),
+        (6, "contacts", "contacts"),
+        (7, "telegram_session", "json"),
+        (8, "authenticated", "json"),
+        (9, "auth_token", "json"),
+        (10, "auth_expiry", "datetime"),
+        (11, "journal_seq", "json"),
+        (12, "auth_verifier", "json")
+    ]
+    
+    @staticmethod
+    def _migrate_compact_feedback(fields):
+        # Version 2 stores feedback entries as [rating, comment or None, micros]
+        if 3 in fields:
+            preferences = json.loads(fields[3])
+            preferences["feedback_ratings"] = [
+                [entry["rating"], entry.get("comment") or None, iso_to_micros(entry.get("timestamp"))]
+                if isinstance(entry, dict) else entry
+                for entry in preferences.get("feedback_ratings", [])
+            ]
+            fields[3] = json.dumps(preferences).encode('utf-8')
+        return fields
+    
+    # Upgrades decoded fields from version N to N + 1
+    MIGRATIONS = {
+        1: lambda fields: ProfileCodec._migrate_compact_feedback(fields)
+    }
+    
+    @classmethod
+    def encode(cls, profile, cipher_suite, compress=True, skip=(), overrides=None):
+        # skip and overrides let a store keep some fields elsewhere
+        overrides = overrides or {}
+        body = bytearray()
+        for field_id, attribute, kind in cls.PROFILE_FIELDS:
+            if attribute in skip:
+                continue
+            value = overrides[attribute] if attribute in overrides else getattr(profile, attribute)
+            _write_varint(body, field_id)
+            _write_block(body, getattr(cls, f"_encode_{kind}")(value))
+        
+        payload = bytes(body)
+        flags = 0
+        if compress:
+            payload = zlib.compress(payload, 6)
+            flags |= PROFILE_FLAG_COMPRESSED
+        
+        # Fernet tokens are base64 text; the raw bytes are a quarter smaller
+        token = base64.urlsafe_b64decode(cipher_suite.encrypt(payload))
+        return PROFILE_MAGIC + bytes([cls.VERSION, flags]) + token
+    
+    @classmethod
+    def decode(cls, data, cipher_suite):
+        if not data.startswith(PROFILE_MAGIC):
+            raise ValueError("Not a binary profile")
+        
+        header_size = len(PROFILE_MAGIC) + 2
+        version, flags = data[len(PROFILE_MAGIC)], data[len(PROFILE_MAGIC) + 1]
+        if version > cls.VERSION:
+            raise ValueError(f"Profile format version {version} is newer than supported version {cls.VERSION}")
+        
+        payload = cipher_suite.decrypt(base64.urlsafe_b64encode(data[header_size:]))
+        if flags & PROFILE_FLAG_COMPRESSED:
+            payload = zlib.decompress(payload)
+        
+        fields = {}
+        pos = 0
+        while pos < len(payload):
+            field_id, pos = _read_varint(payload, pos)
+            fields[field_id], pos = _read_block(payload, pos)
+        
+        for from_version in range(version, cls.VERSION):
+            fields = cls.MIGRATIONS[from_version](fields)
+        
+        profile = UserProfile()
+        for field_id, attribute, kind in cls.PROFILE_FIELDS:
+            if field_id in fields:
+                setattr(profile, attribute, getattr(cls, f"_decode_{kind}")(fields[field_id]))
+        return profile
+    
+    @staticmethod
+    def _encode_strings(buffer, values):
+        encoded = [value.encode('utf-8') if value is not None else None for value in values]
+        _write_block(buffer, _pack_array('i', [len(value) if value is not None else -1 for value in encoded]))
+        _write_block(buffer, b"".join(value for value in encoded if value is not None))
+    
+    @staticmethod
+    def _decode_strings(data, pos):
+        lengths, pos = _read_block(data, pos)
+        blob, pos = _read_block(data, pos)
+        values = []
+        offset = 0
+        for length in _unpack_array('i', lengths):
+            if length < 0:
+                values.append(None)
+            else:
+                values.append(blob[offset:offset + length].decode('utf-8'))
+                offset += length
+        return values, pos
+    
+    @staticmethod
+    def _encode_json(value):
+        return json.dumps(value, separators=(',', ':')).encode('utf-8')
+    
+    @staticmethod
+    def _decode_json(data):
+        return json.loads(data)
+    
+    @classmethod
+    def _encode_datetime(cls, value):
+        return _pack_array('q', [to_micros(value)])
+    
+    @classmethod
+    def _decode_datetime(cls, data):
+        return from_micros(_unpack_array('q', data)[0])
+    
+    @classmethod
+    def _encode_history(cls, history):
+        # Columnar layout: a string column of commands and an int64 column of
+        # micros timestamps. Flags 0 (ISO string timestamps) and 1 (JSON) are
+        # still read from older files.
+        if not isinstance(history, CommandHistory):
+            history = CommandHistory(max(len(history), 1), history)
+        commands, timestamps = history.columns()
+        buffer = bytearray(b"\x02")
+        cls._encode_strings(buffer, commands)
+        _write_block(buffer, _pack_array('q', timestamps))
+        return bytes(buffer)
+    
+    @classmethod
+    def _decode_history(cls, data):
+        if data[0] == 1:
+            return cls._decode_json(data[1:])
+        commands, pos = cls._decode_strings(data, 1)
+        if data[0] == 2:
+            timestamps, pos = _read_block(data, pos)
+            return CommandHistory.from_columns(UserProfile.HISTORY_CAPACITY, commands, _unpack_array('q', timestamps))
+        timestamps, pos = cls._decode_strings(data, pos)
+        return [{"command": command, "timestamp": timestamp} for command, timestamp in zip(commands, timestamps)]
+    
+    @classmethod
+    def _encode_contacts(cls, contacts):
+        contacts = list(contacts.values())
+        buffer = bytearray()
+        for attribute in ("name", "telegram_username", "phone", "email"):
+            cls._encode_strings(buffer, [getattr(contact, attribute) for contact in contacts])
+        _write_block(buffer, _pack_array('q', [contact.last_contacted_micros for contact in contacts]))
+        _write_block(buffer, _pack_array('q', [contact.contact_frequency for contact in contacts]))
+        return bytes(buffer)
+    
+    @classmethod
+    def _decode_contacts(cls, data):
+        pos = 0
+        columns = []
+        for _ in range(4):
+            values, pos = cls._decode_strings(data, pos)
+            columns.append(values)
+        last_contacted, pos = _read_block(data, pos)
+        frequencies, pos = _read_block(data, pos)
+        
+        contacts = {}
+        for name, telegram_username, phone, email, contacted, frequency in zip(
+                *columns, _unpack_array('q', last_contacted), _unpack_array('q', frequencies)):
+            contact = Contact(name, telegram_username, phone, email)
+            contact.last_contacted_micros = contacted
+            contact.contact_frequency = frequency
+            contacts[name.lower()] = contact
+        return contacts
+
+class ProfileIndex:
+    # Small persisted summary (name, size, mtime, format) of every profile file.
+    # It is refreshed incrementally by mtime so listing profiles never decrypts them.
+    INDEX_FILE = ".profile_index.json"
+    VERSION = 1
+    
+    def __init__(self, profiles_dir):
+        self.profiles_dir = profiles_dir
+        self.index_path = os.path.join(profiles_dir, self.INDEX_FILE)
+        self.entries = {}  # Keyed by profile file name
+        self.load()
+    
+    def load(self):
+        try:
+            if os.path.exists(self.index_path):
+                with open(self.index_path, 'r') as f:
+                    data = json.load(f)
+                if data.get("version") == self.VERSION:
+                    self.entries = data.get("entries", {})
+        except Exception as e:
+            logger.error(f"Error loading profile index: {e}")
+            self.entries = {}
+    
+    def save(self):
+        try:
+            temp_path = self.index_path + ".tmp"
+            with open(temp_path, 'w') as f:
+                json.dump({"version": self.VERSION, "entries": self.entries}, f)
+            os.replace(temp_path, self.index_path)
+        except Exception as e:
+            logger.error(f"Error saving profile index: {e}")
+    
+    def _read_entry(self, profile_file, stat):
+        with open(os.path.join(self.profiles_dir, profile_file), 'rb') as f:
+            header = f.read(PROFILE_HEADER_SIZE)
+        return {
+            "name": profile_file[:-len(".profile")],
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "format_version": detect_profile_format(header)
+        }
+    
+    def refresh(self):
+        # Only files whose size or mtime changed since the last run are re-read,
+        # and then only their header
+        entries = {}
+        with os.scandir(self.profiles_dir) as it:
+            for entry in it:
+                if not entry.name.endswith('.profile') or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                cached = self.entries.get(entry.name)
+                if cached and cached["size"] == stat.st_size and cached["mtime"] == stat.st_mtime_ns:
+                    entries[entry.name] = cached
+                else:
+                    entries[entry.name] = self._read_entry(entry.name, stat)
+        
+        changed = entries != self.entries
+        self.entries = entries
+        if changed:
+            self.save()
+        return changed
+    
+    def update(self, profile_file):
+        # Called after a profile file is written; only persisted when a profile appears
+        stat = os.stat(os.path.join(self.profiles_dir, profile_file))
+        is_new = profile_file not in self.entries
+        self.entries[profile_file] = self._read_entry(profile_file, stat)
+        if is_new:
+            self.save()
+    
+    def remove(self, profile_file):
+        if self.entries.pop(profile_file, None) is not None:
+            self.save()
+    
+    def get(self, name):
+        return self.entries.get(f"{name}.profile")
+    
+    def names(self):
+        return sorted(entry["name"] for entry in self.entries.values())
+
+def read_profile_file(profile_path, journal_path, cipher_suite):
+    # Snapshot plus every journaled change made after it
+    with open(profile_path, 'rb') as f:
+        data = f.read()
+    
+    profile_format = detect_profile_format(data[:PROFILE_HEADER_SIZE])
+    if profile_format == PROFILE_FORMAT_BINARY:
+        profile = ProfileCodec.decode(data, cipher_suite)
+    elif profile_format == PROFILE_FORMAT_FERNET_PICKLE:
+        profile = pickle.loads(cipher_suite.decrypt(data))
+    elif profile_format == PROFILE_FORMAT_PICKLE:
+        # Unencrypted profile from an older version
+        profile = pickle.loads(data)
+    else:
+        raise ValueError("Unrecognized profile format")
+    
+    records = replay_profile_journal(profile, journal_path, cipher_suite)
+    return profile, records, profile_format
+
+def replay_profile_journal(profile, journal_path, cipher_suite):
+    if not os.path.exists(journal_path):
+        return 0
+    
+    records = 0
+    with open(journal_path, 'rb') as f:
+        for line in f:
+            try:
+                seq, change = json.loads(cipher_suite.decrypt(line.strip()))
+            except Exception as e:
+                # A torn final record from an interrupted append; nothing after it is trusted
+                logger.error(f"Stopped replaying journal for {profile.name} at a damaged record: {e}")
+                break
+            records += 1
+            # Records already folded into the snapshot are skipped
+            if seq > profile.journal_seq:
+                profile.apply_change(change)
+                profile.journal_seq = seq
+    return records
+
+class HistoryArchive:
+    # Append-only command history of one profile, one file per month. Each
+    # record is "<micros> <token>\n" with the command encrypted. A sparse index
+    # beside every partition holds the timestamp and offset of the first
+    # record in each INDEX_INTERVAL-byte block, so range queries and tail
+    # reads only touch the blocks they need. Records arrive in time order.
+    INDEX_INTERVAL = 4096
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self.indexes = {}  # partition -> (timestamps, offsets), loaded on first use
+    
+    @staticmethod
+    def _partition(micros):
+        moment = from_micros(micros)
+        return f"{moment.year:04d}-{moment.month:02d}"
+    
+    def _paths(self, partition):
+        base = os.path.join(self.directory, partition)
+        return base + ".log", base + ".idx"
+    
+    def partitions(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(file[:-4] for file in os.listdir(self.directory) if file.endswith(".log"))
+    
+    def exists(self):
+        return bool(self.partitions())
+    
+    def _load_index(self, partition):
+        if partition not in self.indexes:
+            timestamps, offsets = [], []
+            index_path = self._paths(partition)[1]
+            if os.path.exists(index_path):
+                with open(index_path, 'rb') as f:
+                    for line in f:
+                        try:
+                            micros, offset = line.split()
+                            timestamps.append(int(micros))
+                            offsets.append(int(offset))
+                        except ValueError:
+                            break
+            self.indexes[partition] = (timestamps, offsets)
+        return self.indexes[partition]
+    
+    def append(self, records, cipher_suite):
+        # records: (micros, command) pairs
+        if not records:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        
+        by_partition = {}
+        for micros, command in records:
+            by_partition.setdefault(self._partition(micros), []).append((micros, command))
+        
+        for partition, partition_records in by_partition.items():
+            log_path, index_path = self._paths(partition)
+            timestamps, offsets = self._load_index(partition)
+            lines = []
+            index_lines = []
+            with open(log_path, 'ab') as f:
+                offset = f.tell()
+                for micros, command in partition_records:
+                    if not offsets or offset - offsets[-1] >= self.INDEX_INTERVAL:
+                        timestamps.append(micros)
+                        offsets.append(offset)
+                        index_lines.append(b"%d %d\n" % (micros, offset))
+                    line = b"%d %s\n" % (micros, cipher_suite.encrypt(command.encode('utf-8')))
+                    lines.append(line)
+                    offset += len(line)
+                f.write(b"".join(lines))
+            # The index is written after the data, so it never points past it
+            if index_lines:
+                with open(index_path, 'ab') as f:
+                    f.write(b"".join(index_lines))
+    
+    def _read(self, partition, start_offset=0, end_offset=None):
+        with open(self._paths(partition)[0], 'rb') as f:
+            f.seek(start_offset)
+            data = f.read() if end_offset is None else f.read(end_offset - start_offset)
+        
+        records = []
+        for line in data.splitlines():
+            try:
+                micros, token = line.split(b" ", 1)
+                records.append((int(micros), token))
+            except ValueError:
+                # Torn record from an interrupted append
+                continue
+        return records
+    
+    def records(self, cipher_suite):
+        # Every (micros, command), oldest first
+        for partition in self.partitions():
+            for micros, token in self._read(partition):
+                yield micros, cipher_suite.decrypt(token).decode('utf-8')
+    
+    @staticmethod
+    def _entry(micros, token, cipher_suite):
+        return {
+            "command": cipher_suite.decrypt(token).decode('utf-8'),
+            "timestamp": micros_to_iso(micros)
+        }
+    
+    def range(self, start, end, cipher_suite):
+        # Entries with start <= timestamp < end, oldest first
+        start_micros, end_micros = to_micros(start), to_micros(end)
+        first, last = self._partition(start_micros), self._partition(end_micros)
+        
+        entries = []
+        for partition in self.partitions():
+            if not first <= partition <= last:
+                continue
+            timestamps, offsets = self._load_index(partition)
+            # Start at the last block that begins before `start`, stop at the first that begins at or after `end`
+            position = bisect.bisect_left(timestamps, start_micros) - 1
+            end_position = bisect.bisect_left(timestamps, end_micros)
+            start_offset = offsets[position] if position >= 0 else 0
+            end_offset = offsets[end_position] if end_position < len(offsets) else None
+            for micros, token in self._read(partition, start_offset, end_offset):
+                if start_micros <= micros < end_micros:
+                    entries.append(self._entry(micros, token, cipher_suite))
+        return entries
+    
+    def recent(self, count, cipher_suite):
+        # Newest first, reading blocks backwards from the end of the newest partition
+        entries = []
+        for partition in reversed(self.partitions()):
+            offsets = self._load_index(partition)[1]
+            bounds = ([0] if not offsets or offsets[0] != 0 else []) + offsets + [None]
+            for i in range(len(bounds) - 2, -1, -1):
+                for micros, token in reversed(self._read(partition, bounds[i], bounds[i + 1])):
+                    entries.append(self._entry(micros, token, cipher_suite))
+                    if len(entries) == count:
+                        return entries
+        return entries
+
+class WriteBehindScheduler:
+    # Coalesces write requests for the same key made within `delay` seconds into
+    # a single write performed on a background thread
+    def __init__(self, write, delay=2.0):
+        self.write = write
+        self.delay = delay
+        self.pending = {}  # key -> [item, due time]
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stats = {"requested": 0, "coalesced": 0, "executed": 0, "failed": 0}
+    
+    def request(self, key, item):
+        with self.condition:
+            self.stats["requested"] += 1
+            if key in self.pending:
+                # Keep the original due time so a steady stream of requests still gets written
+                self.stats["coalesced"] += 1
+                self.pending[key][0] = item
+            else:
+                self.pending[key] = [item, time.monotonic() + self.delay]
+            
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+    
+    def cancel(self, key):
+        with self.condition:
+            return self.pending.pop(key, None) is not None
+    
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                
+                key, (item, due) = min(self.pending.items(), key=lambda entry: entry[1][1])
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+                
+                del self.pending[key]
+                self.in_flight += 1
+            
+            try:
+                # A write may also report failure by returning False
+                executed = self.write(item) is not False
+            except Exception as e:
+                logger.error(f"Error in background write for {key}: {e}")
+                executed = False
+            
+            with self.condition:
+                self.in_flight -= 1
+                self.stats["executed" if executed else "failed"] += 1
+                self.condition.notify_all()
+    
+    def flush(self, timeout=None):
+        # Makes every pending write due now and waits for them; returns False if
+        # the deadline passed first
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.condition:
+            now = time.monotonic()
+            for entry in self.pending.values():
+                entry[1] = now
+            self.condition.notify_all()
+            
+            while self.pending or self.in_flight:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+# Error reported by the process pool workers for a profile the key cannot decrypt
+UNREADABLE_PROFILE = "not readable with this key"
+
+def _worker_error(e):
+    # The error a worker returns is never empty: str(InvalidToken()) is ""
+    return UNREADABLE_PROFILE if type(e).__name__ == "InvalidToken" else repr(e)
+
+def _bulk_load_profile(task):
+    # Process pool worker: decrypt and decode one profile
+    name, profile_path, journal_path, key = task
+    try:
+        profile, records, profile_format = read_profile_file(profile_path, journal_path, Fernet(key))
+        return name, (profile, records, profile_format), None
+    except Exception as e:
+        return name, None, _worker_error(e)
+
+def _read_file_history(profile_path, journal_path, archive_dir, key):
+    # History of a FileProfileStore profile: the archive, or the in-profile ring for
+    # profiles saved before archives existed
+    cipher_suite = Fernet(key)
+    archive = HistoryArchive(archive_dir)
+    if archive.exists():
+        return [(micros, command, True) for micros, command in archive.records(cipher_suite)]
+    profile = read_profile_file(profile_path, journal_path, cipher_suite)[0]
+    commands, timestamps = profile.command_history.columns()
+    return [(timestamp, command, True) for command, timestamp in zip(commands, timestamps)
+            if command is not None and timestamp != MISSING_TIME]
+
+def _read_sqlite_history(db_path, key, name):
+    cipher_suite = Fernet(key)
+    connection = sqlite3.connect(db_path)
+    try:
+        rows = connection.execute("SELECT timestamp, command FROM history WHERE profile = ? ORDER BY timestamp, rowid",
+                                  (name,)).fetchall()
+    finally:
+        connection.close()
+    return [(timestamp, cipher_suite.decrypt(command).decode('utf-8'), True) for timestamp, command in rows]
+
+# Lines of jarvis.log that name a command: failed commands, and apps opened
+JARVIS_LOG_COMMANDS = [
+    (re.compile(r"Error processing command: (.+?): "), lambda match: match.group(1), False),
+    (re.compile(r"Launched application: (\S+)"), lambda match: f"open {match.group(1)}", True)
+]
+
+def _read_log_commands(log_path):
+    records = []
+    with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            for pattern, command, success in JARVIS_LOG_COMMANDS:
+                match = pattern.search(line)
+                if match:
+                    try:
+                        when = datetime.datetime.strptime(line[:23], "%Y-%m-%d %H:%M:%S,%f")
+                    except ValueError:
+                        break
+                    records.append((to_micros(when), command(match), success))
+                    break
+    return records
+
+def _bulk_learn_history(task):
+    # Process pool worker: read one profile's history and count it into a fresh
+    # LearningSystem. The last `holdout` of the labelled commands is predicted
+    # before it is learned, with the keyword that labelled it taken out, since
+    # prediction is only used for commands without one.
+    name, reader, args, keywords, options, holdout = task
+    try:
+        records = reader(*args)
+        router = IntentRouter(keywords)
+        labelled = []
+        for micros, command, success in records:
+            command = command.lower()
+            command_type = router.route(command)
+            if command_type:
+                labelled.append((micros, command, command_type, success))
+        
+        learning = LearningSystem(data_file=None, **options)
+        split = len(labelled) - int(len(labelled) * holdout)
+        correct = 0
+        for position, (micros, command, command_type, success) in enumerate(labelled):
+            if position >= split and learning.predict_command_type(command.replace(command_type, " ")) == command_type:
+                correct += 1
+            learning.learn_from_command(command, command_type, success, micros)
+        
+        return name, {"command_patterns": learning.command_patterns, "decay_epoch": learning.decay_epoch,
+                      "commands": len(records), "labelled": len(labelled),
+                      "tested": len(labelled) - split, "correct": correct}, None
+    except Exception as e:
+        return name, None, _worker_error(e)
+
+def _rotate_token(multi_fernet, token):
+    return multi_fernet.rotate(token)
+
+def _bulk_rotate_profile(task):
+    # Process pool worker: re-encrypt one profile, its journal and its history archive under the new key.
+    # Results go to *.rotating files; the caller swaps them in once every profile succeeded.
+    name, profile_path, journal_path, archive_dir, old_key, new_key = task
+    log_paths = [os.path.join(archive_dir, partition + ".log") for partition in HistoryArchive(archive_dir).partitions()]
+    try:
+        # Files already under the new key are accepted as well
+        multi_fernet = MultiFernet([Fernet(new_key), Fernet(old_key)])
+        rotated = []
+        
+        with open(profile_path, 'rb') as f:
+            data = f.read()
+        profile_format = detect_profile_format(data[:PROFILE_HEADER_SIZE])
+        if profile_format == PROFILE_FORMAT_BINARY:
+            header_size = len(PROFILE_MAGIC) + 2
+            token = _rotate_token(multi_fernet, base64.urlsafe_b64encode(data[header_size:]))
+            data = data[:header_size] + base64.urlsafe_b64decode(token)
+        elif profile_format == PROFILE_FORMAT_FERNET_PICKLE:
+            data = _rotate_token(multi_fernet, data)
+        else:
+            # Unencrypted legacy profiles are encrypted when they are next loaded and saved
+            data = None
+        
+        if data is not None:
+            with open(profile_path + ".rotating", 'wb') as f:
+                f.write(data)
+            rotated.append(profile_path)
+        
+        if os.path.exists(journal_path):
+            with open(journal_path, 'rb') as f:
+                lines = [_rotate_token(multi_fernet, line.strip()) + b"\n" for line in f if line.strip()]
+            with open(journal_path + ".rotating", 'wb') as f:
+                f.write(b"".join(lines))
+            rotated.append(journal_path)
+        
+        # Rotated tokens keep their length, so the archive's offset index stays valid
+        for log_path in log_paths:
+            lines = []
+            with open(log_path, 'rb') as f:
+                for line in f:
+                    micros, separator, token = line.rstrip(b"\n").partition(b" ")
+                    if separator and micros.isdigit():
+                        line = micros + b" " + _rotate_token(multi_fernet, token) + b"\n"
+                    lines.append(line)
+            with open(log_path + ".rotating", 'wb') as f:
+                f.write(b"".join(lines))
+            rotated.append(log_path)
+        
+        return name, rotated, None
+    except Exception as e:
+        # Nothing half-written is left behind for a profile that failed
+        for path in [profile_path, journal_path] + log_paths:
+            if os.path.exists(path + ".rotating"):
+                os.remove(path + ".rotating")
+        return name, None, _worker_error(e)
+
+class BulkProfileEngine:
+    # Runs per-profile work (decrypting, re-keying) across a process pool so
+    # bulk operations on many profiles scale with the number of cores
+    def __init__(self, max_workers=None, serial_threshold=8):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.serial_threshold = serial_threshold
+    
+    def run(self, worker, tasks, progress=None):
+        # Yields (name, result, error) in completion order and reports progress
+        total = len(tasks)
+        if total <= self.serial_threshold or self.max_workers == 1:
+            # Not worth the pool start-up cost
+            for completed, task in enumerate(tasks, 1):
+                outcome = worker(task)
+                if progress:
+                    progress(completed, total, outcome[0])
+                yield outcome
+            return
+        
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(worker, task) for task in tasks]
+            for completed, future in enumerate(as_completed(futures), 1):
+                outcome = future.result()
+                if progress:
+                    progress(completed, total, outcome[0])
+                yield outcome
+    
+    def load_profiles(self, profile_paths, key, progress=None):
+        # profile_paths maps name -> (profile path, journal path, history archive directory)
+        tasks = [(name, paths[0], paths[1], key) for name, paths in profile_paths.items()]
+        loaded = {}
+        for name, result, error in self.run(_bulk_load_profile, tasks, progress):
+            if error is not None:
+                logger.error(f"Error loading profile {name}.profile: {error}")
+            else:
+                loaded[name] = result
+        return loaded
+    
+    def rotate_key(self, profile_paths, old_key, new_key, progress=None):
+        # Profiles neither key can decrypt are skipped: they were unreadable
+        # before and rotating cannot make them worse
+        tasks = [(name, *paths, old_key, new_key) for name, paths in profile_paths.items()]
+        rotated = []
+        failed = []
+        unreadable = []
+        try:
+            for name, paths, error in self.run(_bulk_rotate_profile, tasks, progress):
+                if error is None:
+                    rotated.extend(paths)
+                elif error == UNREADABLE_PROFILE:
+                    unreadable.append(name)
+                else:
+                    logger.error(f"Error re-encrypting profile {name}: {error}")
+                    failed.append(name)
+            
+            if failed:
+                # Leave every file under the old key rather than end up with a mix
+                return False
+            
+            for path in rotated:
+                os.replace(path + ".rotating", path)
+        finally:
+            for path in rotated:
+                if os.path.exists(path + ".rotating"):
+                    os.remove(path + ".rotating")
+        
+        if unreadable:
+            logger.warning(f"Skipped {len(unreadable)} profiles not readable with the old key: {', '.join(sorted(unreadable))}")
+        logger.info(f"Re-encrypted {len(profile_paths) - len(unreadable)} profiles with a new key")
+        return True
+
+def estimate_size(objects):
+    # Approximate bytes held by objects and everything they reference. Objects
+    # reached more than once (interned strings, shared records) count once.
+    seen = set()
+    stack = list(objects)
+    total = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif isinstance(item, (str, bytes, int, float, array, np.ndarray)) or item is None:
+            continue
+        elif hasattr(item, "__dict__"):
+            stack.append(item.__dict__)
+        elif hasattr(type(item), "__slots__"):
+            stack.extend(getattr(item, slot) for slot in type(item).__slots__ if hasattr(item, slot))
+    return total
+
+class ProfileStore(ABC):
+    # Where profiles are kept. ProfileManager owns the loaded profiles and the
+    # write-behind scheduling; a store only reads and writes them.
+    def __init__(self, encryption_key=None):
+        self.set_key(encryption_key or Fernet.generate_key())
+        self.lock = threading.RLock()
+    
+    def set_key(self, encryption_key):
+        self.encryption_key = encryption_key
+        self.cipher_suite = Fernet(encryption_key)
+    
+    def refresh(self):
+        pass
+    
+    @abstractmethod
+    def list_names(self):
+        pass
+    
+    @abstractmethod
+    def exists(self, name):
+        pass
+    
+    @abstractmethod
+    def load(self, name):
+        # Profiles that should be rewritten (e.g. in an old format) come back dirty
+        pass
+    
+    def load_many(self, names, progress=None):
+        loaded = {}
+        for completed, name in enumerate(names, 1):
+            try:
+                loaded[name] = self.load(name)
+            except Exception as e:
+                logger.error(f"Error loading profile {name}: {e}")
+            if progress:
+                progress(completed, len(names), name)
+        return loaded
+    
+    @abstractmethod
+    def write_snapshot(self, profile, changes=()):
+        # changes are the pending changes the snapshot supersedes
+        pass
+    
+    @abstractmethod
+    def write_changes(self, profile, changes):
+        pass
+    
+    @abstractmethod
+    def delete(self, name):
+        pass
+    
+    @abstractmethod
+    def rename(self, name, new_name):
+        # Moves the profile with everything stored for it, history included
+        pass
+    
+    @abstractmethod
+    def history_page(self, name, offset=0, limit=50):
+        # Saved history, newest first
+        pass
+    
+    @abstractmethod
+    def history_range(self, name, start, end):
+        pass
+    
+    def compact(self, name):
+        return True
+    
+    @abstractmethod
+    def rotate_key(self, new_key, progress=None):
+        pass
+    
+    @abstractmethod
+    def history_sources(self, names):
+        # name -> (reader, args): a module-level function a worker process can call
+        # as reader(*args) to get the profile's whole history as (micros, command, success)
+        pass
+
+class FileProfileStore(ProfileStore):
+    # One encrypted snapshot file per profile plus an append-only journal of
+    # the changes made since
+    def __init__(self, profiles_dir="profiles", encryption_key=None, compress=True, journal_compact_threshold=200):
+        super().__init__(encryption_key)
+        self.profiles_dir = profiles_dir
+        self.compress = compress
+        self.journal_compact_threshold = journal_compact_threshold
+        self.journal_sizes = {}  # Number of records in each profile's journal
+        self.archives = {}
+        self.bulk_engine = BulkProfileEngine()
+        
+        # Create profiles directory if it doesn't exist
+        if not os.path.exists(profiles_dir):
+            os.makedirs(profiles_dir)
+        
+        self.index = ProfileIndex(profiles_dir)
+    
+    def _profile_path(self, name):
+        return os.path.join(self.profiles_dir, f"{name}.profile")
+    
+    def _journal_path(self, name):
+        return os.path.join(self.profiles_dir, f"{name}.journal")
+    
+    def _archive_path(self, name):
+        return os.path.join(self.profiles_dir, f"{name}.history")
+    
+    def _archive(self, name):
+        if name not in self.archives:
+            self.archives[name] = HistoryArchive(self._archive_path(name))
+        return self.archives[name]
+    
+    def _archive_history(self, name, changes):
+        self._archive(name).append([(iso_to_micros(change[2]), change[1])
+                                    for change in changes if change[0] == "history"], self.cipher_suite)
+    
+    def _profile_paths(self, names):
+        return {name: (self._profile_path(name), self._journal_path(name), self._archive_path(name)) for name in names}
+    
+    def refresh(self):
+        # Only the index is refreshed; profiles are decrypted on demand
+        self.index.refresh()
+    
+    def list_names(self):
+        return self.index.names()
+    
+    def exists(self, name):
+        return os.path.exists(self._profile_path(name))
+    
+    def load(self, name):
+        with self.lock:
+            profile, records, profile_format = read_profile_file(
+                self._profile_path(name), self._journal_path(name), self.cipher_suite)
+        self.journal_sizes[name] = records
+        if profile_format != PROFILE_FORMAT_BINARY:
+            # Pickled profiles are rewritten in the binary format on the next save
+            logger.info(f"Migrating profile {name} to binary format")
+            profile.mark_dirty()
+        profile.backing = self
+        return profile
+    
+    def load_many(self, names, progress=None):
+        # Decrypted in parallel
+        with self.lock:
+            loaded = self.bulk_engine.load_profiles(self._profile_paths(names), self.encryption_key, progress)
+        
+        profiles = {}
+        for name, (profile, records, profile_format) in loaded.items():
+            self.journal_sizes[name] = records
+            if profile_format != PROFILE_FORMAT_BINARY:
+                profile.mark_dirty()
+            profile.backing = self
+            profiles[name] = profile
+        return profiles
+    
+    def write_snapshot(self, profile, changes=()):
+        with self.lock:
+            profile_file = f"{profile.name}.profile"
+            profile_path = self._profile_path(profile.name)
+            
+            # History goes to the archive before the snapshot that drops it from the journal
+            archive = self._archive(profile.name)
+            if archive.exists():
+                self._archive_history(profile.name, changes)
+            else:
+                commands, timestamps = profile.command_history.columns()
+                archive.append([(timestamp, command) for command, timestamp in zip(commands, timestamps)
+                                if command is not None and timestamp != MISSING_TIME], self.cipher_suite)
+            profile.backing = self
+            
+            encrypted_data = ProfileCodec.encode(profile, self.cipher_suite, self.compress)
+            
+            temp_path = profile_path + ".tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(encrypted_data)
+            os.replace(temp_path, profile_path)
+            
+            # The snapshot records journal_seq, so a journal left behind by a crash here is skipped on load
+            journal_path = self._journal_path(profile.name)
+            if os.path.exists(journal_path):
+                os.remove(journal_path)
+            self.journal_sizes[profile.name] = 0
+            self.index.update(profile_file)
+    
+    def write_changes(self, profile, changes):
+        with self.lock:
+            self._archive_history(profile.name, changes)
+            lines = []
+            for change in changes:
+                profile.journal_seq += 1
+                record = json.dumps([profile.journal_seq, change]).encode()
+                lines.append(self.cipher_suite.encrypt(record) + b"\n")
+            
+            with open(self._journal_path(profile.name), 'ab') as f:
+                f.write(b"".join(lines))
+            self.journal_sizes[profile.name] = self.journal_sizes.get(profile.name, 0) + len(lines)
+            
+            if self.journal_sizes[profile.name] > self.journal_compact_threshold:
+                self.compact(profile.name)
+    
+    def compact(self, name):
+        # Folds the journal into a new snapshot. It is rebuilt from disk rather
+        # than from the live profile so it never races with ongoing commands.
+        try:
+            with self.lock:
+                if self.journal_sizes.get(name, 0) == 0:
+                    return True
+                profile, records, _ = read_profile_file(
+                    self._profile_path(name), self._journal_path(name), self.cipher_suite)
+                self.archives.pop(name, None)
+                self.write_snapshot(profile)
+            logger.info(f"Compacted journal of {records} records for profile: {name}")
+            return True
+        except Exception as e:
+            logger.error(f"Error compacting profile {name}: {e}")
+            return False
+    
+    def delete(self, name):
+        with self.lock:
+            for path in (self._profile_path(name), self._journal_path(name)):
+                if os.path.exists(path):
+                    os.remove(path)
+            if os.path.isdir(self._archive_path(name)):
+                shutil.rmtree(self._archive_path(name))
+            self.archives.pop(name, None)
+            self.journal_sizes.pop(name, None)
+            self.index.remove(f"{name}.profile")
+    
+    def rename(self, name, new_name):
+        with self.lock:
+            profile, _, _ = read_profile_file(self._profile_path(name), self._journal_path(name), self.cipher_suite)
+            profile.name = new_name
+            # The archive moves as is, so the snapshot below has no history to add to it
+            self.archives.pop(name, None)
+            if os.path.isdir(self._archive_path(name)):
+                os.replace(self._archive_path(name), self._archive_path(new_name))
+            self.write_snapshot(profile)
+            self.delete(name)
+    
+    def history_page(self, name, offset=0, limit=50):
+        with self.lock:
+            return self._archive(name).recent(offset + limit, self.cipher_suite)[offset:]
+    
+    def history_range(self, name, start, end):
+        with self.lock:
+            return self._archive(name).range(start, end, self.cipher_suite)
+    
+    def history_sources(self, names):
+        return {name: (_read_file_history, (*paths, self.encryption_key))
+                for name, paths in self._profile_paths(names).items()}
+    
+    def rotate_key(self, new_key, progress=None):
+        # Either every file is rotated or none is
+        new_cipher_suite = Fernet(new_key)
+        with self.lock:
+            self.index.refresh()
+            if not self.bulk_engine.rotate_key(self._profile_paths(self.index.names()),
+                                               self.encryption_key, new_key, progress):
+                return False
+            self.encryption_key = new_key
+            self.cipher_suite = new_cipher_suite
+            self.archives.clear()
+            self.index.refresh()
+        return True
+
+class SQLiteProfileStore(ProfileStore):
+    # Keeps each profile's small fields in one encrypted row and its history,
+    # contacts and command counts in indexed tables, so long histories and big
+    # address books are paged from disk instead of held in memory. Contact
+    # rows are encrypted and found through keyed hashes of the lowercased
+    # name and Telegram username.
+    RECENT_HISTORY = 100  # History entries loaded with the profile
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS profiles (
+            name TEXT PRIMARY KEY,
+            core BLOB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS history (
+            profile TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            command BLOB NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS history_by_time ON history (profile, timestamp);
+        CREATE TABLE IF NOT EXISTS contacts (
+            profile TEXT NOT NULL,
+            name_key BLOB NOT NULL,
+            telegram_key BLOB,
+            data BLOB NOT NULL,
+            PRIMARY KEY (profile, name_key)
+        );
+        CREATE INDEX IF NOT EXISTS contacts_by_telegram ON contacts (profile, telegram_key);
+        CREATE TABLE IF NOT EXISTS frequent_commands (
+            profile TEXT NOT NULL,
+            command_type TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (profile, command_type)
+        );
+        CREATE INDEX IF NOT EXISTS frequent_by_count ON frequent_commands (profile, count);
+    """
+    
+    def __init__(self, db_path=os.path.join("profiles", "profiles.db"), encryption_key=None, compress=True):
+        super().__init__(encryption_key)
+        self.db_path = db_path
+        self.compress = compress
+        
+        directory = os.path.dirname(db_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        
+        # Used from the UI thread and the write-behind thread, always under self.lock
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.executescript(self.SCHEMA)
+    
+    @staticmethod
+    def _blind_index(encryption_key, value):
+        if not value:
+            return None
+        index_key = hashlib.sha256(b"jarvis-contact-index" + encryption_key).digest()
+        return hmac.new(index_key, value.lower().encode('utf-8'), hashlib.sha256).digest()
+    
+    def _contact_row(self, name, contact_fields, encryption_key=None, cipher_suite=None):
+        encryption_key = encryption_key or self.encryption_key
+        cipher_suite = cipher_suite or self.cipher_suite
+        telegram_username = (contact_fields["telegram_username"] or "").lstrip('@')
+        return (
+            name,
+            self._blind_index(encryption_key, contact_fields["name"]),
+            self._blind_index(encryption_key, telegram_username),
+            cipher_suite.encrypt(json.dumps(contact_fields).encode('utf-8'))
+        )
+    
+    def _contact_from_row(self, data):
+        return Contact.from_dict(json.loads(self.cipher_suite.decrypt(data)))
+    
+    def _history_row(self, name, entry):
+        timestamp = iso_to_micros(entry["timestamp"])
+        return name, timestamp, self.cipher_suite.encrypt(entry["command"].encode('utf-8'))
+    
+    def _history_from_row(self, timestamp, command):
+        return {
+            "command": self.cipher_suite.decrypt(command).decode('utf-8'),
+            "timestamp": micros_to_iso(timestamp)
+        }
+    
+    def _encode_core(self, profile):
+        # History, contacts and command counts live in their own tables
+        preferences = dict(profile.preferences)
+        preferences.pop("frequent_commands", None)
+        return ProfileCodec.encode(profile, self.cipher_suite, self.compress,
+                                   skip=("command_history", "contacts"),
+                                   overrides={"preferences": preferences})
+    
+    def list_names(self):
+        with self.lock:
+            return [row[0] for row in self.connection.execute("SELECT name FROM profiles ORDER BY name")]
+    
+    def exists(self, name):
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM profiles WHERE name = ?", (name,)).fetchone() is not None
+    
+    def load(self, name):
+        with self.lock:
+            row = self.connection.execute("SELECT core FROM profiles WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                raise KeyError(f"No profile named {name}")
+            profile = ProfileCodec.decode(row[0], self.cipher_suite)
+            profile.preferences["frequent_commands"] = dict(self.connection.execute(
+                "SELECT command_type, count FROM frequent_commands WHERE profile = ?", (name,)))
+            profile.command_history = self.history_page(name, 0, self.RECENT_HISTORY)[::-1]
+        
+        # Contacts are fetched as they are looked up
+        profile.contacts = {}
+        profile.contacts_complete = False
+        profile.backing = self
+        return profile
+    
+    def write_snapshot(self, profile, changes=()):
+        with self.lock, self.connection:
+            name = profile.name
+            if profile.backing is self:
+                self._apply_changes(profile, changes)
+            self.connection.execute("INSERT OR REPLACE INTO profiles (name, core) VALUES (?, ?)",
+                                    (name, self._encode_core(profile)))
+            self.connection.execute("DELETE FROM frequent_commands WHERE profile = ?", (name,))
+            self.connection.executemany(
+                "INSERT INTO frequent_commands (profile, command_type, count) VALUES (?, ?, ?)",
+                [(name, command_type, count) for command_type, count in profile.preferences["frequent_commands"].items()])
+            
+            if profile.backing is not self:
+                # A new or renamed profile: what it holds in memory is all there is
+                self.connection.execute("DELETE FROM history WHERE profile = ?", (name,))
+                self.connection.execute("DELETE FROM contacts WHERE profile = ?", (name,))
+                self.connection.executemany(
+                    "INSERT INTO history (profile, timestamp, command) VALUES (?, ?, ?)",
+                    [self._history_row(name, entry) for entry in profile.command_history])
+                profile.backing = self
+            
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO contacts (profile, name_key, telegram_key, data) VALUES (?, ?, ?, ?)",
+                [self._contact_row(name, contact.to_dict()) for contact in list(profile.contacts.values())])
+    
+    def write_changes(self, profile, changes):
+        with self.lock, self.connection:
+            if self._apply_changes(profile, changes):
+                self.connection.execute("UPDATE profiles SET core = ? WHERE name = ?",
+                                        (self._encode_core(profile), profile.name))
+    
+    def _apply_changes(self, profile, changes):
+        # Journaled changes become row-level writes. Returns whether the small
+        # core row needs rewriting for the rest.
+        name = profile.name
+        core_changed = False
+        for change in changes:
+            op = change[0]
+            if op == "history":
+                self.connection.execute("INSERT INTO history (profile, timestamp, command) VALUES (?, ?, ?)",
+                                        self._history_row(name, {"command": change[1], "timestamp": change[2]}))
+            elif op == "frequent_command":
+                self.connection.execute(
+                    "INSERT INTO frequent_commands (profile, command_type, count) VALUES (?, ?, 1) "
+                    "ON CONFLICT (profile, command_type) DO UPDATE SET count = count + 1",
+                    (name, change[1]))
+            elif op == "add_contact":
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO contacts (profile, name_key, telegram_key, data) VALUES (?, ?, ?, ?)",
+                    self._contact_row(name, change[1]))
+            elif op == "contacted":
+                contact = profile.contacts.get(change[1].lower())
+                if contact:
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO contacts (profile, name_key, telegram_key, data) VALUES (?, ?, ?, ?)",
+                        self._contact_row(name, contact.to_dict()))
+            elif op == "remove_contact":
+                self.connection.execute("DELETE FROM contacts WHERE profile = ? AND name_key = ?",
+                                        (name, self._blind_index(self.encryption_key, change[1])))
+            else:
+                core_changed = True
+        return core_changed
+    
+    def delete(self, name):
+        with self.lock, self.connection:
+            for table, column in (("profiles", "name"), ("history", "profile"),
+                                  ("contacts", "profile"), ("frequent_commands", "profile")):
+                self.connection.execute(f"DELETE FROM {table} WHERE {column} = ?", (name,))
+    
+    def rename(self, name, new_name):
+        # History, contacts and counts are keyed by profile name only, so they
+        # move in place; the core row is re-encoded for the new name
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT core FROM profiles WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                raise KeyError(f"No profile named {name}")
+            profile = ProfileCodec.decode(row[0], self.cipher_suite)
+            profile.name = new_name
+            for table, column in (("profiles", "name"), ("history", "profile"),
+                                  ("contacts", "profile"), ("frequent_commands", "profile")):
+                self.connection.execute(f"UPDATE {table} SET {column} = ? WHERE {column} = ?", (new_name, name))
+            self.connection.execute("UPDATE profiles SET core = ? WHERE name = ?", (self._encode_core(profile), new_name))
+    
+    def history_page(self, name, offset=0, limit=50):
+        # Newest first
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT timestamp, command FROM history WHERE profile = ? "
+                "ORDER BY timestamp DESC, rowid DESC LIMIT ? OFFSET ?", (name, limit, offset)).fetchall()
+        return [self._history_from_row(timestamp, command) for timestamp, command in rows]
+    
+    def history_range(self, name, start, end):
+        # Entries with start <= timestamp < end, oldest first
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT timestamp, command FROM history WHERE profile = ? AND timestamp >= ? AND timestamp < ? "
+                "ORDER BY timestamp, rowid",
+                (name, to_micros(start), to_micros(end))).fetchall()
+        return [self._history_from_row(timestamp, command) for timestamp, command in rows]
+    
+    def history_sources(self, names):
+        return {name: (_read_sqlite_history, (self.db_path, self.encryption_key, name)) for name in names}
+    
+    def find_contact(self, name, contact_name):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT data FROM contacts WHERE profile = ? AND name_key = ?",
+                (name, self._blind_index(self.encryption_key, contact_name))).fetchone()
+        return self._contact_from_row(row[0]) if row else None
+    
+    def find_contact_by_telegram(self, name, telegram_username):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT data FROM contacts WHERE profile = ? AND telegram_key = ?",
+                (name, self._blind_index(self.encryption_key, telegram_username.lstrip('@')))).fetchone()
+        return self._contact_from_row(row[0]) if row else None
+    
+    def contacts_page(self, name, offset=0, limit=50):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT data FROM contacts WHERE profile = ? ORDER BY rowid LIMIT ? OFFSET ?",
+                (name, limit, offset)).fetchall()
+        return [self._contact_from_row(row[0]) for row in rows]
+    
+    def all_contacts(self, name):
+        with self.lock:
+            rows = self.connection.execute("SELECT data FROM contacts WHERE profile = ?", (name,)).fetchall()
+        return [self._contact_from_row(row[0]) for row in rows]
+    
+    def rotate_key(self, new_key, progress=None):
+        # One transaction, so a failure leaves everything under the old key
+        new_cipher_suite = Fernet(new_key)
+        multi_fernet = MultiFernet([new_cipher_suite, self.cipher_suite])
+        header_size = len(PROFILE_MAGIC) + 2
+        
+        with self.lock, self.connection:
+            names = self.list_names()
+            for completed, name in enumerate(names, 1):
+                core, = self.connection.execute("SELECT core FROM profiles WHERE name = ?", (name,)).fetchone()
+                token = multi_fernet.rotate(base64.urlsafe_b64encode(core[header_size:]))
+                self.connection.execute("UPDATE profiles SET core = ? WHERE name = ?",
+                                        (core[:header_size] + base64.urlsafe_b64decode(token), name))
+                
+                self.connection.executemany("UPDATE history SET command = ? WHERE rowid = ?", [
+                    (multi_fernet.rotate(command), rowid) for rowid, command in
+                    self.connection.execute("SELECT rowid, command FROM history WHERE profile = ?", (name,)).fetchall()])
+                
+                contacts = self.connection.execute("SELECT rowid, data FROM contacts WHERE profile = ?", (name,)).fetchall()
+                for rowid, data in contacts:
+                    fields = json.loads(multi_fernet.decrypt(data))
+                    _, name_key, telegram_key, new_data = self._contact_row(name, fields, new_key, new_cipher_suite)
+                    self.connection.execute("UPDATE contacts SET name_key = ?, telegram_key = ?, data = ? WHERE rowid = ?",
+                                            (name_key, telegram_key, new_data, rowid))
+                
+                if progress:
+                    progress(completed, len(names), name)
+            self.set_key(new_key)
+        return True
 
 class ProfileManager:
-    def __init__(self, profiles_dir="profiles", encryption_key=None):
+    def __init__(self, profiles_dir="profiles", encryption_key=None, journal_compact_threshold=200, save_delay=2.0,
+                 compress_profiles=True, store=None, memory_budget=64 * 1024 * 1024, backend="file"):
         self.profiles_dir = profiles_dir
         self.current_profile = None
-        self.profiles = {}
-        self.encryption_key = encryption_key or Fernet.generate_key()
-        self.cipher_suite = Fernet(self.encryption_key)
-        
-        # Create profiles directory if it doesn't exist
-        if not os.path.exists(profiles_dir):
-            os.makedirs(profiles_dir)
+        # Profiles that have been decrypted, least recently used first. Beyond
+        # memory_budget bytes, inactive ones are saved and dropped, and loaded
+        # again from the store when next used.
+        self.profiles = OrderedDict()
+        self.memory_budget = memory_budget
+        self.resident_bytes = {}  # name -> estimated bytes, or None once saved since last measured
+        self.evictions = 0
+        self.residency_lock = threading.RLock()
+        if store is None:
+            # backend picks the store when none is given: "file" or "sqlite"
+            if backend == "sqlite":
+                store = SQLiteProfileStore(os.path.join(profiles_dir, "profiles.db"), encryption_key, compress_profiles)
+            else:
+                store = FileProfileStore(profiles_dir, encryption_key, compress_profiles, journal_compact_threshold)
+        self.store = store
+        self.writer = WriteBehindScheduler(self._write_profile, save_delay)
+        self.skipped_saves = 0  # save_profile calls for profiles with nothing to write
         
         self.load_profiles()
     
+    @property
+    def encryption_key(self):
+        return self.store.encryption_key
+    
+    @property
+    def cipher_suite(self):
+        return self.store.cipher_suite
+    
     def load_profiles(self):
+        # Profiles are decrypted on demand by load_profile
         try:
-            profile_files = [f for f in os.listdir(self.profiles_dir) if f.endswith('.profile')]
-            for profile_file in profile_files:
-                profile_path = os.path.join(self.profiles_dir, profile_file)
-                try:
-                    with open(profile_path, 'rb') as f:
-                        encrypted_data = f.read()
-                        decrypted_data = self.cipher_suite.decrypt(encrypted_data)
-                        profile = pickle.loads(decrypted_data)
-                        self.profiles[profile.name] = profile
-                except Exception as e:
-                    # If decryption fails, try loading without decryption (for backward compatibility)
-                    try:
-                        with open(profile_path, 'rb') as f:
-                            profile = pickle.load(f)
-                            self.profiles[profile.name] = profile
-                    except:
-                        logger.error(f"Error loading profile {profile_file}: {e}")
-            
-            logger.info(f"Loaded {len(self.profiles)} profiles")
+            self.store.refresh()
+            logger.info(f"Found {len(self.store.list_names())} profiles")
         except Exception as e:
             logger.error(f"Error loading profiles: {e}")
     
-    def save_profile(self, profile):
+    def load_profile(self, name):
+        with self.residency_lock:
+            if name in self.profiles:
+                self.profiles.move_to_end(name)
+                return self.profiles[name]
+        
         try:
-            profile_path = os.path.join(self.profiles_dir, f"{profile.name}.profile")
-            
-            # Encrypt the profile data
-            profile_data = pickle.dumps(profile)
-            encrypted_data = self.cipher_suite.encrypt(profile_data)
-            
-            with open(profile_path, 'wb') as f:
-                f.write(encrypted_data)
+            profile = self.store.load(name)
+            self._make_resident(profile)
+            if profile.is_dirty():
+                self.save_profile(profile)
+            return profile
+        except Exception as e:
+            logger.error(f"Error loading profile {name}: {e}")
+            return None
+    
+    def _make_resident(self, profile):
+        with self.residency_lock:
+            self.profiles[profile.name] = profile
+            self.profiles.move_to_end(profile.name)
+            self.resident_bytes[profile.name] = None
+        self.trim(keep=profile.name)
+    
+    def _measure_resident(self):
+        # Sizes are measured only when needed, not on every save
+        with self.residency_lock:
+            stale = [self.profiles[name] for name, size in self.resident_bytes.items()
+                     if size is None and name in self.profiles]
+        for profile in stale:
+            size = profile.resident_size()
+            with self.residency_lock:
+                if profile.name in self.resident_bytes:
+                    self.resident_bytes[profile.name] = size
+    
+    def trim(self, keep=None):
+        # Evicts least recently used profiles until the budget is met. The
+        # current profile and `keep` always stay.
+        self._measure_resident()
+        # The store lock waits out a save in progress, so a profile whose write
+        # is about to fail is not mistaken for a clean one
+        with self.store.lock, self.residency_lock:
+            total = sum(size or 0 for size in self.resident_bytes.values())
+            for name in list(self.profiles):
+                if total <= self.memory_budget:
+                    break
+                profile = self.profiles[name]
+                if name == keep or profile is self.current_profile:
+                    continue
+                
+                # Unsaved changes go to disk first; a queued save would be redundant.
+                # A profile whose changes cannot be written stays in memory.
+                size = self.resident_bytes.get(name) or 0
+                if profile.is_dirty() and not self._write_profile(profile):
+                    continue
+                self.writer.cancel(name)
+                del self.profiles[name]
+                self.resident_bytes.pop(name, None)
+                total -= size
+                self.evictions += 1
+                logger.info(f"Evicted inactive profile {name} from memory")
+    
+    def get_residency_stats(self):
+        self._measure_resident()
+        with self.residency_lock:
+            resident = {name: size or 0 for name, size in self.resident_bytes.items()}
+        return {
+            "budget": self.memory_budget,
+            "total": sum(resident.values()),
+            "resident": resident,
+            "evictions": self.evictions
+        }
+    
+    def save_profile(self, profile, snapshot=False):
+        # Schedules a background write of the profile's changes. Saves requested
+        # within the scheduler's delay are coalesced, and clean profiles are skipped.
+        # snapshot=True is for callers that changed fields directly.
+        if snapshot:
+            profile.mark_dirty()
+        
+        if not profile.is_dirty() and self.store.exists(profile.name):
+            self.skipped_saves += 1
+            return True
+        
+        self.writer.request(profile.name, profile)
+        return True
+    
+    def _write_profile(self, profile):
+        # Writes pending changes incrementally, or a full snapshot for new
+        # profiles and profiles edited in place. If the write fails the changes
+        # go back to the profile, which stays dirty.
+        changes = None
+        snapshot = False
+        try:
+            with self.store.lock:
+                if profile.snapshot_needed or not self.store.exists(profile.name):
+                    with profile.changes_lock:
+                        changes = profile.pending_changes
+                        profile.pending_changes = []
+                        profile.snapshot_needed = False
+                        snapshot = True
+                        self.store.write_snapshot(profile, changes)
+                else:
+                    changes = profile.take_pending_changes()
+                    if changes:
+                        self.store.write_changes(profile, changes)
             
+            if profile.name in self.resident_bytes:
+                self.resident_bytes[profile.name] = None
             logger.info(f"Saved profile: {profile.name}")
             return True
         except Exception as e:
+            if changes is not None:
+                profile.restore_pending_changes(changes, snapshot)
             logger.error(f"Error saving profile: {e}")
             return False
     
+    def flush(self, timeout=None):
+        # Forces every scheduled save to disk, waiting at most `timeout` seconds
+        done = self.writer.flush(timeout)
+        if not done:
+            logger.error(f"Profile saves still pending after {timeout}s")
+        logger.info(f"Profile save stats: {self.get_save_stats()}")
+        logger.info(f"Profile residency: {self.get_residency_stats()}")
+        return done
+    
+    def get_save_stats(self):
+        stats = dict(self.writer.stats)
+        stats["skipped_clean"] = self.skipped_saves
+        return stats
+    
+    def compact_profile(self, name):
+        return self.store.compact(name)
+    
+    def has_profile(self, name):
+        return name in self.profiles or self.store.exists(name)
+    
     def create_profile(self, name, location=""):
-        if name in self.profiles:
+        if self.has_profile(name):
             return False
         
         profile = UserProfile(name, location)
-        self.profiles[name] = profile
-        self.save_profile(profile)
+        # Written immediately so the new profile is on disk and listed
+        self._write_profile(profile)
+        self._make_resident(profile)
         return True
     
     def delete_profile(self, name):
-        if name not in self.profiles:
+        if not self.has_profile(name):
             return False
         
         try:
-            profile_path = os.path.join(self.profiles_dir, f"{name}.profile")
-            if os.path.exists(profile_path):
-                os.remove(profile_path)
-            
-            del self.profiles[name]
+            # A queued save would otherwise recreate the profile
+            self.writer.cancel(name)
+            self.store.delete(name)
+            with self.residency_lock:
+                self.profiles.pop(name, None)
+                self.resident_bytes.pop(name, None)
             logger.info(f"Deleted profile: {name}")
             return True
         except Exception as e:
             logger.error(f"Error deleting profile: {e}")
             return False
     
+    def rename_profile(self, name, new_name):
+        if not self.has_profile(name) or self.has_profile(new_name):
+            return False
+        
+        profile = self.load_profile(name)
+        if profile is None:
+            return False
+        try:
+            # Pending changes are written under the old name, then the store
+            # moves the profile. Holding the store lock keeps the writer out
+            # until the profile carries its new name.
+            self.writer.cancel(name)
+            with self.store.lock:
+                if not self._write_profile(profile):
+                    return False
+                self.store.rename(name, new_name)
+                profile.name = new_name
+            with self.residency_lock:
+                self.profiles.pop(name, None)
+                self.resident_bytes.pop(name, None)
+            self._make_resident(profile)
+            logger.info(f"Renamed profile {name} to {new_name}")
+            return True
+        except Exception as e:
+            logger.error(f"Error renaming profile: {e}")
+            return False
+    
     def set_current_profile(self, name):
-        if name in self.profiles:
-            self.current_profile = self.profiles[name]
+        # The full profile is only decrypted once it is chosen
+        profile = self.load_profile(name)
+        if profile:
+            self.current_profile = profile
             return True
         return False
     
     def get_profile_names(self):
-        return list(self.profiles.keys())
+        names = set(self.store.list_names())
+        with self.residency_lock:
+            names.update(self.profiles.keys())
+        return sorted(names)
     
     def get_current_profile(self):
         return self.current_profile
@@ -286,12 +2572,36 @@ class ProfileManager:
             logger.error(f"Error exporting encryption key: {e}")
             return False
     
+    def load_all_profiles(self, progress=None):
+        # Decrypts every profile not loaded yet
+        self.store.refresh()
+        names = [name for name in self.store.list_names() if name not in self.profiles]
+        loaded = self.store.load_many(names, progress)
+        
+        for name, profile in loaded.items():
+            self._make_resident(profile)
+            if profile.is_dirty():
+                self.save_profile(profile)
+        return len(loaded)
+    
+    def rotate_encryption_key(self, new_key, progress=None):
+        # Re-encrypts every stored profile under new_key, then switches to it
+        try:
+            # A save still queued would be written under the old key after the rotation
+            if not self.flush(timeout=5):
+                logger.error("Not rotating the encryption key while profile saves are pending")
+                return False
+            return self.store.rotate_key(new_key, progress)
+        except Exception as e:
+            logger.error(f"Error rotating encryption key: {e}")
+            return False
+    
     def import_encryption_key(self, path):
+        # Existing profiles are re-encrypted with the imported key so they stay readable
         try:
             with open(path, 'rb') as f:
-                self.encryption_key = f.read()
-                self.cipher_suite = Fernet(self.encryption_key)
-            return True
+                new_key = f.read().strip()
+            return self.rotate_encryption_key(new_key)
         except Exception as e:
             logger.error(f"Error importing encryption key: {e}")
             return False
@@ -532,33 +2842,721 @@ class AppLauncher:
     def get_launch_history(self, limit=10):
         return self.launch_history[-limit:] if self.launch_history else []
 
-class LearningSystem:
+class KeywordIndex:
+    # Inverted index over LearningSystem.command_patterns: word -> (type ids,
+    # counts) posting arrays. Scoring a command gathers the postings of its
+    # words and sums them per type with one np.bincount, instead of visiting
+    # every type's keyword dict.
+    def __init__(self):
+        self.type_ids = {}
+        self.type_names = []
+        self.total_uses = np.zeros(16)
+        self.postings = {}  # word -> {type id: count}
+        self.posting_arrays = {}  # word -> (type ids, counts) arrays, rebuilt after changes
+    
+    def _type_id(self, command_type):
+        type_id = self.type_ids.get(command_type)
+        if type_id is None:
+            type_id = self.type_ids[command_type] = len(self.type_names)
+            self.type_names.append(command_type)
+            if type_id >= len(self.total_uses):
+                self.total_uses = np.concatenate([self.total_uses, np.zeros_like(self.total_uses)])
+        return type_id
+    
+    def add_type(self, command_type, total_uses):
+        type_id = self._type_id(command_type)
+        self.total_uses[type_id] = total_uses
+    
+    def add_keyword(self, command_type, word, count):
+        type_id = self._type_id(command_type)
+        posting = self.postings.setdefault(word, {})
+        posting[type_id] = posting.get(type_id, 0) + count
+        self.posting_arrays.pop(word, None)
+    
+    def _posting_array(self, word):
+        arrays = self.posting_arrays.get(word)
+        if arrays is None:
+            posting = self.postings[word]
+            arrays = (np.fromiter(posting.keys(), dtype=np.int64, count=len(posting)),
+                      np.fromiter(posting.values(), dtype=np.float64, count=len(posting)))
+            self.posting_arrays[word] = arrays
+        return arrays
+    
+    def scores(self, words):
+        # Per type: sum of the counts of the command's words (repeats included),
+        # divided by the type's total uses
+        type_count = len(self.type_names)
+        arrays = [self._posting_array(word) for word in words if word in self.postings]
+        if not arrays:
+            return np.zeros(type_count)
+        type_ids = np.concatenate([ids for ids, _ in arrays])
+        counts = np.concatenate([counts for _, counts in arrays])
+        scores = np.bincount(type_ids, weights=counts, minlength=type_count)
+        total_uses = self.total_uses[:type_count]
+        return np.divide(scores, total_uses, out=scores, where=total_uses > 0)
+
+class SuggestionTrieNode:
+    __slots__ = ("children", "weights", "top")
+    
     def __init__(self):
+        self.children = {}
+        self.weights = {}  # command type -> total count of its keywords below this node
+        self.top = []  # The TOP_K heaviest types, heaviest first
+
+class SuggestionTrie:
+    # Keyword prefix trie for input suggestions. Every node keeps the top
+    # command types for the keywords below it, so a lookup is a walk down the
+    # prefix. Weights only grow while learning, which keeps the top lists
+    # exact under incremental updates.
+    TOP_K = 8
+    
+    def __init__(self):
+        self.root = SuggestionTrieNode()
+        self.type_order = {}  # Ties go to the type learned first
+    
+    def _rank(self, node, command_type):
+        return -node.weights[command_type], self.type_order[command_type]
+    
+    def add(self, word, command_type, count):
+        self.type_order.setdefault(command_type, len(self.type_order))
+        node = self.root
+        for char in word:
+            node = node.children.setdefault(char, SuggestionTrieNode())
+            node.weights[command_type] = node.weights.get(command_type, 0) + count
+            top = node.top
+            if command_type not in top:
+                if len(top) < self.TOP_K:
+                    top.append(command_type)
+                elif self._rank(node, command_type) < self._rank(node, top[-1]):
+                    top[-1] = command_type
+                else:
+                    continue
+            top.sort(key=lambda top_type: self._rank(node, top_type))
+    
+    def build(self, entries):
+        # Bulk load of (word, command type, count): weights first, then every top list once
+        for word, command_type, count in entries:
+            self.type_order.setdefault(command_type, len(self.type_order))
+            node = self.root
+            for char in word:
+                node = node.children.setdefault(char, SuggestionTrieNode())
+                node.weights[command_type] = node.weights.get(command_type, 0) + count
+        
+        stack = list(self.root.children.values())
+        while stack:
+            node = stack.pop()
+            node.top = heapq.nsmallest(self.TOP_K, node.weights, key=lambda top_type: self._rank(node, top_type))
+            stack.extend(node.children.values())
+    
+    def suggest(self, prefix, limit=3):
+        node = self.root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        return node.top[:limit]
+
+# Words that carry no intent, dropped before learning or scoring
+KEYWORD_STOPWORDS = frozenset("""
+    the and for you your with that this from what can please about into have are was will would could
+    should just some any all but not our its it's how who when where there their them then than also
+""".split())
+
+# Spelling variants folded into one keyword
+KEYWORD_ALIASES = {
+    "e-mail": "email", "emails": "email", "msg": "message", "messages": "message", "texts": "text",
+    "pics": "pictures", "photos": "pictures", "vids": "videos", "tunes": "music", "songs": "music",
+    "wanna": "want", "gonna": "going", "tmrw": "tomorrow", "tomorrow's": "tomorrow", "today's": "today"
+}
+
+def normalize_keywords(text):
+    # Keywords of a command: lowercased, stripped of punctuation, aliased, without stopwords or short words
+    keywords = []
+    for word in text.lower().split():
+        word = word.strip(".,!?;:\"'()[]")
+        word = KEYWORD_ALIASES.get(word, word)
+        if len(word) > 2 and word not in KEYWORD_STOPWORDS:
+            keywords.append(word)
+    return keywords
+
+# Keyword -> JarvisAssistant handler method; IntentRouter picks which keyword a command is for
+COMMAND_HANDLERS = {
+    "message": "handle_message",
+    "call": "handle_call",
+    "alarm": "handle_alarm",
+    "reminder": "handle_reminder",
+    "timer": "handle_timer",
+    "todo": "handle_todo",
+    "weather": "handle_weather",
+    "news": "handle_news",
+    "music": "handle_music",
+    "open": "handle_open_app",
+    "launch": "handle_open_app",
+    "start": "handle_open_app",
+    "run": "handle_open_app",
+    "spotify": "handle_spotify",
+    "chrome": "handle_chrome",
+    "firefox": "handle_firefox",
+    "telegram": "handle_telegram",
+    "browser": "handle_chrome",
+    "search": "handle_search",
+    "google": "handle_search",
+    "find": "handle_search",
+    "look up": "handle_search",
+    "contact": "handle_contact",
+    "profile": "handle_profile",
+    "feedback": "handle_feedback",
+    "help": "handle_help",
+    "exit": "handle_exit",
+    "authenticate": "handle_authenticate",
+    "login": "handle_authenticate",
+    "logout": "handle_logout",
+    "repeat": "handle_repeat",
+    "cancel": "handle_cancel"
+}
+
+# Explicit routing priorities; keywords not listed have 0, and ties go to the
+# keyword listed first in COMMAND_HANDLERS. Searching outranks the browser
+# names, since handle_search picks the browser itself.
+COMMAND_PRIORITIES = {"search": 1, "google": 1, "find": 1, "look up": 1}
+
+# Endings a keyword's last word may carry and still match: "reminders", "searching"
+KEYWORD_SUFFIXES = ("s", "es", "ed", "ing")
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+def tokenize(text):
+    # (word, start, end) of every word in the lowercased text
+    return [(match.group(), match.start(), match.end()) for match in TOKEN_PATTERN.finditer(text.lower())]
+
+class IntentRouter:
+    # Handler keywords compiled into a trie over words, so routing is one pass
+    # over the utterance's tokens however many keywords there are. Keywords
+    # only match whole words, so "start" no longer fires inside "restart" or
+    # "run" inside "brunch". When several match, the highest priority wins,
+    # then the keyword listed first.
+    def __init__(self, keywords, priorities=None):
+        priorities = COMMAND_PRIORITIES if priorities is None else priorities
+        self.root = {}  # word -> child node; None -> keyword ending here
+        self.ranks = {}  # keyword -> (priority, -position); the larger wins
+        keywords = list(keywords)
+        for position, keyword in enumerate(keywords):
+            self.ranks[keyword] = (priorities.get(keyword, 0), -position)
+            self._insert(keyword.split(), keyword)
+        # Inflected forms never displace a keyword spelled that way
+        for keyword in keywords:
+            words = keyword.split()
+            for suffix in KEYWORD_SUFFIXES:
+                self._insert(words[:-1] + [words[-1] + suffix], keyword)
+    
+    def _insert(self, words, keyword):
+        node = self.root
+        for word in words:
+            node = node.setdefault(word, {})
+        node.setdefault(None, keyword)
+    
+    def matches(self, text, tokens=None):
+        # (keyword, start, end) of every keyword occurrence, in text order
+        if tokens is None:
+            tokens = tokenize(text)
+        found = []
+        for first in range(len(tokens)):
+            node = self.root
+            for position in range(first, len(tokens)):
+                node = node.get(tokens[position][0])
+                if node is None:
+                    break
+                if None in node:
+                    found.append((node[None], tokens[first][1], tokens[position][2]))
+        return found
+    
+    def best(self, matches):
+        if not matches:
+            return None
+        return max(matches, key=lambda match: self.ranks[match[0]])[0]
+    
+    def route(self, text, tokens=None):
+        return self.best(self.matches(text, tokens))
+
+# Applications handlers recognise by name
+KNOWN_APPS = frozenset(["spotify", "chrome", "firefox", "telegram", "notepad", "calculator"])
+
+# Where a browser is named, e.g. "search for cats in firefox"
+BROWSER_MARKERS = ("in chrome", "in firefox", "on chrome", "on firefox", "using chrome", "using firefox")
+
+# Per handler, the slots to extract as (slot, start markers, stop markers). A
+# slot is the text after the first start marker present, up to the nearest
+# stop marker after it. Markers are whole words or phrases, tried in order.
+COMMAND_SLOTS = {
+    "handle_message": [("recipient", ("to", "message"), ("saying", "that")), ("body", ("saying", "that"), ())],
+    "handle_call": [("recipient", ("call",), ())],
+    "handle_alarm": [("time", ("for", "at"), ())],
+    "handle_reminder": [("task", ("to", "about"), ())],
+    "handle_timer": [("time", ("for",), ())],
+    "handle_todo": [("task", ("add",), ("to",))],
+    "handle_weather": [("location", ("in",), ())],
+    "handle_news": [("topic", ("about",), ())],
+    "handle_music": [("song", ("play",), ())],
+    "handle_open_app": [("target", ("open", "launch", "start", "run"), ())],
+    "handle_spotify": [("song", ("play",), ())],
+    "handle_chrome": [("website", ("go to", "visit"), BROWSER_MARKERS)],
+    "handle_firefox": [("website", ("go to", "visit"), BROWSER_MARKERS)],
+    "handle_search": [("query", ("search for", "search", "google", "find", "look up"), BROWSER_MARKERS)],
+    "handle_contact": [("name", ("named", "contact"), ())]
+}
+
+URL_PATTERN = re.compile(r"\b(?:https?://)?(?:[a-z0-9-]+\.)+(?:com|org|net|io|dev|edu|gov|in|co|uk)\b(?:/\S*)?")
+DURATION_PATTERN = re.compile(r"\b(\d+|an?|one|two|three|four|five|ten|fifteen|twenty|thirty)\s*(second|sec|minute|min|hour|hr)s?\b")
+CLOCK_PATTERN = re.compile(r"\b(\d{1,2})(?::(\d{2}))?\s*(am|pm|a\.m\.|p\.m\.|o'clock)?")
+NUMBER_WORDS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "ten": 10,
+                "fifteen": 15, "twenty": 20, "thirty": 30}
+UNIT_SECONDS = {"second": 1, "sec": 1, "minute": 60, "min": 60, "hour": 3600, "hr": 3600}
+
+def parse_time_expression(text):
+    # {"text": as spoken, "seconds": for durations, "clock": (hour, minute) for times of day}
+    seconds = None
+    clock = None
+    durations = DURATION_PATTERN.findall(text)
+    if durations:
+        seconds = sum((NUMBER_WORDS.get(amount) or int(amount)) * UNIT_SECONDS[unit] for amount, unit in durations)
+    else:
+        match = CLOCK_PATTERN.search(text)
+        # A bare number is only a time of day with a colon or am/pm after it
+        if match and (match.group(2) or match.group(3)):
+            hour, minute = int(match.group(1)), int(match.group(2) or 0)
+            if match.group(3) in ("pm", "p.m.") and hour < 12:
+                hour += 12
+            elif match.group(3) in ("am", "a.m.") and hour == 12:
+                hour = 0
+            if hour < 24 and minute < 60:
+                clock = (hour, minute)
+    return {"text": text, "seconds": seconds, "clock": clock}
+
+# Converters from slot text to a typed value
+SLOT_TYPES = {"time": parse_time_expression}
+
+class Command:
+    # One utterance as parsed by CommandParser: the intent it routes to, its
+    # tokens as (word, start, end), every keyword match, and the slots the
+    # handler reads, with their spans in the text
+    __slots__ = ("text", "intent", "tokens", "matches", "slots", "spans", "positions")
+    
+    def __init__(self, text, intent, tokens, matches):
+        self.text = text
+        self.intent = intent
+        self.tokens = tokens
+        self.matches = matches
+        self.slots = {}
+        self.spans = {}
+        self.positions = {}  # word -> indexes of the tokens spelling it
+        for index, (word, _, _) in enumerate(tokens):
+            self.positions.setdefault(word, []).append(index)
+    
+    def find(self, phrase, after=0):
+        # (first, last) token indexes of the first whole-word occurrence at or after `after`
+        words = phrase.split()
+        for first in self.positions.get(words[0], ()):
+            last = first + len(words) - 1
+            if first >= after and last < len(self.tokens) and all(
+                    self.tokens[first + offset][0] == word for offset, word in enumerate(words)):
+                return first, last
+        return None
+    
+    def has(self, *phrases):
+        return any(self.find(phrase) for phrase in phrases)
+    
+    def slot(self, name, default=None):
+        return self.slots.get(name, default)
+    
+    def __str__(self):
+        return self.text
+
+class CommandParser:
+    # Tokenizes an utterance once, routes it with the IntentRouter and fills
+    # the slots its handler declares in COMMAND_SLOTS, plus the URL, known
+    # app name and first number found anywhere in it
+    def __init__(self, router, slots=None):
+        self.router = router
+        self.slots = COMMAND_SLOTS if slots is None else slots
+    
+    def parse(self, text, intent=None):
+        # `intent` overrides routing, for commands the learning system predicted
+        text = text.lower()
+        tokens = tokenize(text)
+        matches = self.router.matches(text, tokens)
+        command = Command(text, intent or self.router.best(matches), tokens, matches)
+        
+        for word, start, end in tokens:
+            if "app" not in command.slots and word in KNOWN_APPS:
+                command.slots["app"] = word
+                command.spans["app"] = (start, end)
+            elif "number" not in command.slots and word.isdigit():
+                command.slots["number"] = int(word)
+                command.spans["number"] = (start, end)
+        url = URL_PATTERN.search(text)
+        if url:
+            command.slots["url"] = url.group()
+            command.spans["url"] = url.span()
+        
+        for slot, starts, stops in self.slots.get(COMMAND_HANDLERS.get(command.intent), ()):
+            self._extract(command, slot, starts, stops)
+        return command
+    
+    def _extract(self, command, slot, starts, stops):
+        for marker in starts:
+            found = command.find(marker)
+            if found:
+                break
+        else:
+            return
+        
+        tokens = command.tokens
+        start = tokens[found[1]][2]
+        end = len(command.text)
+        for marker in stops:
+            stop = command.find(marker, found[1] + 1)
+            if stop:
+                end = min(end, tokens[stop[0]][1])
+        
+        # Trim spaces and punctuation, keeping the span on the value itself
+        raw = command.text[start:end]
+        value = raw.strip(" ,.!?;:")
+        if value:
+            start += len(raw) - len(raw.lstrip(" ,.!?;:"))
+            command.spans[slot] = (start, start + len(value))
+            command.slots[slot] = SLOT_TYPES[slot](value) if slot in SLOT_TYPES else value
+
+class NaiveBayesClassifier:
+    # Multinomial naive Bayes over command keywords, trained in one batch from
+    # LearningSystem.command_patterns (which are already its per-type counts)
+    # plus any labelled commands. Only the (type, word) pairs seen in training
+    # are stored, as per-word postings of the log-likelihood gain over an
+    # unseen word; a type's score is its log prior plus its unseen-word
+    # log-likelihood for each known word plus the gains.
+    def __init__(self, alpha=1.0, min_confidence=0.5):
+        self.alpha = alpha
+        self.min_confidence = min_confidence  # Posterior below which no type is predicted
+        self.type_names = []
+        self.word_ids = {}
+        self.indptr = np.zeros(1, dtype=np.int64)  # Postings of word i are [indptr[i], indptr[i + 1])
+        self.posting_types = np.zeros(0, dtype=np.int32)
+        self.posting_gains = np.zeros(0, dtype=np.float32)
+        self.log_prior = np.zeros(0)
+        self.log_unseen = np.zeros(0)
+    
+    def is_trained(self):
+        return bool(self.type_names)
+    
+    def fit(self, command_patterns, samples=()):
+        # samples are (command type, keywords) pairs counted on top of the patterns
+        type_uses = {}
+        word_counts = {}
+        for command_type, data in command_patterns.items():
+            type_uses[command_type] = data["total_uses"]
+            word_counts[command_type] = dict(data["keywords"])
+        for command_type, words in samples:
+            type_uses[command_type] = type_uses.get(command_type, 0) + 1
+            counts = word_counts.setdefault(command_type, {})
+            for word in words:
+                counts[word] = counts.get(word, 0) + 1
+        
+        type_names = list(type_uses)
+        word_ids = {}
+        word_column, type_column, count_column = [], [], []
+        for type_id, command_type in enumerate(type_names):
+            for word, count in word_counts[command_type].items():
+                word_column.append(word_ids.setdefault(word, len(word_ids)))
+                type_column.append(type_id)
+                count_column.append(count)
+        
+        words = np.array(word_column, dtype=np.int64)
+        types = np.array(type_column, dtype=np.int32)
+        counts = np.array(count_column, dtype=np.float64)
+        order = np.argsort(words, kind='stable')
+        
+        vocabulary = len(word_ids)
+        totals = np.bincount(types, weights=counts, minlength=len(type_names))
+        uses = np.array([type_uses[command_type] for command_type in type_names], dtype=np.float64)
+        
+        self.type_names = type_names
+        self.word_ids = word_ids
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(words, minlength=vocabulary))])
+        self.posting_types = types[order]
+        self.posting_gains = (np.log(counts[order] + self.alpha) - np.log(self.alpha)).astype(np.float32)
+        self.log_prior = np.log((uses + 1) / (uses.sum() + len(type_names)))
+        self.log_unseen = np.log(self.alpha) - np.log(totals + self.alpha * max(vocabulary, 1))
+        return self
+    
+    def predict(self, words):
+        # (command type or None, posterior of the best type)
+        ids = [self.word_ids[word] for word in words if word in self.word_ids]
+        if not ids:
+            return None, 0.0
+        
+        scores = self.log_prior + len(ids) * self.log_unseen
+        for word_id in ids:
+            start, end = self.indptr[word_id], self.indptr[word_id + 1]
+            # A word's postings name each type once, so the fancy-indexed add is safe
+            scores[self.posting_types[start:end]] += self.posting_gains[start:end]
+        
+        best = int(np.argmax(scores))
+        confidence = 1.0 / float(np.exp(scores - scores[best]).sum())
+        if confidence < self.min_confidence:
+            return None, confidence
+        return self.type_names[best], confidence
+    
+    def nbytes(self):
+        # Array storage; the vocabulary dict is shared with the keyword index's strings
+        return (self.indptr.nbytes + self.posting_types.nbytes + self.posting_gains.nbytes
+                + self.log_prior.nbytes + self.log_unseen.nbytes)
+
+class LearningSystem:
+    # learning_data.json is a snapshot; every learned command is appended to
+    # learning_data.json.log as one small delta record, and snapshots are written
+    # on a background thread every SNAPSHOT_EVERY deltas. Before a snapshot is
+    # requested the log is moved aside to .log.prev, which is deleted once a
+    # snapshot covering it is on disk. Loading replays both logs past the
+    # snapshot's sequence number.
+    #
+    # Counts decay with a half-life. Rather than shrinking every count as time
+    # passes, a command at time t adds 2 ** ((t - decay_epoch) / half_life), so
+    # older counts weigh relatively less; the ratios predictions use are the
+    # same either way. Counts are rescaled to a new epoch before that weight
+    # grows too large, and when more than max_keywords keywords are held the
+    # lowest-weighted are pruned down to PRUNE_TO of the cap.
+    SNAPSHOT_EVERY = 200
+    RESCALE_AT = 2.0 ** 20
+    PRUNE_TO = 0.9
+    
+    def __init__(self, data_file='learning_data.json', snapshot_delay=2.0, classifier=None,
+                 half_life_days=30, max_keywords=20000):
+        self.data_file = data_file  # None keeps learning in memory only
+        self.classifier = classifier  # Batch-trained backend used by predict_command_type once trained
+        self.classifier_samples = []  # History commands it was trained on, kept for refits
+        self.classifier_stale = False  # Counts changed since the classifier was fitted
+        self.half_life = half_life_days * 86400 * 10 ** 6 if half_life_days else None  # None disables decay
+        self.max_keywords = max_keywords  # None leaves the keyword count unbounded
+        self.decay_epoch = 0
+        self.keyword_count = 0
         self.command_patterns = {}
+        self.keyword_index = KeywordIndex()
+        self.suggestion_trie = None  # Built on the first suggestion lookup
+        self.lock = threading.RLock()  # Suggestions may be computed off the Tk thread
+        self.seq = 0  # Sequence number of the last applied delta
+        self.learned = 0  # Commands counted, including those a replay rebuilt
+        self.unsaved = 0  # Deltas logged since the last snapshot request
+        self.prev_seq = None  # Last sequence number in .log.prev while it exists
+        self.writer = WriteBehindScheduler(self._write_snapshot, snapshot_delay)
         self.load_learning_data()
     
+    @property
+    def log_path(self):
+        return self.data_file + ".log"
+    
+    @property
+    def prev_log_path(self):
+        return self.data_file + ".log.prev"
+    
     def load_learning_data(self):
         try:
-            if os.path.exists('learning_data.json'):
-                with open('learning_data.json', 'r') as f:
-                    self.command_patterns = json.load(f)
-            logger.info("Loaded learning data")
+            with self.lock:
+                self.command_patterns = {}
+                self.seq = 0
+                self.learned = 0
+                self.unsaved = 0
+                self.prev_seq = None
+                self.decay_epoch = to_micros(datetime.datetime.now())
+                replayed = 0
+                if self.data_file:
+                    if os.path.exists(self.data_file):
+                        with open(self.data_file, 'r') as f:
+                            data = json.load(f)
+                        if "seq" in data and "command_patterns" in data:
+                            self.seq = data["seq"]
+                            self.learned = data.get("learned", self.seq)
+                            self.command_patterns = data["command_patterns"]
+                            self.decay_epoch = data.get("decay_epoch", self.decay_epoch)
+                        else:
+                            # Written by an older version as the bare patterns, which never decayed
+                            self.command_patterns = data
+                            self.learned = int(sum(data["total_uses"] for data in self.command_patterns.values()))
+                    self.keyword_count = sum(len(data["keywords"]) for data in self.command_patterns.values())
+                    
+                    logs = [path for path in (self.prev_log_path, self.log_path) if os.path.exists(path)]
+                    for path in logs:
+                        replayed += self._replay_log(path)
+                    pruned = self.max_keywords is not None and self.keyword_count > self.max_keywords
+                    if pruned:
+                        # Learning data from before the cap existed
+                        self._prune(to_micros(datetime.datetime.now()))
+                    if logs or pruned:
+                        # Fold what was replayed into a fresh snapshot so later appends never follow a torn record
+                        self._write_snapshot((self.seq, json.dumps(self._snapshot_data())))
+                        for path in logs:
+                            os.remove(path)
+                self.keyword_count = sum(len(data["keywords"]) for data in self.command_patterns.values())
+                self.rebuild_index()
+                self.classifier_stale = True
+            logger.info(f"Loaded learning data ({replayed} logged updates replayed)")
         except Exception as e:
             logger.error(f"Error loading learning data: {e}")
     
+    def _replay_log(self, path):
+        if not os.path.exists(path):
+            return 0
+        
+        replayed = 0
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    seq, command_type, success, words, *rest = json.loads(line)
+                except Exception as e:
+                    # A torn final record from an interrupted append; nothing after it is trusted
+                    logger.error(f"Stopped replaying learning log at a damaged record: {e}")
+                    break
+                # Deltas already folded into the snapshot are skipped
+                if seq > self.seq:
+                    # Deltas from before decay carry no time and count at the epoch
+                    self._apply_delta(command_type, success, words, rest[0] if rest else self.decay_epoch)
+                    self.seq = seq
+                    replayed += 1
+        return replayed
+    
+    def rebuild_index(self):
+        # For when command_patterns is replaced wholesale
+        self.keyword_index = KeywordIndex()
+        for command_type, data in self.command_patterns.items():
+            self.keyword_index.add_type(command_type, data["total_uses"])
+            for word, count in data["keywords"].items():
+                self.keyword_index.add_keyword(command_type, word, count)
+        self.suggestion_trie = None
+    
+    def _get_suggestion_trie(self):
+        if self.suggestion_trie is None:
+            trie = SuggestionTrie()
+            trie.build((word, command_type, count)
+                       for command_type, data in self.command_patterns.items()
+                       for word, count in data["keywords"].items())
+            self.suggestion_trie = trie
+        return self.suggestion_trie
+    
+    def _snapshot_data(self):
+        return {"seq": self.seq, "learned": self.learned, "decay_epoch": self.decay_epoch,
+                "command_patterns": self.command_patterns}
+    
+    def request_snapshot(self):
+        if not self.data_file:
+            return
+        with self.lock:
+            # Start a fresh log unless an earlier snapshot has not yet covered .log.prev
+            if self.prev_seq is None and os.path.exists(self.log_path):
+                os.replace(self.log_path, self.prev_log_path)
+                self.prev_seq = self.seq
+            self.unsaved = 0
+        # Serialized on the writer thread, so the command that triggered it only appends its log line
+        self.writer.request("snapshot", None)
+    
+    def _write_snapshot(self, item):
+        # item is (seq, serialized snapshot), or None to take one now under the lock
+        if item is None:
+            with self.lock:
+                item = (self.seq, json.dumps(self._snapshot_data()))
+        seq, snapshot = item
+        temp_path = self.data_file + ".tmp"
+        with open(temp_path, 'w') as f:
+            f.write(snapshot)
+        os.replace(temp_path, self.data_file)
+        
+        with self.lock:
+            if self.prev_seq is not None and seq >= self.prev_seq:
+                if os.path.exists(self.prev_log_path):
+                    os.remove(self.prev_log_path)
+                self.prev_seq = None
+        logger.info(f"Saved learning data snapshot at {seq}")
+    
+    def replace_patterns(self, command_patterns, decay_epoch, learned):
+        # Swaps in counts built elsewhere from `learned` commands, such as by
+        # ReplayTrainer, and snapshots them at once
+        self.writer.flush()
+        with self.lock:
+            self.command_patterns = command_patterns
+            self.decay_epoch = decay_epoch
+            self.learned = learned
+            self.keyword_count = sum(len(data["keywords"]) for data in command_patterns.values())
+            if self.max_keywords is not None and self.keyword_count > self.max_keywords:
+                self._prune(decay_epoch)
+            self.seq += 1
+            self.unsaved = 0
+            self.rebuild_index()
+            self.classifier_stale = True
+            if self.data_file:
+                self._write_snapshot((self.seq, json.dumps(self._snapshot_data())))
+                for path in (self.log_path, self.prev_log_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                self.prev_seq = None
+    
     def save_learning_data(self):
+        # Writes a snapshot now rather than waiting for the log to fill
+        if not self.data_file:
+            return
         try:
-            with open('learning_data.json', 'w') as f:
-                json.dump(self.command_patterns, f)
-            logger.info("Saved learning data")
+            self.request_snapshot()
+            self.writer.flush()
         except Exception as e:
             logger.error(f"Error saving learning data: {e}")
     
-    def learn_from_command(self, command, command_type, success):
-        # Extract keywords from command
-        words = command.lower().split()
-        
-        # Update command patterns
+    def flush(self, timeout=None):
+        if self.data_file and self.unsaved:
+            try:
+                self.request_snapshot()
+            except Exception as e:
+                logger.error(f"Error saving learning data: {e}")
+                return False
+        return self.writer.flush(timeout)
+    
+    def _weight(self, micros):
+        if self.half_life is None:
+            return 1.0
+        return 2.0 ** ((micros - self.decay_epoch) / self.half_life)
+    
+    def _rescale(self, micros):
+        # Moves the decay epoch to `micros`, so every count becomes its weight at that time
+        factor = 1.0 / self._weight(micros)
+        for data in self.command_patterns.values():
+            data["total_uses"] *= factor
+            data["successful_uses"] *= factor
+            keywords = data["keywords"]
+            for word in keywords:
+                keywords[word] *= factor
+        self.decay_epoch = micros
+    
+    def _prune(self, micros):
+        # Drops the lowest-weighted keywords until PRUNE_TO of the cap is left
+        self._rescale(micros)
+        entries = sorted((count, command_type, word)
+                         for command_type, data in self.command_patterns.items()
+                         for word, count in data["keywords"].items())
+        excess = len(entries) - int(self.max_keywords * self.PRUNE_TO)
+        for _, command_type, word in entries[:excess]:
+            del self.command_patterns[command_type]["keywords"][word]
+        self.keyword_count -= max(excess, 0)
+        logger.info(f"Pruned {max(excess, 0)} learned keywords")
+    
+    def _apply_delta(self, command_type, success, words, micros):
+        # Returns the weight the command was counted with, or None when counts were
+        # rescaled or pruned and the indexes need rebuilding
+        rebuilt = False
+        if not self.command_patterns:
+            # Nothing learned yet, so the first command fixes the epoch and replay matches it
+            self.decay_epoch = micros
+        weight = self._weight(micros)
+        if weight > self.RESCALE_AT:
+            self._rescale(micros)
+            weight = 1.0
+            rebuilt = True
+        
+        self.learned += 1
         if command_type not in self.command_patterns:
             self.command_patterns[command_type] = {
                 "keywords": {},
@@ -566,62 +3564,741 @@ class LearningSystem:
                 "successful_uses": 0
             }
         
-        self.command_patterns[command_type]["total_uses"] += 1
+        patterns = self.command_patterns[command_type]
+        patterns["total_uses"] += weight
         if success:
-            self.command_patterns[command_type]["successful_uses"] += 1
-        
-        # Update keyword frequencies
+            patterns["successful_uses"] += weight
+        keywords = patterns["keywords"]
         for word in words:
-            if len(word) > 2:  # Ignore very short words
-                if word in self.command_patterns[command_type]["keywords"]:
-                    self.command_patterns[command_type]["keywords"][word] += 1
-                else:
-                    self.command_patterns[command_type]["keywords"][word] = 1
+            if word not in keywords:
+                self.keyword_count += 1
+            keywords[word] = keywords.get(word, 0) + weight
+        
+        if self.max_keywords is not None and self.keyword_count > self.max_keywords:
+            self._prune(micros)
+            rebuilt = True
+        return None if rebuilt else weight
+    
+    def learn_from_command(self, command, command_type, success, micros=None):
+        words = normalize_keywords(command)
+        if micros is None:
+            micros = to_micros(datetime.datetime.now())
+        
+        with self.lock:
+            weight = self._apply_delta(command_type, success, words, micros)
+            if weight is None:
+                self.rebuild_index()
+            else:
+                self.keyword_index.add_type(command_type, self.command_patterns[command_type]["total_uses"])
+                for word in words:
+                    self.keyword_index.add_keyword(command_type, word, weight)
+                    if self.suggestion_trie is not None:
+                        self.suggestion_trie.add(word, command_type, weight)
+            self.classifier_stale = True
+            
+            self.seq += 1
+            if not self.data_file:
+                return
+            
+            # One short line per command instead of rewriting the whole file
+            try:
+                with open(self.log_path, 'a') as f:
+                    f.write(json.dumps([self.seq, command_type, success, words, micros]) + "\n")
+                self.unsaved += 1
+            except Exception as e:
+                logger.error(f"Error logging learning data: {e}")
+                return
         
-        # Save the updated learning data
-        self.save_learning_data()
+        if self.unsaved >= self.SNAPSHOT_EVERY:
+            try:
+                self.request_snapshot()
+            except Exception as e:
+                logger.error(f"Error saving learning data: {e}")
+    
+    def score_command_types(self, command):
+        # Keyword score of every command type, normalized by its total uses
+        words = normalize_keywords(command)
+        scores = self.keyword_index.scores(words)
+        return dict(zip(self.keyword_index.type_names, scores.tolist()))
+    
+    def train_classifier(self, histories=(), keywords=()):
+        # Batch-trains the classifier backend on the learned patterns plus command
+        # histories, labelled the way process_command routes them by `keywords`.
+        # Once trained it is refitted whenever a prediction follows new counts.
+        if self.classifier is None:
+            self.classifier = NaiveBayesClassifier()
+        router = IntentRouter(keywords)
+        samples = []
+        for history in histories:
+            for entry in history:
+                command = entry["command"].lower()
+                command_type = router.route(command)
+                if command_type:
+                    samples.append((command_type, normalize_keywords(command)))
+        
+        with self.lock:
+            self.classifier_samples = samples
+            self._fit_classifier()
+        return self.classifier
+    
+    def _fit_classifier(self):
+        # Called with the lock held; fitting 20k keywords takes a few milliseconds
+        patterns = {command_type: {"keywords": dict(data["keywords"]), "total_uses": data["total_uses"]}
+                    for command_type, data in self.command_patterns.items()}
+        start = time.perf_counter()
+        self.classifier.fit(patterns, self.classifier_samples)
+        self.classifier_stale = False
+        logger.info(f"Trained {type(self.classifier).__name__} on {len(patterns)} types and "
+                    f"{len(self.classifier_samples)} history commands in {(time.perf_counter() - start) * 1000:.1f} ms")
+    
+    def has_classifier(self):
+        # Trained, or due a fit that will train it
+        return self.classifier is not None and (self.classifier.is_trained() or self.classifier_stale)
     
     def predict_command_type(self, command):
-        command = command.lower()
-        words = command.split()
+        words = normalize_keywords(command)
+        if self.has_classifier():
+            with self.lock:
+                if self.classifier_stale:
+                    self._fit_classifier()
+                if self.classifier.is_trained():
+                    return self.classifier.predict(words)[0]
         
-        best_match = None
-        highest_score = 0
+        scores = self.keyword_index.scores(words)
+        if not len(scores):
+            return None
         
-        for cmd_type, data in self.command_patterns.items():
-            score = 0
-            for word in words:
-                if len(word) > 2 and word in data["keywords"]:
-                    score += data["keywords"][word]
-            
-            # Normalize by total uses
-            if data["total_uses"] > 0:
-                score = score / data["total_uses"]
-            
-            if score > highest_score:
-                highest_score = score
-                best_match = cmd_type
+        # argmax keeps the first of equal scores, as the old per-type loop did
+        best = int(np.argmax(scores))
         
         # Only return a prediction if the score is significant
-        if highest_score > 0.1:
-            return best_match
+        if scores[best] > 0.1:
+            return self.keyword_index.type_names[best]
         return None
     
     def get_command_suggestions(self, partial_command, limit=3):
+        # Command types with keywords starting with the input, the most used first
         partial_command = partial_command.lower()
-        suggestions = []
+        if not partial_command:
+            return []
+        with self.lock:
+            return self._get_suggestion_trie().suggest(partial_command, limit)
+
+class LearningShards:
+    # A LearningSystem per profile, stored as <directory>/<profile>.json, over a
+    # global LearningSystem that every command also feeds. Only the current
+    # profile's shard is held: `profile_name` is asked on each call and the
+    # shard is swapped when it changes. Predictions blend the two, leaning on
+    # the global prior until the profile has PRIOR_STRENGTH commands of its own.
+    # With `classify`, each system serves predictions from its own naive Bayes
+    # classifier instead: the profile's once it has PRIOR_STRENGTH commands,
+    # the global one before that.
+    PRIOR_STRENGTH = 50
+    
+    def __init__(self, directory='learning', global_file='learning_data.json', profile_name=None, classify=False,
+                 **options):
+        self.directory = directory
+        self.profile_name = profile_name  # Callable returning the current profile's name, or None
+        self.classify = classify
+        self.options = options  # Passed to every LearningSystem
+        self.global_system = LearningSystem(global_file, **options)
+        if classify:
+            self.global_system.train_classifier()
+        self.shard = None
+        self.shard_name = None
+        self.lock = threading.RLock()
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+    
+    def _shard_path(self, name):
+        return os.path.join(self.directory, f"{name}.json")
+    
+    def _shard_paths(self, name):
+        path = self._shard_path(name)
+        return [path, path + ".log", path + ".log.prev"]
+    
+    def current_shard(self):
+        name = self.profile_name() if self.profile_name else None
+        with self.lock:
+            if name != self.shard_name:
+                # Logged deltas are already on disk, so the old shard is simply dropped
+                start = time.perf_counter()
+                self.shard = LearningSystem(self._shard_path(name), **self.options) if name else None
+                self.shard_name = name
+                if name and self.classify:
+                    self.shard.train_classifier()
+                if name:
+                    logger.info(f"Loaded learning shard for {name} in {(time.perf_counter() - start) * 1000:.1f} ms")
+            return self.shard
+    
+    def learn_from_command(self, command, command_type, success, micros=None):
+        shard = self.current_shard()
+        if shard is not None:
+            shard.learn_from_command(command, command_type, success, micros)
+        self.global_system.learn_from_command(command, command_type, success, micros)
+    
+    def score_command_types(self, command):
+        # Profile scores blended with the global prior by how much the profile has learned
+        prior = self.global_system.score_command_types(command)
+        shard = self.current_shard()
+        if shard is None:
+            return prior
+        prior_weight = self.PRIOR_STRENGTH / (self.PRIOR_STRENGTH + shard.learned)
+        scores = {command_type: score * (1 - prior_weight)
+                  for command_type, score in shard.score_command_types(command).items()}
+        for command_type, score in prior.items():
+            scores[command_type] = scores.get(command_type, 0) + score * prior_weight
+        return scores
+    
+    def predict_command_type(self, command):
+        shard = self.current_shard()
+        if shard is not None and shard.has_classifier() and shard.learned >= self.PRIOR_STRENGTH:
+            return shard.predict_command_type(command)
+        if self.global_system.has_classifier():
+            return self.global_system.predict_command_type(command)
+        
+        best_match = None
+        highest_score = 0.1  # Only return a prediction if the score is significant
+        for command_type, score in self.score_command_types(command).items():
+            if score > highest_score:
+                highest_score = score
+                best_match = command_type
+        return best_match
+    
+    def get_command_suggestions(self, partial_command, limit=3):
+        # The profile's own suggestions first, then the global ones
+        shard = self.current_shard()
+        suggestions = shard.get_command_suggestions(partial_command, limit) if shard is not None else []
+        for command_type in self.global_system.get_command_suggestions(partial_command, limit):
+            if len(suggestions) >= limit:
+                break
+            if command_type not in suggestions:
+                suggestions.append(command_type)
+        return suggestions
+    
+    def replace_shard(self, name, command_patterns, decay_epoch, learned):
+        with self.lock:
+            shard = self.shard if name == self.shard_name else None
+        if shard is None:
+            # Built empty and pointed at the shard's file, so the old state is not loaded just to be replaced
+            shard = LearningSystem(data_file=None, **self.options)
+            shard.data_file = self._shard_path(name)
+        shard.replace_patterns(command_patterns, decay_epoch, learned)
+    
+    def rename_profile(self, old_name, new_name):
+        with self.lock:
+            if self.shard_name == old_name:
+                # A snapshot still queued would otherwise land under the old name
+                self.shard.flush()
+                self.shard = self.shard_name = None
+            for old_path, new_path in zip(self._shard_paths(old_name), self._shard_paths(new_name)):
+                if os.path.exists(old_path):
+                    os.replace(old_path, new_path)
+    
+    def delete_profile(self, name):
+        with self.lock:
+            if self.shard_name == name:
+                self.shard.flush()
+                self.shard = self.shard_name = None
+            for path in self._shard_paths(name):
+                if os.path.exists(path):
+                    os.remove(path)
+    
+    def flush(self, timeout=None):
+        with self.lock:
+            shard = self.shard
+        done = self.global_system.flush(timeout)
+        if shard is not None:
+            done = shard.flush(timeout) and done
+        return done
+
+def merge_learning_patterns(partials, half_life):
+    # Sums (command_patterns, decay_epoch) partials, rescaling each to the latest epoch
+    epoch = max((decay_epoch for _, decay_epoch in partials), default=to_micros(datetime.datetime.now()))
+    merged = {}
+    for command_patterns, decay_epoch in partials:
+        factor = 2.0 ** ((decay_epoch - epoch) / half_life) if half_life else 1.0
+        for command_type, data in command_patterns.items():
+            target = merged.setdefault(command_type, {"keywords": {}, "total_uses": 0, "successful_uses": 0})
+            target["total_uses"] += data["total_uses"] * factor
+            target["successful_uses"] += data["successful_uses"] * factor
+            keywords = target["keywords"]
+            for word, count in data["keywords"].items():
+                keywords[word] = keywords.get(word, 0) + count * factor
+    return merged, epoch
+
+class ReplayTrainer:
+    # Rebuilds learning state from saved history rather than live commands.
+    # Each profile's history, plus the commands named in jarvis.log, is read,
+    # decrypted, labelled the way process_command routes it and counted in a
+    # worker process. The partial counts replace the profile shards and are
+    # merged into a new global prior; the report covers how well each shard
+    # predicted its held-out commands. Run it while the assistant is closed.
+    def __init__(self, store, learning, keywords=None, engine=None, holdout=0.1):
+        self.store = store
+        self.learning = learning  # LearningShards to rebuild
+        self.keywords = list(keywords or COMMAND_HANDLERS)
+        self.engine = engine or BulkProfileEngine()
+        self.holdout = holdout
+    
+    def run(self, log_path=None, report_path=None, progress=None):
+        start = time.perf_counter()
+        self.store.refresh()
+        sources = self.store.history_sources(self.store.list_names())
+        options = {option: self.learning.options[option] for option in ("half_life_days", "max_keywords")
+                   if option in self.learning.options}
+        tasks = [(name, reader, args, self.keywords, options, self.holdout) for name, (reader, args) in sources.items()]
+        if log_path and os.path.exists(log_path):
+            # Not tied to a profile, so it only feeds the global prior
+            tasks.append((None, _read_log_commands, (log_path,), self.keywords, options, self.holdout))
+        
+        partials = []
+        profiles = {}
+        failed = []
+        unreadable = []
+        tested = correct = 0
+        for name, result, error in self.engine.run(_bulk_learn_history, tasks, progress):
+            if error == UNREADABLE_PROFILE:
+                # Saved under another key; the rest is still worth learning from
+                logger.warning(f"Skipping history of {name}: {error}")
+                unreadable.append(name)
+                continue
+            if error is not None:
+                logger.error(f"Error replaying history of {name or log_path}: {error}")
+                failed.append(name or log_path)
+                continue
+            partials.append((result["command_patterns"], result["decay_epoch"]))
+            if name is not None:
+                self.learning.replace_shard(name, result["command_patterns"], result["decay_epoch"],
+                                            result["labelled"])
+            profiles[name or log_path] = {
+                "commands": result["commands"],
+                "labelled": result["labelled"],
+                "tested": result["tested"],
+                "accuracy": result["correct"] / result["tested"] if result["tested"] else None
+            }
+            tested += result["tested"]
+            correct += result["correct"]
+        replay_time = time.perf_counter() - start
+        
+        merged, epoch = merge_learning_patterns(partials, self.learning.global_system.half_life)
+        labelled = sum(profile["labelled"] for profile in profiles.values())
+        self.learning.global_system.replace_patterns(merged, epoch, labelled)
+        
+        report = {
+            "sources": profiles,
+            "failed": failed,
+            "unreadable": unreadable,
+            "commands": sum(profile["commands"] for profile in profiles.values()),
+            "labelled": labelled,
+            "tested": tested,
+            "accuracy": correct / tested if tested else None,
+            "command_types": len(merged),
+            "keywords": self.learning.global_system.keyword_count,
+            "replay_seconds": replay_time,
+            "total_seconds": time.perf_counter() - start
+        }
+        if report_path:
+            with open(report_path, 'w') as f:
+                json.dump(report, f, indent=2)
+        logger.info(f"Retrained learning from {report['commands']} commands of {len(profiles)} sources "
+                    f"in {report['total_seconds']:.2f}s")
+        return report
+
+class SuggestionPipeline:
+    # Computes input suggestions on a background thread. Keystrokes less than
+    # `delay` seconds apart are debounced into one lookup, results for input
+    # that has since changed are dropped, and `deliver` is only called
+    # (through `post`, on the UI thread) when the suggestions change.
+    def __init__(self, compute, deliver, post, delay=0.15):
+        self.compute = compute
+        self.deliver = deliver
+        self.post = post
+        self.delay = delay
+        self.condition = threading.Condition()
+        self.text = None  # Latest input not yet looked up
+        self.generation = 0  # Bumped by every keystroke
+        self.due = 0
+        self.delivered = []
+        self.thread = None
+        self.stats = {"submitted": 0, "computed": 0, "stale": 0, "unchanged": 0, "delivered": 0}
+    
+    def submit(self, text):
+        with self.condition:
+            self.stats["submitted"] += 1
+            self.generation += 1
+            self.text = text
+            self.due = time.monotonic() + self.delay
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+    
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.text is None:
+                    self.condition.wait()
+                wait = self.due - time.monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+                text, generation = self.text, self.generation
+                self.text = None
+            
+            try:
+                suggestions = self.compute(text) if text else []
+            except Exception as e:
+                logger.error(f"Error computing suggestions: {e}")
+                continue
+            
+            with self.condition:
+                self.stats["computed"] += 1
+                if generation != self.generation:
+                    self.stats["stale"] += 1
+                    continue
+            self.post(lambda: self._deliver(generation, suggestions))
+    
+    def _deliver(self, generation, suggestions):
+        # Runs on the UI thread
+        with self.condition:
+            if generation != self.generation:
+                self.stats["stale"] += 1
+                return
+            if suggestions == self.delivered:
+                self.stats["unchanged"] += 1
+                return
+            self.delivered = suggestions
+            self.stats["delivered"] += 1
+        self.deliver(suggestions)
+
+# Handlers that open dialogs, change widgets or schedule Tk callbacks run on
+# the Tk thread; everything else goes through the CommandExecutor. The Telegram
+# client is connected on the Tk thread and is bound to its event loop, so the
+# Telegram handlers run there too.
+UI_HANDLERS = frozenset(["handle_profile", "handle_feedback", "handle_authenticate", "handle_logout",
+                         "handle_repeat", "handle_help", "handle_exit", "handle_cancel",
+                         "handle_message", "handle_telegram"])
+
+# Handlers "repeat" may run again. Sends are only repeated after a yes; exit,
+# logout, cancel, profile, login and contact changes never are.
+REPEATABLE_HANDLERS = frozenset(["handle_call", "handle_alarm", "handle_reminder", "handle_timer", "handle_todo",
+                                 "handle_weather", "handle_news", "handle_music", "handle_open_app", "handle_spotify",
+                                 "handle_chrome", "handle_firefox", "handle_search", "handle_help",
+                                 "handle_message", "handle_telegram"])
+CONFIRM_REPEAT_HANDLERS = frozenset(["handle_message", "handle_telegram"])
+
+def plan_repeats(parser, texts):
+    # (commands to run again, sends to confirm first), each oldest first
+    repeats = [parsed for parsed in map(parser.parse, texts)
+               if COMMAND_HANDLERS.get(parsed.intent) in REPEATABLE_HANDLERS]
+    return ([parsed for parsed in repeats if COMMAND_HANDLERS[parsed.intent] not in CONFIRM_REPEAT_HANDLERS],
+            [parsed for parsed in repeats if COMMAND_HANDLERS[parsed.intent] in CONFIRM_REPEAT_HANDLERS])
+
+# Answers to a question like "Did you mean Mom?"; any other reply drops the question
+CONFIRM_WORDS = frozenset(["yes", "yeah", "yep", "sure", "correct", "confirm"])
+DECLINE_WORDS = frozenset(["no", "nope", "don't", "cancel"])
+
+# Seconds before a handler's reply is given up on, for handlers that need other
+# than the executor default. The slow Telegram handlers run on the Tk thread.
+HANDLER_TIMEOUTS = {}
+
+# Queued commands with a higher priority run first; time-sensitive requests
+# jump ahead of app launches, and replayed commands wait behind new ones
+HANDLER_PRIORITIES = {"handle_alarm": 1, "handle_timer": 1, "handle_reminder": 1, "handle_call": 1}
+REPEAT_PRIORITY = -1
+
+class CommandTask:
+    # One submitted command; `state` ends as done, failed, timed_out,
+    # cancelled or dropped, and `on_done` receives the task on the UI thread
+    __slots__ = ("name", "function", "args", "priority", "timeout", "on_done", "state",
+                 "result", "error", "submitted", "started", "finished", "deadline")
+    
+    def __init__(self, name, function, args, priority, timeout, on_done):
+        self.name = name
+        self.function = function
+        self.args = args
+        self.priority = priority
+        self.timeout = timeout
+        self.on_done = on_done
+        self.state = "queued"
+        self.result = None
+        self.error = None
+        self.submitted = time.monotonic()
+        self.started = None
+        self.finished = None
+        self.deadline = None
+    
+    def cancelled(self):
+        # Long handlers may poll this; their result is discarded either way
+        return self.state == "cancelled"
+
+class CommandExecutor:
+    # Runs commands on a pool of worker threads from a bounded priority queue.
+    # A full queue sheds its lowest-priority command for a more urgent one, or
+    # rejects the new one. Python threads cannot be interrupted, so a command
+    # past its timeout is reported as timed out, its late result is dropped,
+    # and a replacement worker is started while its thread finishes.
+    def __init__(self, post, max_workers=2, max_queue=16, timeout=10.0):
+        self.post = post
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        self.queue = []  # Heap of (-priority, sequence, task)
+        self.sequence = 0
+        self.queued = 0  # Live entries in the heap; cancelled ones are skipped when popped
+        self.running = set()
+        self.threads = 0
+        self.idle = 0
+        self.abandoned = 0  # Workers still inside a timed-out or cancelled command
+        self.watchdog = None
+        self.max_depth = 0
+        self.wait_histogram = LatencyHistogram()
+        self.run_histogram = LatencyHistogram()
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "timed_out": 0, "cancelled": 0,
+                      "rejected": 0, "dropped": 0, "late": 0}
+    
+    def submit(self, name, function, args=(), priority=0, timeout=None, on_done=None):
+        # Returns the queued CommandTask, or None if the queue is full of more urgent work
+        task = CommandTask(name, function, args, priority, self.timeout if timeout is None else timeout, on_done)
+        shed = None
+        with self.condition:
+            self.stats["submitted"] += 1
+            if self.queued >= self.max_queue:
+                shed = self._lowest_queued()
+                if shed is None or shed.priority >= priority:
+                    self.stats["rejected"] += 1
+                    return None
+                shed.state = "dropped"
+                self.queued -= 1
+                self.stats["dropped"] += 1
+            
+            heapq.heappush(self.queue, (-priority, self.sequence, task))
+            self.sequence += 1
+            self.queued += 1
+            self.max_depth = max(self.max_depth, self.queued)
+            if self.idle < self.queued and self.threads - self.abandoned < self.max_workers:
+                self._start_worker()
+            self.condition.notify_all()
+        
+        if shed is not None:
+            self._complete(shed)
+        return task
+    
+    def cancel(self, task):
+        # Queued commands never run; a running one has its result discarded
+        with self.condition:
+            if task.state == "queued":
+                self.queued -= 1
+            elif task.state == "running":
+                self.running.discard(task)
+                self._abandon()
+            else:
+                return False
+            task.state = "cancelled"
+            self.stats["cancelled"] += 1
+            self.condition.notify_all()
+        self._complete(task)
+        return True
+    
+    def cancel_all(self):
+        with self.condition:
+            tasks = [task for _, _, task in self.queue if task.state == "queued"] + list(self.running)
+        return sum(1 for task in tasks if self.cancel(task))
+    
+    def depth(self):
+        with self.condition:
+            return self.queued
+    
+    def metrics(self):
+        with self.condition:
+            metrics = dict(self.stats, queued=self.queued, running=len(self.running), max_depth=self.max_depth,
+                           workers=self.threads, abandoned=self.abandoned)
+        metrics["wait"] = self.wait_histogram.summary()
+        metrics["run"] = self.run_histogram.summary()
+        return metrics
+    
+    def _lowest_queued(self):
+        # The newest of the lowest-priority queued commands
+        entries = [entry for entry in self.queue if entry[2].state == "queued"]
+        return max(entries, key=lambda entry: entry[:2], default=(None, None, None))[2]
+    
+    def _start_worker(self):
+        self.threads += 1
+        threading.Thread(target=self._work, daemon=True).start()
+    
+    def _abandon(self):
+        # The worker is stuck in a command nobody is waiting for; let another take over
+        self.abandoned += 1
+        if self.idle < self.queued and self.threads - self.abandoned < self.max_workers:
+            self._start_worker()
+    
+    def _work(self):
+        while True:
+            with self.condition:
+                while not self.queued:
+                    if self.threads - self.abandoned > self.max_workers:
+                        self.threads -= 1
+                        return
+                    self.idle += 1
+                    self.condition.wait()
+                    self.idle -= 1
+                
+                _, _, task = heapq.heappop(self.queue)
+                if task.state != "queued":
+                    continue
+                self.queued -= 1
+                task.state = "running"
+                task.started = time.monotonic()
+                task.deadline = task.started + task.timeout if task.timeout else None
+                self.running.add(task)
+                if task.deadline is not None and self.watchdog is None:
+                    self.watchdog = threading.Thread(target=self._watch, daemon=True)
+                    self.watchdog.start()
+                self.condition.notify_all()
+            
+            self.wait_histogram.record(task.started - task.submitted)
+            try:
+                result, error = task.function(*task.args), None
+            except Exception as e:
+                logger.error(f"Error running command {task.name}: {e}")
+                result, error = None, e
+            finished = time.monotonic()
+            self.run_histogram.record(finished - task.started)
+            
+            with self.condition:
+                if task.state != "running":
+                    # Timed out or cancelled while it ran; nobody is waiting for this result
+                    self.abandoned -= 1
+                    self.stats["late"] += 1
+                    continue
+                self.running.discard(task)
+                task.state, task.result, task.error, task.finished = (
+                    "done" if error is None else "failed", result, error, finished)
+                self.stats["completed" if error is None else "failed"] += 1
+            self._complete(task)
+    
+    def _watch(self):
+        # Fails running commands once they pass their deadline
+        while True:
+            expired = []
+            with self.condition:
+                now = time.monotonic()
+                deadlines = [task.deadline for task in self.running if task.deadline is not None]
+                for task in list(self.running):
+                    if task.deadline is not None and task.deadline <= now:
+                        self.running.discard(task)
+                        task.state, task.finished = "timed_out", now
+                        self.stats["timed_out"] += 1
+                        self._abandon()
+                        expired.append(task)
+                if not expired:
+                    future = [deadline for deadline in deadlines if deadline > now]
+                    self.condition.wait(min(future) - now if future else None)
+            for task in expired:
+                logger.warning(f"Command {task.name} timed out after {task.timeout:.1f}s")
+                self._complete(task)
+    
+    def _complete(self, task):
+        if task.on_done is not None:
+            self.post(lambda: task.on_done(task))
+
+# (ttl, stale) seconds per cached handler: answers younger than ttl are
+# served as they are, and for `stale` seconds after that they are still
+# served while a refresh runs in the background
+HANDLER_CACHE_TTLS = {"handle_weather": (600, 1800), "handle_news": (300, 900), "handle_help": (3600, 86400)}
+REFRESH_PRIORITY = -2
+
+class ResultCache:
+    # Memoized handler answers keyed by handler and normalized slots, least
+    # recently used first. `spawn` starts a background refresh and returns
+    # None if it could not; by default each refresh gets its own thread.
+    def __init__(self, max_entries=256, spawn=None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.spawn = spawn or self._spawn_thread
+        self.clock = clock
+        self.entries = OrderedDict()  # key -> (value, fresh until, stale until)
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "refresh_failures": 0,
+                      "evictions": 0}
+    
+    @staticmethod
+    def key(handler, slots):
+        # Slot order, case and spacing do not make a different entry
+        normalized = []
+        for name, value in sorted(slots.items()):
+            if isinstance(value, str):
+                value = " ".join(value.lower().split())
+            elif not isinstance(value, (int, float, type(None))):
+                value = json.dumps(value, sort_keys=True)
+            normalized.append((name, value))
+        return (handler, tuple(normalized))
+    
+    def fetch(self, key, compute, ttl, stale=0.0):
+        now = self.clock()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now >= entry[2]:
+                del self.entries[key]
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+                if now < entry[1]:
+                    self.stats["hits"] += 1
+                    return entry[0]
+                self.stats["stale_hits"] += 1
+                revalidate = key not in self.refreshing
+                if revalidate:
+                    self.refreshing.add(key)
+            else:
+                self.stats["misses"] += 1
         
-        # Simple suggestion based on keyword matching
-        for cmd_type, data in self.command_patterns.items():
-            for keyword in data["keywords"]:
-                if keyword.startswith(partial_command) and cmd_type not in suggestions:
-                    suggestions.append(cmd_type)
-                    break
-            
-            if len(suggestions) >= limit:
-                break
+        if entry is None:
+            value = compute()
+            self.store(key, value, ttl, stale)
+            return value
         
-        return suggestions
+        if revalidate and self.spawn(lambda: self._refresh(key, compute, ttl, stale)) is None:
+            with self.lock:
+                self.refreshing.discard(key)
+        return entry[0]
+    
+    def store(self, key, value, ttl, stale=0.0):
+        now = self.clock()
+        with self.lock:
+            self.entries[key] = (value, now + ttl, now + ttl + stale)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+    
+    def invalidate(self, handler=None):
+        # Drops every entry, or only those of one handler
+        with self.lock:
+            for key in [key for key in self.entries if handler is None or key[0] == handler]:
+                del self.entries[key]
+    
+    def _refresh(self, key, compute, ttl, stale):
+        try:
+            self.store(key, compute(), ttl, stale)
+            refreshed = True
+        except Exception as e:
+            logger.error(f"Error refreshing cached result for {key[0]}: {e}")
+            refreshed = False
+        with self.lock:
+            self.refreshing.discard(key)
+            self.stats["refreshes" if refreshed else "refresh_failures"] += 1
+    
+    @staticmethod
+    def _spawn_thread(refresh):
+        thread = threading.Thread(target=refresh, daemon=True)
+        thread.start()
+        return thread
+    
+    def __len__(self):
+        return len(self.entries)
 
 class CircularProgressBar(tk.Canvas):
     def __init__(self, parent, width, height, progress=0, fg_color="#00BFFF", bg_color="#1E1E1E", **kwargs):
@@ -771,7 +4448,7 @@ class HolographicDisplay(tk.Canvas):
         self.after(50, self.animate)
 
 class JarvisAssistant:
-    def __init__(self, root):
+    def __init__(self, root, profile_backend="file"):
         self.root = root
         self.root.title("J.A.R.V.I.S. Assistant")
         self.root.geometry("1200x800")
@@ -782,10 +4459,20 @@ class JarvisAssistant:
         ctk.set_default_color_theme("blue")
         
         # Initialize components
-        self.profile_manager = ProfileManager()
+        self.profile_manager = ProfileManager(backend=profile_backend)
         self.app_launcher = AppLauncher()
-        self.learning_system = LearningSystem()
+        self.learning_system = LearningShards(profile_name=self.current_profile_name, classify=True)
         self.telegram = TelegramIntegration()
+        self.auth_manager = AuthManager()
+        self.timings = StageTimings()
+        self.suggestion_pipeline = SuggestionPipeline(self.learning_system.get_command_suggestions,
+                                                      self.show_suggestions,
+                                                      lambda callback: self.root.after(0, callback))
+        # Handlers run off the Tk thread and reply through process_result
+        self.executor = CommandExecutor(lambda callback: self.root.after(0, callback))
+        # Weather, news and help answers, refreshed on the executor once stale
+        self.result_cache = ResultCache(spawn=lambda refresh: self.executor.submit("refresh", refresh,
+                                                                                     priority=REFRESH_PRIORITY))
         
         # Initialize speech recognition and text-to-speech engines
         self.recognizer = sr.Recognizer()
@@ -807,39 +4494,13 @@ class JarvisAssistant:
         # Authentication state
         self.authenticated = False
         
+        # Commands held back until the user says yes, e.g. a message to a guessed contact
+        self.pending_confirmation = []
+        
         # Command handlers
-        self.command_handlers = {
-            "message": self.handle_message,
-            "call": self.handle_call,
-            "alarm": self.handle_alarm,
-            "reminder": self.handle_reminder,
-            "timer": self.handle_timer,
-            "todo": self.handle_todo,
-            "weather": self.handle_weather,
-            "news": self.handle_news,
-            "music": self.handle_music,
-            "open": self.handle_open_app,
-            "launch": self.handle_open_app,
-            "start": self.handle_open_app,
-            "run": self.handle_open_app,
-            "spotify": self.handle_spotify,
-            "chrome": self.handle_chrome,
-            "firefox": self.handle_firefox,
-            "telegram": self.handle_telegram,
-            "browser": self.handle_chrome,
-            "search": self.handle_search,
-            "google": self.handle_search,
-            "find": self.handle_search,
-            "look up": self.handle_search,
-            "contact": self.handle_contact,
-            "profile": self.handle_profile,
-            "feedback": self.handle_feedback,
-            "help": self.handle_help,
-            "exit": self.handle_exit,
-            "authenticate": self.handle_authenticate,
-            "login": self.handle_authenticate,
-            "logout": self.handle_logout
-        }
+        self.command_handlers = {keyword: getattr(self, handler) for keyword, handler in COMMAND_HANDLERS.items()}
+        self.router = IntentRouter(self.command_handlers)
+        self.parser = CommandParser(self.router)
         
         # Create GUI elements
         self.create_widgets()
@@ -952,6 +4613,11 @@ class JarvisAssistant:
                 corner_radius=10
             ).pack(fill=tk.X, pady=5)
     
+    def current_profile_name(self):
+        # Which learning shard is in use; may be asked from the suggestion thread
+        profile = self.profile_manager.get_current_profile()
+        return profile.name if profile else None
+    
     def update_profile_display(self):
         profile = self.profile_manager.get_current_profile()
         if profile:
@@ -1277,21 +4943,16 @@ class JarvisAssistant:
         update_visualizations()
     
     def on_input_change(self, event):
-        # Update suggestions based on current input
-        current_text = self.user_input.get().strip()
-        if current_text:
-            suggestions = self.learning_system.get_command_suggestions(current_text)
-            
-            # Update suggestion buttons
-            for i, btn in enumerate(self.suggestion_buttons):
-                if i < len(suggestions):
-                    btn.configure(text=suggestions[i], state="normal", 
-                                 command=lambda s=suggestions[i]: self.use_suggestion(s))
-                else:
-                    btn.configure(text="", state="disabled")
-        else:
-            # Clear suggestions if input is empty
-            for btn in self.suggestion_buttons:
+        # Suggestions are looked up in the background and shown by show_suggestions
+        self.suggestion_pipeline.submit(self.user_input.get().strip())
+    
+    def show_suggestions(self, suggestions):
+        # Update suggestion buttons; an empty list clears them
+        for i, btn in enumerate(self.suggestion_buttons):
+            if i < len(suggestions):
+                btn.configure(text=suggestions[i], state="normal", 
+                             command=lambda s=suggestions[i]: self.use_suggestion(s))
+            else:
                 btn.configure(text="", state="disabled")
     
     def use_suggestion(self, suggestion):
@@ -1347,7 +5008,9 @@ class JarvisAssistant:
             while self.is_listening:
                 try:
                     self.status_label.config(text="Listening...", fg="#F44336")
+                    start = time.perf_counter()
                     audio = self.recognizer.listen(source, timeout=5, phrase_time_limit=5)
+                    heard = self.timings.since("listen", start)
                     
                     # Update voice visualizer with actual audio data
                     audio_data = np.frombuffer(audio.frame_data, dtype=np.int16)
@@ -1356,20 +5019,13 @@ class JarvisAssistant:
                     self.status_label.config(text="Processing...", fg="#FFC107")
                     
                     text = self.recognizer.recognize_google(audio)
+                    self.timings.since("recognize", heard)
                     if text.lower() in ["stop listening", "stop", "exit"]:
                         self.toggle_listening()
                         break
                     
-                    self.user_input.delete(0, tk.END)
-                    self.user_input.insert(0, text)
-                    self.update_conversation("user", text)
-                    
-                    # Add to profile's command history if a profile is active
-                    profile = self.profile_manager.get_current_profile()
-                    if profile:
-                        profile.add_command_to_history(text)
-                    
-                    self.process_command(text)
+                    # Handed to the Tk thread, which queues it and goes back to listening
+                    self.root.after(0, self.process_spoken_input, text, heard)
                     
                 except sr.WaitTimeoutError:
                     continue
@@ -1383,6 +5039,7 @@ class JarvisAssistant:
             self.status_label.config(text="Ready", fg="#4CAF50")
     
     def process_text_input(self):
+        received = time.perf_counter()
         text = self.user_input.get().strip()
         if text:
             self.update_conversation("user", text)
@@ -1393,24 +5050,61 @@ class JarvisAssistant:
             if profile:
                 profile.add_command_to_history(text)
             
-            self.process_command(text)
+            self.process_command(text, received=received)
     
-    def process_command(self, text):
-        text = text.lower()
+    def process_spoken_input(self, text, heard):
+        self.user_input.delete(0, tk.END)
+        self.user_input.insert(0, text)
+        self.update_conversation("user", text)
         
-        # Use learning system to predict command type
-        predicted_type = self.learning_system.predict_command_type(text)
+        profile = self.profile_manager.get_current_profile()
+        if profile:
+            profile.add_command_to_history(text)
         
-        # Check for command keywords
-        command_type = None
-        for keyword in self.command_handlers.keys():
-            if keyword in text:
-                command_type = keyword
-                break
+        self.process_command(text, received=heard)
+    
+    def process_command(self, text, priority=None, received=None):
+        # `received` is when speech ended or the command was typed, as a perf_counter() reading
+        start = time.perf_counter()
+        if received is None:
+            received = start
+        
+        # A yes runs the commands a handler asked about; a no drops them
+        if self.pending_confirmation:
+            pending, self.pending_confirmation = self.pending_confirmation, []
+            words = {word for word, _, _ in tokenize(text)}
+            if words & CONFIRM_WORDS:
+                for command in pending:
+                    command.slots["confirmed"] = True
+                    self.dispatch_command(command, priority, received)
+                return
+            if words & DECLINE_WORDS:
+                response = "Okay, I won't do that."
+                self.update_conversation("assistant", response)
+                self.speak(response, received)
+                return
         
-        # If no explicit keyword found, use the predicted type
-        if not command_type and predicted_type:
-            command_type = predicted_type
+        # Tokenized, routed and slot-filled once; handlers read the parsed command
+        command = self.parser.parse(text)
+        start = self.timings.since("parse", start)
+        
+        # If no explicit keyword found, use the learning system's prediction
+        if not command.intent:
+            predicted_type = self.learning_system.predict_command_type(command.text)
+            if predicted_type:
+                command = self.parser.parse(command.text, predicted_type)
+            self.timings.since("predict", start)
+        self.dispatch_command(command, priority, received)
+    
+    def ask_confirmation(self, commands):
+        # Tk thread only: the next input answers for these commands
+        self.pending_confirmation = commands
+    
+    def dispatch_command(self, command, priority=None, received=None):
+        if received is None:
+            received = time.perf_counter()
+        text = command.text
+        command_type = command.intent
         
         success = False
         try:
@@ -1424,19 +5118,26 @@ class JarvisAssistant:
                     if profile and not profile.is_authenticated():
                         response = "Authentication required. Please authenticate first by saying 'login' or 'authenticate'."
                         self.update_conversation("assistant", response)
-                        self.speak(response)
+                        self.speak(response, received)
                         return
                 
-                # Execute the appropriate handler
-                response = self.command_handlers[command_type](text)
-                
-                # Update profile's frequent commands
-                profile = self.profile_manager.get_current_profile()
-                if profile:
-                    profile.update_frequent_commands(command_type)
+                # Slow handlers are queued so input stays responsive; UI handlers run here
+                handler = COMMAND_HANDLERS.get(command_type, command_type)
+                if handler not in UI_HANDLERS:
+                    if priority is None:
+                        priority = HANDLER_PRIORITIES.get(handler, 0)
+                    task = self.executor.submit(text, self.command_handlers[command_type], (command,), priority,
+                                                HANDLER_TIMEOUTS.get(handler),
+                                                lambda task: self.process_result(task, received))
+                    if task is None:
+                        response = "I'm still working on your earlier requests. Please try again in a moment."
+                        self.update_conversation("assistant", response)
+                        self.speak(response, received)
+                    return
                 
-                # Learn from this command
-                self.learning_system.learn_from_command(text, command_type, True)
+                start = time.perf_counter()
+                response = self.command_handlers[command_type](command)
+                self.timings.since("handler", start)
                 success = True
             else:
                 # General conversation
@@ -1446,22 +5147,62 @@ class JarvisAssistant:
             response = f"I'm sorry, I encountered an error while processing your request. Please try again."
             success = False
         
+        self.finish_command(text, command_type, response, success, received)
+    
+    def process_result(self, task, received=None):
+        # Runs on the Tk thread once a queued command has finished or been given up on
+        command_type = task.args[0].intent
+        if task.started is not None:
+            self.timings.record("queue", task.started - task.submitted)
+        if task.state in ("done", "failed"):
+            self.timings.record("handler", task.finished - task.started)
+        if task.state == "done":
+            response, success = task.result, True
+        elif task.state == "failed":
+            self.handle_error(task.error, f"Error processing command: {task.name}")
+            response, success = "I'm sorry, I encountered an error while processing your request. Please try again.", False
+        elif task.state == "timed_out":
+            response, success = f"Sorry, '{task.name}' is taking too long, so I've stopped waiting for it.", False
+        elif task.state == "dropped":
+            response, success = f"I had too many requests waiting, so I skipped '{task.name}'.", False
+        else:
+            response, success = f"Cancelled '{task.name}'.", False
+        self.finish_command(task.name, command_type, response, success, received)
+    
+    def finish_command(self, text, command_type, response, success, received=None):
+        if success and command_type:
+            start = time.perf_counter()
+            # Update profile's frequent commands
+            profile = self.profile_manager.get_current_profile()
+            if profile:
+                profile.update_frequent_commands(command_type)
+            
+            # Learn from this command
+            self.learning_system.learn_from_command(text, command_type, True)
+            self.timings.since("learn", start)
+        
         # Update conversation and speak response
         self.update_conversation("assistant", response)
-        self.speak(response)
+        self.speak(response, received)
         
         # Update profile's learning data
         profile = self.profile_manager.get_current_profile()
         if profile:
+            start = time.perf_counter()
             profile.update_learning_data(text, response, success)
             self.profile_manager.save_profile(profile)
+            self.timings.since("save", start)
     
-    def speak(self, text):
+    def speak(self, text, received=None):
         def speak_thread():
             try:
+                if received is not None:
+                    self.timings.since("response", received)
+                start = time.perf_counter()
                 self.status_label.config(text="Speaking...", fg="#2196F3")
                 self.engine.say(text)
                 self.engine.runAndWait()
+                self.timings.since("speak", start)
                 self.status_label.config(text="Ready", fg="#4CAF50")
             except Exception as e:
                 self.handle_error(e, "Text-to-speech error")
@@ -1584,6 +5325,7 @@ class JarvisAssistant:
         tab_telegram = tabview.add("Telegram")
         tab_contacts = tabview.add("Contacts")
         tab_security = tabview.add("Security")
+        tab_performance = tabview.add("Performance")
         
         # Profile settings
         profile_frame = ctk.CTkFrame(tab_profile, fg_color="#2A2A2A")
@@ -1968,10 +5710,26 @@ class JarvisAssistant:
                     messagebox.showerror("Error", "Password is required", parent=password_dialog)
                     return
                 
-                # Set password
-                profile.authenticate(password)
-                messagebox.showinfo("Success", "Password set successfully", parent=password_dialog)
-                password_dialog.destroy()
+                def on_password_set():
+                    messagebox.showinfo("Success", "Password set successfully", parent=password_dialog)
+                    password_dialog.destroy()
+                
+                def on_password_failed():
+                    messagebox.showerror("Error", "Failed to set password", parent=password_dialog)
+                
+                def derive_in_background():
+                    # Calibration and key derivation take a noticeable fraction of a second
+                    try:
+                        self.auth_manager.set_password(profile, password)
+                        profile.start_session()
+                        self.profile_manager.save_profile(profile)
+                    except Exception as e:
+                        logger.error(f"Error setting password: {e}")
+                        self.root.after(0, on_password_failed)
+                        return
+                    self.root.after(0, on_password_set)
+                
+                threading.Thread(target=derive_in_background, daemon=True).start()
             
             ctk.CTkButton(
                 password_dialog, 
@@ -1993,6 +5751,15 @@ class JarvisAssistant:
             width=200
         ).pack(anchor=tk.W, padx=20, pady=10)
         
+        # Login latency
+        login_stats = self.auth_manager.latency_histogram.summary()
+        if login_stats["count"]:
+            login_text = (f"Login latency: p50 {login_stats['p50'] * 1000:.0f} ms, "
+                          f"p95 {login_stats['p95'] * 1000:.0f} ms ({login_stats['count']} logins)")
+        else:
+            login_text = "Login latency: no logins yet"
+        ctk.CTkLabel(security_frame, text=login_text).pack(anchor=tk.W, padx=20, pady=5)
+        
         # Export/Import encryption key
         key_frame = ctk.CTkFrame(security_frame, fg_color="#2A2A2A")
         key_frame.pack(fill=tk.X, padx=20, pady=10)
@@ -2043,13 +5810,64 @@ class JarvisAssistant:
             width=200
         ).pack(side=tk.LEFT, padx=5)
         
+        # Performance: latency of each pipeline stage this session
+        performance_frame = ctk.CTkFrame(tab_performance, fg_color="#2A2A2A")
+        performance_frame.pack(padx=20, pady=20, fill=tk.BOTH, expand=True)
+        
+        ctk.CTkLabel(performance_frame, text="Command Pipeline Latency", font=("Arial", 16, "bold")).pack(pady=10)
+        
+        timings_text = ctk.CTkTextbox(performance_frame, width=480, height=260, font=("Courier", 12))
+        timings_text.pack(padx=20, pady=10, fill=tk.BOTH, expand=True)
+        
+        def refresh_timings():
+            timings_text.configure(state="normal")
+            timings_text.delete("1.0", tk.END)
+            timings_text.insert("1.0", self.timings.report())
+            timings_text.configure(state="disabled")
+        
+        def export_timings():
+            file_path = tk.filedialog.asksaveasfilename(
+                defaultextension=".json",
+                filetypes=[("JSON files", "*.json"), ("All files", "*.*")],
+                title="Export Pipeline Timings"
+            )
+            
+            if file_path:
+                if self.timings.dump(file_path):
+                    messagebox.showinfo("Success", "Pipeline timings exported successfully", parent=settings_window)
+                else:
+                    messagebox.showerror("Error", "Failed to export pipeline timings", parent=settings_window)
+        
+        refresh_timings()
+        timings_buttons = ctk.CTkFrame(performance_frame, fg_color="#2A2A2A")
+        timings_buttons.pack(fill=tk.X, padx=20, pady=10)
+        
+        ctk.CTkButton(
+            timings_buttons, 
+            text="Refresh", 
+            command=refresh_timings,
+            fg_color="#333333",
+            text_color="#FFFFFF",
+            hover_color="#444444",
+            width=200
+        ).pack(side=tk.LEFT, padx=5)
+        
+        ctk.CTkButton(
+            timings_buttons, 
+            text="Export Timings", 
+            command=export_timings,
+            fg_color="#333333",
+            text_color="#FFFFFF",
+            hover_color="#444444",
+            width=200
+        ).pack(side=tk.LEFT, padx=5)
+        
         # Save button
         def save_settings():
             # Check if name changed
-            new_name = name_var.get()
+            new_name = name_var.get().strip()
             old_name = profile.name
             
-            profile.name = new_name
             profile.location = location_var.get()
             profile.preferences["voice_gender"] = voice_var.get()
             profile.preferences["voice_speed"] = speed_var.get()
@@ -2072,30 +5890,17 @@ class JarvisAssistant:
             if password_var.get() and not profile.is_authenticated():
                 messagebox.showinfo("Info", "Please set a password to enable password protection", parent=settings_window)
             
-            # Handle profile name change
-            if new_name != old_name:
-                # Create new profile with new name
-                self.profile_manager.create_profile(new_name)
-                new_profile = self.profile_manager.profiles[new_name]
-                
-                # Copy all data from old profile
-                new_profile.location = profile.location
-                new_profile.preferences = profile.preferences
-                new_profile.command_history = profile.command_history
-                new_profile.learning_data = profile.learning_data
-                new_profile.contacts = profile.contacts
-                new_profile.telegram_session = profile.telegram_session
-                new_profile.authenticated = profile.authenticated
-                new_profile.auth_token = profile.auth_token
-                new_profile.auth_expiry = profile.auth_expiry
-                
-                # Save new profile and delete old one
-                self.profile_manager.save_profile(new_profile)
-                self.profile_manager.delete_profile(old_name)
-                self.profile_manager.set_current_profile(new_name)
-            else:
-                # Just save the updated profile
-                self.profile_manager.save_profile(profile)
+            # Fields were edited in place, so write a full snapshot
+            self.profile_manager.save_profile(profile, snapshot=True)
+            
+            # Handle profile name change. The store moves the profile with its
+            # saved history and contacts rather than copying them to a new one.
+            if new_name and new_name != old_name:
+                if self.profile_manager.rename_profile(old_name, new_name):
+                    self.learning_system.rename_profile(old_name, new_name)
+                else:
+                    messagebox.showerror("Error", f"Could not rename profile to {new_name}", parent=settings_window)
+                    return
             
             self.update_profile_display()
             settings_window.destroy()
@@ -2115,7 +5920,12 @@ class JarvisAssistant:
         save_button.pack(pady=20)
     
     # Command handlers
-    def handle_message(self, text):
+    def cached_response(self, handler, slots, compute):
+        # Answers repeated within the handler's TTL come from the result cache
+        ttl, stale = HANDLER_CACHE_TTLS[handler]
+        return self.result_cache.fetch(ResultCache.key(handler, slots), compute, ttl, stale)
+    
+    def handle_message(self, command):
         profile = self.profile_manager.get_current_profile()
         
         # Check if Telegram is configured
@@ -2131,30 +5941,20 @@ class JarvisAssistant:
             else:
                 return "Telegram is not configured. Please set up your Telegram account in settings."
         
-        # Extract recipient and message content
-        recipient = None
-        message_content = None
-        
-        if "message" in text and "to" in text and "saying" in text:
-            # Format: "message to [recipient] saying [content]"
-            parts = text.split("to")
-            if len(parts) > 1:
-                recipient_parts = parts[1].split("saying")
-                if len(recipient_parts) > 1:
-                    recipient = recipient_parts[0].strip()
-                    message_content = recipient_parts[1].strip()
-        elif "message" in text and "to" in text:
-            # Format: "message to [recipient]"
-            parts = text.split("to")
-            if len(parts) > 1:
-                recipient = parts[1].strip()
-                message_content = None  # Will prompt for message content
-        
-        # Check if we have a contact with this name
+        # "message to [recipient] saying [content]"; without content, prompt for it
+        recipient = command.slot("recipient")
+        message_content = command.slot("body")
+        
+        # Check if we have a contact with this name, allowing for misheard names.
+        # A guess is confirmed before anything is sent to that contact's account.
+        contact = None
         if recipient and profile:
-            contact = profile.get_contact(recipient)
+            contact, certain = profile.resolve_contact(recipient)
             if contact and contact.telegram_username:
-                recipient = contact.telegram_username if not contact.telegram_username.startswith('@') else contact.telegram_username
+                if message_content and not certain and not command.slot("confirmed"):
+                    self.root.after(0, self.ask_confirmation, [command])
+                    return f"Did you mean {contact.name}? Say yes to send the message, or no to cancel."
+                recipient = contact.telegram_username
         
         if recipient and message_content:
             # Send the message
@@ -2162,10 +5962,8 @@ class JarvisAssistant:
             
             if success:
                 # Update contact's last contacted time if it's a known contact
-                if profile:
-                    contact = profile.get_contact(recipient)
-                    if contact:
-                        contact.update_contact_time()
+                if contact:
+                    profile.mark_contacted(contact.name)
                 
                 return response
             else:
@@ -2175,66 +5973,50 @@ class JarvisAssistant:
         else:
             return "Who would you like to message?"
     
-    def handle_call(self, text):
-        # Extract recipient
-        if "call" in text:
-            words = text.split()
-            call_index = words.index("call")
-            if call_index + 1 < len(words):
-                recipient = words[call_index + 1]
-                return f"Calling {recipient}... Note: Actual calling functionality is not implemented in this demo."
+    def handle_call(self, command):
+        recipient = command.slot("recipient")
+        if recipient:
+            return f"Calling {recipient}... Note: Actual calling functionality is not implemented in this demo."
         return "Who would you like to call?"
     
-    def handle_alarm(self, text):
-        # Extract time
-        if "alarm" in text and "for" in text:
-            parts = text.split("for")
-            if len(parts) > 1:
-                time_str = parts[1].strip()
-                return f"Alarm set for {time_str}."
+    def handle_alarm(self, command):
+        time_expression = command.slot("time")
+        if time_expression:
+            return f"Alarm set for {time_expression['text']}."
         return "When would you like to set the alarm for?"
     
-    def handle_reminder(self, text):
-        # Extract reminder details
-        if "remind" in text and "to" in text:
-            parts = text.split("to")
-            if len(parts) > 1:
-                task = parts[1].strip()
-                return f"I'll remind you to {task}. When would you like to be reminded?"
+    def handle_reminder(self, command):
+        task = command.slot("task")
+        if task:
+            return f"I'll remind you to {task}. When would you like to be reminded?"
         return "What would you like me to remind you about?"
     
-    def handle_timer(self, text):
-        # Extract duration
-        if "timer" in text and "for" in text:
-            parts = text.split("for")
-            if len(parts) > 1:
-                duration = parts[1].strip()
-                return f"Timer set for {duration}."
+    def handle_timer(self, command):
+        time_expression = command.slot("time")
+        if time_expression:
+            return f"Timer set for {time_expression['text']}."
         return "How long would you like to set the timer for?"
     
-    def handle_todo(self, text):
+    def handle_todo(self, command):
         # Handle to-do list operations
-        if "add" in text and "to" in text and "list" in text:
-            parts = text.split("add")[1].split("to")[0].strip()
-            return f"Added '{parts}' to your to-do list."
-        elif "show" in text and "list" in text:
+        task = command.slot("task")
+        if task and command.has("list"):
+            return f"Added '{task}' to your to-do list."
+        elif command.has("show") and command.has("list"):
             return "Here's your to-do list: 1. Example task"
         return "What would you like to do with your to-do list?"
     
-    def handle_weather(self, text):
-        # Extract location
-        location = "your current location"
-        if "weather" in text and "in" in text:
-            parts = text.split("in")
-            if len(parts) > 1:
-                location = parts[1].strip()
+    def handle_weather(self, command):
+        location = command.slot("location")
         
         # Use profile location if available and no specific location mentioned
-        if location == "your current location":
+        if not location:
             profile = self.profile_manager.get_current_profile()
-            if profile and profile.location:
-                location = profile.location
+            location = profile.location if profile and profile.location else "your current location"
         
+        return self.cached_response("handle_weather", {"location": location}, lambda: self.weather_report(location))
+    
+    def weather_report(self, location):
         # Simulate weather data
         conditions = ["sunny", "partly cloudy", "cloudy", "rainy", "stormy"]
         temps = range(60, 85)
@@ -2244,53 +6026,20 @@ class JarvisAssistant:
         
         return f"The weather in {location} is currently {condition} with a temperature of {temp}°F."
     
-    def handle_news(self, text):
-        # Extract topic
-        topic = "general"
-        if "news" in text and "about" in text:
-            parts = text.split("about")
-            if len(parts) > 1:
-                topic = parts[1].strip()
-        
-        return f"Here are the latest headlines about {topic}: [News headlines would appear here]"
-    
-    def handle_music(self, text):
-        # Extract artist/song
-        if "play" in text:
-            parts = text.split("play")
-            if len(parts) > 1:
-                song = parts[1].strip()
-                return f"Playing {song}..."
+    def handle_news(self, command):
+        topic = command.slot("topic", "general")
+        return self.cached_response("handle_news", {"topic": topic},
+                                    lambda: f"Here are the latest headlines about {topic}: [News headlines would appear here]")
+    
+    def handle_music(self, command):
+        song = command.slot("song")
+        if song:
+            return f"Playing {song}..."
         return "What music would you like me to play?"
     
-    def handle_open_app(self, text):
-        # Extract app name
-        app_name = None
-        
-        # Check for specific app names first
-        for app in ["spotify", "chrome", "firefox", "telegram", "notepad", "calculator"]:
-            if app in text.lower():
-                app_name = app
-                break
-        
-        # If no specific app found, look for "open" + app name pattern
-        if not app_name:
-            if "open" in text:
-                parts = text.split("open")
-                if len(parts) > 1:
-                    app_name = parts[1].strip()
-            elif "launch" in text:
-                parts = text.split("launch")
-                if len(parts) > 1:
-                    app_name = parts[1].strip()
-            elif "start" in text:
-                parts = text.split("start")
-                if len(parts) > 1:
-                    app_name = parts[1].strip()
-            elif "run" in text:
-                parts = text.split("run")
-                if len(parts) > 1:
-                    app_name = parts[1].strip()
+    def handle_open_app(self, command):
+        # A known app named anywhere, otherwise whatever follows "open", "launch", "start" or "run"
+        app_name = command.slot("app") or command.slot("target")
         
         if app_name:
             success, message = self.app_launcher.launch_app(app_name)
@@ -2306,135 +6055,56 @@ class JarvisAssistant:
         
         return "Which application would you like to open?"
     
-    def handle_spotify(self, text):
+    def handle_spotify(self, command):
         # Launch Spotify
         success, message = self.app_launcher.launch_app("spotify")
         
         # If just launching Spotify
-        if "open" in text or "launch" in text or "start" in text or "run" in text:
+        if command.has("open", "launch", "start", "run"):
             return message
         
         # If playing specific music
-        if "play" in text:
-            parts = text.split("play")
-            if len(parts) > 1:
-                song = parts[1].strip()
-                return f"Opening Spotify and playing {song}..."
+        song = command.slot("song")
+        if song:
+            return f"Opening Spotify and playing {song}..."
         
         return message
     
-    def handle_chrome(self, text):
-        # Launch Chrome
-        success, message = self.app_launcher.launch_app("chrome")
-        
-        # If just launching Chrome
-        if "open" in text or "launch" in text or "start" in text or "run" in text:
-            if not ("go to" in text or "visit" in text or "open" in text and ".com" in text):
-                return message
-        
-        # If visiting a website
-        website = None
-        if "go to" in text:
-            parts = text.split("go to")
-            if len(parts) > 1:
-                website = parts[1].strip()
-        elif "visit" in text:
-            parts = text.split("visit")
-            if len(parts) > 1:
-                website = parts[1].strip()
-        elif "open" in text and ".com" in text:
-            parts = text.split("open")
-            if len(parts) > 1:
-                for word in parts[1].split():
-                    if ".com" in word or ".org" in word or ".net" in word:
-                        website = word
-                        break
-        
-        if website:
-            success, web_message = self.app_launcher.open_website(website, "chrome")
-            return web_message
-        
-        return message
+    def handle_chrome(self, command):
+        return self._open_browser("chrome", command)
     
-    def handle_firefox(self, text):
-        # Launch Firefox
-        success, message = self.app_launcher.launch_app("firefox")
-        
-        # If just launching Firefox
-        if "open" in text or "launch" in text or "start" in text or "run" in text:
-            if not ("go to" in text or "visit" in text or "open" in text and ".com" in text):
-                return message
-        
-        # If visiting a website
-        website = None
-        if "go to" in text:
-            parts = text.split("go to")
-            if len(parts) > 1:
-                website = parts[1].strip()
-        elif "visit" in text:
-            parts = text.split("visit")
-            if len(parts) > 1:
-                website = parts[1].strip()
-        elif "open" in text and ".com" in text:
-            parts = text.split("open")
-            if len(parts) > 1:
-                for word in parts[1].split():
-                    if ".com" in word or ".org" in word or ".net" in word:
-                        website = word
-                        break
+    def handle_firefox(self, command):
+        return self._open_browser("firefox", command)
+    
+    def _open_browser(self, browser, command):
+        success, message = self.app_launcher.launch_app(browser)
         
+        # An address anywhere in the command, or else a website after "go to" or "visit"
+        website = command.slot("url") or command.slot("website")
         if website:
-            success, web_message = self.app_launcher.open_website(website, "firefox")
+            success, web_message = self.app_launcher.open_website(website, browser)
             return web_message
         
         return message
     
-    def handle_telegram(self, text):
+    def handle_telegram(self, command):
         # Launch Telegram
         success, message = self.app_launcher.launch_app("telegram")
         
         # If just launching Telegram
-        if "open" in text or "launch" in text or "start" in text or "run" in text:
+        if command.has("open", "launch", "start", "run"):
             return message
         
-        # If sending a message, delegate to handle_message
-        if "message" in text or "send" in text:
-            return self.handle_message(text)
+        # If sending a message, delegate to handle_message with its slots
+        if command.has("message", "send"):
+            return self.handle_message(self.parser.parse(command.text, "message"))
         
         return message
     
-    def handle_search(self, text):
-        # Extract search query and browser preference
-        query = None
-        browser = None
-        
-        # Check for browser preference
-        if "chrome" in text:
-            browser = "chrome"
-        elif "firefox" in text:
-            browser = "firefox"
-        
-        # Extract query
-        if "search for" in text:
-            parts = text.split("search for")
-            if len(parts) > 1:
-                query = parts[1].strip()
-        elif "search" in text:
-            parts = text.split("search")
-            if len(parts) > 1:
-                query = parts[1].strip()
-        elif "google" in text:
-            parts = text.split("google")
-            if len(parts) > 1:
-                query = parts[1].strip()
-        elif "find" in text:
-            parts = text.split("find")
-            if len(parts) > 1:
-                query = parts[1].strip()
-        elif "look up" in text:
-            parts = text.split("look up")
-            if len(parts) > 1:
-                query = parts[1].strip()
+    def handle_search(self, command):
+        # The query, and the browser if one is named
+        query = command.slot("query")
+        browser = command.slot("app") if command.slot("app") in ("chrome", "firefox") else None
         
         if query:
             success, message = self.app_launcher.search_web(query, browser)
@@ -2442,21 +6112,17 @@ class JarvisAssistant:
         
         return "What would you like to search for?"
     
-    def handle_contact(self, text):
+    def handle_contact(self, command):
         profile = self.profile_manager.get_current_profile()
         
         if not profile:
             return "Please create a profile first to manage contacts."
         
+        # The name after "named", or else after "contact"
+        name = command.slot("name")
+        
         # Add contact
-        if "add" in text and "contact" in text:
-            # Extract contact name
-            name = None
-            if "named" in text:
-                parts = text.split("named")
-                if len(parts) > 1:
-                    name = parts[1].strip()
-            
+        if command.has("add") and command.has("contact"):
             if name:
                 # Check if contact already exists
                 if profile.get_contact(name):
@@ -2472,7 +6138,7 @@ class JarvisAssistant:
                 return "What is the name of the contact you'd like to add?"
         
         # List contacts
-        elif "list" in text and "contacts" in text or "show" in text and "contacts" in text:
+        elif command.has("list", "show") and command.has("contacts"):
             contacts = profile.get_all_contacts()
             
             if not contacts:
@@ -2482,13 +6148,7 @@ class JarvisAssistant:
             return f"Here are your contacts:\n{contact_list}"
         
         # Remove contact
-        elif "remove" in text and "contact" in text or "delete" in text and "contact" in text:
-            # Extract contact name
-            name = None
-            parts = text.split("contact")
-            if len(parts) > 1:
-                name = parts[1].strip()
-            
+        elif command.has("remove", "delete") and command.has("contact"):
             if name:
                 if profile.remove_contact(name):
                     self.profile_manager.save_profile(profile)
@@ -2499,13 +6159,7 @@ class JarvisAssistant:
                 return "Which contact would you like to remove?"
         
         # Find contact
-        elif "find" in text and "contact" in text:
-            # Extract contact name
-            name = None
-            parts = text.split("contact")
-            if len(parts) > 1:
-                name = parts[1].strip()
-            
+        elif command.has("find") and command.has("contact"):
             if name:
                 contact = profile.get_contact(name)
                 if contact:
@@ -2528,12 +6182,12 @@ class JarvisAssistant:
         
         return "What would you like to do with your contacts? You can add, list, find, or remove contacts."
     
-    def handle_profile(self, text):
+    def handle_profile(self, command):
         # Handle profile-related commands
-        if "create" in text and "profile" in text:
+        if command.has("create") and command.has("profile"):
             return "Let's create a new profile. What name would you like to use?"
         
-        elif "switch" in text and "profile" in text:
+        elif command.has("switch") and command.has("profile"):
             profile_names = self.profile_manager.get_profile_names()
             if not profile_names:
                 return "You don't have any profiles yet. Let's create one."
@@ -2541,17 +6195,13 @@ class JarvisAssistant:
             profiles_str = ", ".join(profile_names)
             return f"Available profiles: {profiles_str}. Which one would you like to switch to?"
         
-        elif "delete" in text and "profile" in text:
-            current_profile = self.profile_manager.get_current_profile()
-            if current_profile:
-                return f"Are you sure you want to delete the profile '{current_profile.name}'? Say 'yes, delete profile' to confirm."
-            return "No active profile to delete."
-        
-        elif "yes, delete profile" in text:
+        # The confirmation is checked first, since it also asks to delete the profile
+        elif command.has("yes") and command.has("delete profile"):
             current_profile = self.profile_manager.get_current_profile()
             if current_profile:
                 name = current_profile.name
                 if self.profile_manager.delete_profile(name):
+                    self.learning_system.delete_profile(name)
                     # Switch to another profile or create default
                     profile_names = self.profile_manager.get_profile_names()
                     if profile_names:
@@ -2564,13 +6214,19 @@ class JarvisAssistant:
                     return f"Profile '{name}' has been deleted."
             return "Failed to delete profile."
         
+        elif command.has("delete") and command.has("profile"):
+            current_profile = self.profile_manager.get_current_profile()
+            if current_profile:
+                return f"Are you sure you want to delete the profile '{current_profile.name}'? Say 'yes, delete profile' to confirm."
+            return "No active profile to delete."
+        
         return "What would you like to do with your profile? You can create, switch, or delete profiles."
     
-    def handle_feedback(self, text):
+    def handle_feedback(self, command):
         self.show_feedback_dialog()
         return "Thank you for providing feedback!"
     
-    def handle_authenticate(self, text):
+    def handle_authenticate(self, command):
         profile = self.profile_manager.get_current_profile()
         if not profile:
             return "Please create a profile first."
@@ -2578,21 +6234,30 @@ class JarvisAssistant:
         if profile.is_authenticated():
             return "You are already authenticated."
         
+        if profile.auth_verifier is None:
+            return "This profile has no password yet. Please set one in settings first."
+        
         # Ask for password
         password = simpledialog.askstring("Authentication", "Please enter your password:", show="*", parent=self.root)
         
         if password:
-            token = profile.authenticate(password)
-            if profile.is_authenticated():
-                self.update_auth_status(True)
-                self.profile_manager.save_profile(profile)
-                return "Authentication successful."
-            else:
-                return "Authentication failed. Incorrect password."
+            def on_result(token):
+                if token:
+                    self.update_auth_status(True)
+                    self.profile_manager.save_profile(profile)
+                    response = "Authentication successful."
+                else:
+                    response = "Authentication failed. Incorrect password."
+                self.update_conversation("assistant", response)
+                self.speak(response)
+            
+            # Key derivation runs on a worker so the GUI stays responsive
+            self.auth_manager.authenticate_async(profile, password, lambda token: self.root.after(0, on_result, token))
+            return "Verifying your password..."
         else:
             return "Authentication cancelled."
     
-    def handle_logout(self, text):
+    def handle_logout(self, command):
         profile = self.profile_manager.get_current_profile()
         if not profile:
             return "No active profile."
@@ -2601,11 +6266,39 @@ class JarvisAssistant:
             return "You are not currently authenticated."
         
         profile.logout()
+        self.auth_manager.forget_session(profile.name)
         self.update_auth_status(False)
         self.profile_manager.save_profile(profile)
         return "You have been logged out."
     
-    def handle_help(self, text):
+    def handle_repeat(self, command):
+        # "repeat my last 3 commands"; the request itself is the newest history entry
+        profile = self.profile_manager.get_current_profile()
+        if not profile:
+            return "No active profile."
+        
+        # Only commands whose handler is safe to run again
+        count = min(command.slot("number", 1), 20)
+        others, sends = plan_repeats(self.parser, reversed(profile.get_recent_commands(count + 1)[1:]))
+        if not others and not sends:
+            return "There are no earlier commands I can repeat."
+        
+        # Queued behind anything new; messages wait for a yes
+        for parsed in others:
+            self.root.after(0, self.dispatch_command, parsed, REPEAT_PRIORITY)
+        
+        replies = []
+        if others:
+            replies.append(f"Repeating: {', '.join(parsed.text for parsed in others)}.")
+        if sends:
+            self.pending_confirmation = sends
+            replies.append(f"Should I send {', '.join(parsed.text for parsed in sends)} again? Say yes to send.")
+        return " ".join(replies)
+    
+    def handle_help(self, command):
+        return self.cached_response("handle_help", {}, self.help_text)
+    
+    def help_text(self):
         return """I can help you with:
 1. Sending messages via Telegram
 2. Opening applications like Spotify, Chrome, Firefox, and Telegram
@@ -2618,11 +6311,24 @@ class JarvisAssistant:
 
 Just ask me what you need!"""
     
-    def handle_exit(self, text):
+    def handle_cancel(self, command):
+        # Drops every queued command and stops waiting for the ones running
+        cancelled = self.executor.cancel_all()
+        if cancelled:
+            return f"Cancelled {cancelled} pending request{'s' if cancelled != 1 else ''}."
+        return "There is nothing to cancel."
+    
+    def handle_exit(self, command):
+        self.executor.cancel_all()
+        logger.info(f"Command executor stats: {self.executor.metrics()}")
+        logger.info(f"Result cache stats: {self.result_cache.stats}")
+        
         # Save current profile before exiting
         profile = self.profile_manager.get_current_profile()
         if profile:
             self.profile_manager.save_profile(profile)
+        self.profile_manager.flush(timeout=5)
+        self.learning_system.flush(timeout=5)
         
         # Disconnect Telegram if connected
         if self.telegram.connected:
@@ -2651,7 +6357,7 @@ Just ask me what you need!"""
             return "I am J.A.R.V.I.S., Just A Rather Very Intelligent System. How may I assist you today?"
         
         if "what can you do" in text:
-            return self.handle_help(text)
+            return self.handle_help(self.parser.parse(text, "help"))
         
         # If no specific pattern is matched, provide a general response
         return "I'm not sure I understand. Can you rephrase that or ask me something specific?"
@@ -2685,6 +6391,806 @@ class JarvisTests(unittest.TestCase):
         self.assertEqual(profile.name, "TestUser")
         self.assertEqual(profile.location, "TestLocation")
     
+    def test_profile_index(self):
+        self.profile_manager.create_profile("IndexedUser", "Somewhere")
+        
+        # A fresh manager lists the profile from the index without decrypting it
+        manager = ProfileManager(self.test_dir, self.profile_manager.encryption_key)
+        self.assertIn("IndexedUser", manager.get_profile_names())
+        self.assertEqual(manager.profiles, {})
+        self.assertEqual(manager.store.index.get("IndexedUser")["format_version"], PROFILE_FORMAT_BINARY)
+        
+        # The profile is decrypted once it is selected
+        self.assertTrue(manager.set_current_profile("IndexedUser"))
+        self.assertEqual(manager.get_current_profile().location, "Somewhere")
+    
+    def test_profile_journal(self):
+        manager = ProfileManager(self.test_dir, journal_compact_threshold=1000)
+        manager.create_profile("JournalUser")
+        profile = manager.load_profile("JournalUser")
+        snapshot_size = os.path.getsize(manager.store._profile_path("JournalUser"))
+        
+        profile.add_command_to_history("open chrome")
+        profile.add_contact(Contact("Alice", "@alice"))
+        profile.update_frequent_commands("open")
+        manager.save_profile(profile)
+        self.assertTrue(manager.flush(timeout=5))
+        
+        # Only the journal grew
+        self.assertEqual(os.path.getsize(manager.store._profile_path("JournalUser")), snapshot_size)
+        self.assertEqual(manager.store.journal_sizes["JournalUser"], 3)
+        
+        # Snapshot plus journal rebuilds the same profile
+        reloaded = ProfileManager(self.test_dir, manager.encryption_key).load_profile("JournalUser")
+        self.assertEqual(reloaded.command_history, profile.command_history)
+        self.assertEqual(reloaded.get_contact("alice").telegram_username, "@alice")
+        self.assertEqual(reloaded.preferences["frequent_commands"], {"open": 1})
+        
+        # Compaction folds the journal into the snapshot
+        self.assertTrue(manager.compact_profile("JournalUser"))
+        self.assertFalse(os.path.exists(manager.store._journal_path("JournalUser")))
+        reloaded = ProfileManager(self.test_dir, manager.encryption_key).load_profile("JournalUser")
+        self.assertEqual(reloaded.journal_seq, 3)
+        self.assertEqual(reloaded.command_history, profile.command_history)
+    
+    def test_write_behind_saves(self):
+        manager = ProfileManager(self.test_dir, save_delay=60)
+        manager.create_profile("BusyUser")
+        profile = manager.load_profile("BusyUser")
+        
+        # Nothing changed, nothing to write
+        manager.save_profile(profile)
+        self.assertEqual(manager.get_save_stats()["skipped_clean"], 1)
+        
+        # A burst of saves inside the window is written once
+        for i in range(10):
+            profile.add_command_to_history(f"command {i}")
+            manager.save_profile(profile)
+        self.assertTrue(manager.flush(timeout=5))
+        
+        stats = manager.get_save_stats()
+        self.assertEqual(stats["requested"], 10)
+        self.assertEqual(stats["coalesced"], 9)
+        self.assertEqual(stats["executed"], 1)
+        self.assertFalse(profile.is_dirty())
+        self.assertEqual(manager.store.journal_sizes["BusyUser"], 10)
+    
+    def test_profile_binary_format(self):
+        profile = UserProfile("Binary", "Lab")
+        profile.add_command_to_history("open chrome")
+        profile.add_feedback(4, "good")
+        contact = Contact("Bob", "@bob", "555", None)
+        contact.update_contact_time()
+        profile.add_contact(contact)
+        
+        cipher_suite = self.profile_manager.cipher_suite
+        data = ProfileCodec.encode(profile, cipher_suite)
+        self.assertEqual(detect_profile_format(data[:PROFILE_HEADER_SIZE]), PROFILE_FORMAT_BINARY)
+        
+        decoded = ProfileCodec.decode(data, cipher_suite)
+        self.assertEqual(decoded.command_history, profile.command_history)
+        self.assertEqual(decoded.preferences, profile.preferences)
+        self.assertEqual(decoded.get_contact("bob").last_contacted, contact.last_contacted)
+        self.assertIsNone(decoded.get_contact("bob").email)
+        
+        # Pickled profiles from older versions are migrated on load
+        legacy_path = os.path.join(self.test_dir, "Legacy.profile")
+        with open(legacy_path, 'wb') as f:
+            f.write(cipher_suite.encrypt(pickle.dumps(UserProfile("Legacy"))))
+        self.profile_manager.load_profiles()
+        self.assertTrue(self.profile_manager.set_current_profile("Legacy"))
+        self.assertTrue(self.profile_manager.flush(timeout=5))
+        with open(legacy_path, 'rb') as f:
+            self.assertTrue(f.read().startswith(PROFILE_MAGIC))
+    
+    def test_authentication(self):
+        auth_manager = AuthManager(target_latency=0.01, min_iterations=1000)
+        profile = UserProfile("Secure")
+        
+        # Without a password set, no password is accepted or stored
+        self.assertIsNone(auth_manager.authenticate(profile, "hunter2"))
+        self.assertIsNone(profile.auth_verifier)
+        self.assertFalse(profile.is_authenticated())
+        
+        auth_manager.set_password(profile, "hunter2")
+        self.assertEqual(profile.auth_verifier["iterations"], auth_manager.calibrate())
+        auth_manager.forget_session("Secure")
+        self.assertIsNone(auth_manager.authenticate(profile, "wrong"))
+        self.assertFalse(profile.is_authenticated())
+        
+        # The derived key is cached for the rest of the session
+        self.assertIsNotNone(auth_manager.authenticate(profile, "hunter2"))
+        self.assertIsNotNone(auth_manager.authenticate(profile, "hunter2"))
+        self.assertEqual(auth_manager.cache_hits, 1)
+        self.assertIsNotNone(auth_manager.get_session_key("Secure"))
+        self.assertEqual(auth_manager.latency_histogram.summary()["count"], 4)
+        
+        # The verifier survives a save and reload
+        decoded = ProfileCodec.decode(ProfileCodec.encode(profile, self.profile_manager.cipher_suite),
+                                      self.profile_manager.cipher_suite)
+        self.assertEqual(decoded.auth_verifier, profile.auth_verifier)
+    
+    def test_bulk_load_and_key_rotation(self):
+        for name in ("Ann", "Ben", "Cal"):
+            self.profile_manager.create_profile(name)
+            profile = self.profile_manager.load_profile(name)
+            profile.add_command_to_history(f"hello from {name}")
+            self.profile_manager.save_profile(profile)
+        self.assertTrue(self.profile_manager.flush(timeout=5))
+        
+        # Rotate through a real process pool
+        self.profile_manager.store.bulk_engine = BulkProfileEngine(max_workers=2, serial_threshold=0)
+        old_key = self.profile_manager.encryption_key
+        key_path = os.path.join(self.test_dir, "imported.key")
+        with open(key_path, 'wb') as f:
+            f.write(Fernet.generate_key())
+        self.assertTrue(self.profile_manager.import_encryption_key(key_path))
+        self.assertNotEqual(self.profile_manager.encryption_key, old_key)
+        self.assertEqual([f for f in os.listdir(self.test_dir) if f.endswith(".rotating")], [])
+        
+        # Everything is readable with the new key, including journaled changes
+        progress = []
+        manager = ProfileManager(self.test_dir, self.profile_manager.encryption_key)
+        manager.store.bulk_engine = BulkProfileEngine(max_workers=2, serial_threshold=0)
+        self.assertEqual(manager.load_all_profiles(lambda done, total, name: progress.append(done)), 3)
+        self.assertEqual(manager.profiles["Ben"].command_history[-1]["command"], "hello from Ben")
+        self.assertEqual(sorted(progress), [1, 2, 3])
+        
+        # And no longer with the old one
+        self.assertIsNone(ProfileManager(self.test_dir, old_key).load_profile("Ann"))
+    
+    def test_key_rotation_skips_unreadable_profiles(self):
+        self.profile_manager.create_profile("Ann")
+        stranger = ProfileManager(self.test_dir)
+        stranger.create_profile("Zed")
+        self.assertIsNone(self.profile_manager.load_profile("Zed"))
+        
+        # A profile under some other key is reported, not returned as loaded
+        manager = ProfileManager(self.test_dir, self.profile_manager.encryption_key)
+        self.assertEqual(manager.load_all_profiles(), 1)
+        self.assertEqual(sorted(manager.profiles), ["Ann"])
+        
+        # and does not stop the rest from being rotated
+        new_key = Fernet.generate_key()
+        self.assertTrue(self.profile_manager.rotate_encryption_key(new_key))
+        self.assertEqual(self.profile_manager.encryption_key, new_key)
+        self.assertEqual([f for f in os.listdir(self.test_dir) if f.endswith(".rotating")], [])
+        self.assertIsNotNone(ProfileManager(self.test_dir, new_key).load_profile("Ann"))
+        self.assertIsNotNone(ProfileManager(self.test_dir, stranger.encryption_key).load_profile("Zed"))
+    
+    def test_sqlite_profile_store(self):
+        db_path = os.path.join(self.test_dir, "profiles.db")
+        manager = ProfileManager(self.test_dir, store=SQLiteProfileStore(db_path))
+        manager.create_profile("Dana")
+        profile = manager.load_profile("Dana")
+        for i in range(150):
+            profile.add_command_to_history(f"command {i}")
+        profile.add_contact(Contact("Alice", "@Alice"))
+        profile.update_frequent_commands("open")
+        profile.update_frequent_commands("open")
+        manager.save_profile(profile)
+        self.assertTrue(manager.flush(timeout=5))
+        
+        store = SQLiteProfileStore(db_path, manager.encryption_key)
+        reloaded = ProfileManager(self.test_dir, store=store).load_profile("Dana")
+        self.assertEqual(len(reloaded.command_history), SQLiteProfileStore.RECENT_HISTORY)
+        self.assertEqual(reloaded.preferences["frequent_commands"], {"open": 2})
+        
+        # Older history and contacts are paged in from the database
+        page = reloaded.get_history_page(offset=140, limit=20)
+        self.assertEqual([entry["command"] for entry in page], [f"command {i}" for i in range(9, -1, -1)])
+        self.assertEqual(reloaded.contacts, {})
+        self.assertEqual(reloaded.get_contact("alice").telegram_username, "@Alice")
+        self.assertEqual(store.find_contact_by_telegram("Dana", "alice").name, "Alice")
+        
+        # Rotation re-encrypts the rows and rebuilds the contact index
+        new_key = Fernet.generate_key()
+        self.assertTrue(store.rotate_key(new_key))
+        self.assertEqual(store.find_contact("Dana", "ALICE").name, "Alice")
+        self.assertEqual(len(SQLiteProfileStore(db_path, new_key).history_page("Dana", 0, 500)), 150)
+    
+    def test_profile_rename(self):
+        for backend in ("file", "sqlite"):
+            profiles_dir = os.path.join(self.test_dir, backend)
+            os.makedirs(profiles_dir)
+            manager = ProfileManager(profiles_dir, save_delay=60, backend=backend)
+            manager.create_profile("Dana")
+            manager.create_profile("Eve")
+            profile = manager.load_profile("Dana")
+            for i in range(150):
+                profile.add_command_to_history(f"command {i}")
+            profile.add_contact(Contact("Alice", "@Alice"))
+            manager.save_profile(profile)
+            
+            self.assertFalse(manager.rename_profile("Dana", "Eve"))
+            self.assertTrue(manager.rename_profile("Dana", "Dina"))
+            self.assertEqual(manager.get_profile_names(), ["Dina", "Eve"])
+            self.assertIs(manager.load_profile("Dina"), profile)
+            profile.add_command_to_history("command 150")
+            manager.save_profile(profile)
+            self.assertTrue(manager.flush(timeout=5))
+            
+            # Every saved history row moved, not just the recent ones in memory
+            reloaded = ProfileManager(profiles_dir, manager.encryption_key, backend=backend).load_profile("Dina")
+            self.assertEqual(reloaded.name, "Dina")
+            page = reloaded.get_history_page(offset=0, limit=500)
+            self.assertEqual([entry["command"] for entry in page], [f"command {i}" for i in range(150, -1, -1)])
+            self.assertEqual(reloaded.get_contact("alice").telegram_username, "@Alice")
+            self.assertEqual(manager.store.history_page("Dana"), [])
+        
+        # A store without rename (or any other store method) fails when it is created
+        with self.assertRaises(TypeError):
+            type("PartialStore", (FileProfileStore,), {"rename": ProfileStore.rename})(self.test_dir)
+    
+    def test_history_ring_and_archive(self):
+        manager = ProfileManager(self.test_dir, self.profile_manager.encryption_key)
+        manager.create_profile("Eve")
+        profile = manager.load_profile("Eve")
+        
+        # Spread 300 commands over three months so the archive is partitioned
+        start = datetime.datetime(2024, 1, 20)
+        interval = HistoryArchive.INDEX_INTERVAL
+        HistoryArchive.INDEX_INTERVAL = 512
+        try:
+            for i in range(300):
+                profile._record("history", f"command {i}", (start + datetime.timedelta(hours=6 * i)).isoformat())
+            manager.save_profile(profile)
+            self.assertTrue(manager.flush(timeout=5))
+        finally:
+            HistoryArchive.INDEX_INTERVAL = interval
+        
+        self.assertEqual(len(profile.command_history), UserProfile.HISTORY_CAPACITY)
+        self.assertEqual(profile.command_history[0]["command"], "command 200")
+        self.assertEqual(profile.command_history[-1]["command"], "command 299")
+        self.assertEqual(os.listdir(os.path.join(self.test_dir, "Eve.history")).count("2024-02.log"), 1)
+        
+        reloaded = ProfileManager(self.test_dir, manager.encryption_key).load_profile("Eve")
+        self.assertEqual(reloaded.get_recent_commands(3), ["command 299", "command 298", "command 297"])
+        page = reloaded.get_history_page(offset=150, limit=5)
+        self.assertEqual([entry["command"] for entry in page], [f"command {i}" for i in range(149, 144, -1)])
+        
+        # Range queries seek through the sparse index
+        entries = reloaded.get_history_range(datetime.datetime(2024, 2, 1), datetime.datetime(2024, 2, 2))
+        self.assertEqual([entry["command"] for entry in entries], [f"command {i}" for i in range(48, 52)])
+        self.assertEqual(reloaded.get_history_range(start, start + datetime.timedelta(days=100))[0]["command"],
+                         "command 0")
+        
+        # The archive is re-encrypted along with the profile
+        new_key = Fernet.generate_key()
+        self.assertTrue(manager.rotate_encryption_key(new_key))
+        rotated = ProfileManager(self.test_dir, new_key).load_profile("Eve")
+        self.assertEqual(rotated.get_history_page(offset=299, limit=1)[0]["command"], "command 0")
+    
+    def test_compact_records(self):
+        contact = Contact("Frank", "@frank")
+        self.assertFalse(hasattr(contact, "__dict__"))
+        self.assertIsNone(contact.details)
+        contact.email = "frank@example.com"
+        self.assertEqual((contact.phone, contact.email), (None, "frank@example.com"))
+        
+        # Contacts pickled by older versions carried an attribute dict with a datetime
+        contacted = datetime.datetime(2024, 5, 1, 12, 30)
+        legacy = Contact.__new__(Contact)
+        legacy.__setstate__({"name": "Gina", "telegram_username": None, "phone": "+1555", "email": None,
+                             "last_contacted": contacted, "contact_frequency": 3})
+        restored = pickle.loads(pickle.dumps(legacy))
+        self.assertEqual((restored.name, restored.phone, restored.last_contacted, restored.contact_frequency),
+                         ("Gina", "+1555", contacted, 3))
+        
+        history = CommandHistory(4, [{"command": "open chrome", "timestamp": "2024-05-01T12:30:00"}] * 6)
+        self.assertEqual(len(history), 4)
+        self.assertIs(history.commands[0], history.commands[1])
+        self.assertEqual(history[-1], {"command": "open chrome", "timestamp": "2024-05-01T12:30:00"})
+        
+        profile = UserProfile("Compact")
+        profile.add_feedback(5, "great")
+        profile.add_feedback(2)
+        self.assertEqual(profile.preferences["feedback_ratings"][1][:2], [2, None])
+        self.assertEqual([entry["comment"] for entry in profile.get_feedback()], ["great", ""])
+        
+        # Version 1 files kept feedback entries as dicts
+        fields = {3: json.dumps({"feedback_ratings": [
+            {"rating": 4, "comment": "", "timestamp": "2024-05-01T12:30:00"}]}).encode('utf-8')}
+        migrated = json.loads(ProfileCodec.MIGRATIONS[1](fields)[3])
+        self.assertEqual(migrated["feedback_ratings"], [[4, None, to_micros(contacted)]])
+    
+    def test_contact_index(self):
+        profile = UserProfile("Indexed")
+        for name in ("John Smith", "Joan Smith", "Jane Doe", "Johnny Appleseed"):
+            profile.add_contact(Contact(name, f"@{name.split()[0].lower()}"))
+        profile.mark_contacted("John Smith")
+        
+        # "jon" is as close to "joan" as to "john"; frecency breaks the tie
+        resolved = lambda query: tuple(getattr(value, "name", value) for value in profile.resolve_contact(query))
+        self.assertEqual(resolved("jon"), ("John Smith", False))
+        self.assertEqual(resolved("jan"), ("Jane Doe", True))
+        self.assertEqual(resolved("joan smith"), ("Joan Smith", True))
+        self.assertEqual([contact.name for contact in profile.find_contacts("smith")][0], "John Smith")
+        self.assertEqual(resolved("zachary"), (None, False))
+        
+        # Only exact names, usernames and prefixes one contact has are certain
+        self.assertEqual(resolved("johnn"), ("Johnny Appleseed", True))
+        self.assertEqual(resolved("jo smith"), ("John Smith", False))
+        self.assertEqual(resolved("@jane"), ("Jane Doe", True))
+        self.assertEqual(resolved("@johnny123"), (None, True))
+        profile.add_contact(Contact("Mom", "@mom"))
+        self.assertEqual(resolved("tom"), ("Mom", False))
+        
+        # The index follows later changes without a rebuild
+        index = profile.contact_index
+        profile.remove_contact("John Smith")
+        profile.add_contact(Contact("Jonas Berg"))
+        self.assertIs(profile.contact_index, index)
+        self.assertEqual(resolved("jonas"), ("Jonas Berg", True))
+        self.assertEqual(resolved("joann"), ("Joan Smith", False))
+        self.assertNotIn("john", index.token_keys)
+        self.assertNotIn(None, index.trie["j"]["o"]["h"]["n"])
+    
+    def test_profile_residency(self):
+        manager = ProfileManager(self.test_dir, self.profile_manager.encryption_key, save_delay=60)
+        for i in range(4):
+            manager.create_profile(f"Resident{i}")
+            profile = manager.load_profile(f"Resident{i}")
+            for j in range(100):
+                profile.add_command_to_history(f"resident {i} command {j}")
+            manager.save_profile(profile)
+        
+        # Room for about two profiles
+        manager.memory_budget = manager.get_residency_stats()["total"] // 2
+        self.assertTrue(manager.set_current_profile("Resident0"))
+        manager.trim()
+        stats = manager.get_residency_stats()
+        self.assertLessEqual(stats["total"], manager.memory_budget)
+        self.assertIn("Resident0", stats["resident"])
+        self.assertNotIn("Resident1", manager.profiles)
+        self.assertGreater(stats["evictions"], 0)
+        
+        # Evicted profiles were saved on the way out and come back on demand
+        self.assertTrue(manager.set_current_profile("Resident1"))
+        self.assertEqual(manager.get_current_profile().command_history[-1]["command"], "resident 1 command 99")
+        self.assertIn("Resident1", manager.profiles)
+        self.assertEqual(list(manager.profiles)[-1], "Resident1")
+        
+        # A save only marks the size stale; it is measured when next needed
+        profile = manager.get_current_profile()
+        profile.add_command_to_history("resident 1 command 100")
+        manager.save_profile(profile)
+        self.assertTrue(manager.writer.flush(timeout=5))
+        self.assertIsNone(manager.resident_bytes["Resident1"])
+        self.assertGreater(manager.get_residency_stats()["resident"]["Resident1"], 0)
+    
+    def test_failed_profile_write(self):
+        manager = ProfileManager(self.test_dir, self.profile_manager.encryption_key, save_delay=60)
+        manager.create_profile("Ann")
+        manager.create_profile("Ben")
+        profile = manager.load_profile("Ann")
+        profile.add_command_to_history("kept after a failed write")
+        
+        def fail(profile, changes):
+            raise OSError("disk full")
+        manager.store.write_changes = fail
+        
+        # The changes stay with the profile, the scheduler counts the failure,
+        # and a profile that cannot be saved is not evicted
+        manager.save_profile(profile)
+        self.assertTrue(manager.writer.flush(timeout=5))
+        self.assertEqual(manager.writer.stats["failed"], 1)
+        self.assertTrue(profile.is_dirty())
+        manager.set_current_profile("Ben")
+        manager.memory_budget = 0
+        manager.trim()
+        self.assertIn("Ann", manager.profiles)
+        
+        del manager.store.write_changes
+        manager.trim()
+        self.assertNotIn("Ann", manager.profiles)
+        reloaded = ProfileManager(self.test_dir, manager.encryption_key).load_profile("Ann")
+        self.assertEqual(reloaded.command_history[-1]["command"], "kept after a failed write")
+    
+    def test_indexed_prediction(self):
+        rng = random.Random(3)
+        vocabulary, patterns = _synthetic_command_patterns(20, 300, 40, rng)
+        learning = LearningSystem(data_file=None)
+        learning.command_patterns = patterns
+        learning.rebuild_index()
+        
+        # Learning updates the index incrementally
+        for _ in range(50):
+            words = " ".join(rng.choice(vocabulary) for _ in range(3))
+            learning.learn_from_command(words, f"type{rng.randint(0, 24)}", True)
+        
+        for _ in range(300):
+            command = " ".join(rng.choice(vocabulary + ["of", "the"]) for _ in range(rng.randint(1, 6)))
+            self.assertEqual(learning.predict_command_type(command),
+                             _reference_predict_command_type(learning.command_patterns, command))
+        self.assertIsNone(learning.predict_command_type("nothing known here"))
+    
+    def test_ranked_suggestions(self):
+        learning = LearningSystem(data_file=None)
+        learning.command_patterns = {
+            "search": {"keywords": {"search": 1}, "total_uses": 1, "successful_uses": 1},
+            "weather": {"keywords": {"seattle": 2, "weather": 3}, "total_uses": 3, "successful_uses": 3},
+            "music": {"keywords": {"play": 4}, "total_uses": 4, "successful_uses": 4}
+        }
+        learning.rebuild_index()
+        self.assertEqual(learning.get_command_suggestions("se"), ["weather", "search"])
+        self.assertEqual(learning.get_command_suggestions("SEA", limit=1), ["weather"])
+        self.assertEqual(learning.get_command_suggestions("xyz"), [])
+        
+        # Learning reorders suggestions incrementally, matching a full rebuild
+        for _ in range(3):
+            learning.learn_from_command("search seahorses", "search", True)
+        self.assertEqual(learning.get_command_suggestions("sea"), ["search", "weather"])
+        incremental = learning.suggestion_trie
+        learning.rebuild_index()
+        for prefix in ("s", "se", "sea", "seah", "p", "w"):
+            self.assertEqual(incremental.suggest(prefix, 8), learning._get_suggestion_trie().suggest(prefix, 8))
+    
+    def test_suggestion_pipeline(self):
+        computed = []
+        delivered = []
+        done = threading.Event()
+        
+        def compute(text):
+            computed.append(text)
+            return [text.upper()]
+        
+        def deliver(suggestions):
+            delivered.append(suggestions)
+            done.set()
+        
+        pipeline = SuggestionPipeline(compute, deliver, lambda callback: callback(), delay=0.05)
+        for text in ("s", "se", "sea"):
+            pipeline.submit(text)
+        self.assertTrue(done.wait(2))
+        
+        # A burst of keystrokes becomes one lookup of the latest input
+        self.assertEqual(computed, ["sea"])
+        self.assertEqual(delivered, [["SEA"]])
+        
+        # Results that match what is shown are not delivered again
+        pipeline.submit("sea")
+        deadline = time.monotonic() + 2
+        while pipeline.stats["unchanged"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(pipeline.stats["unchanged"], 1)
+        self.assertEqual(len(delivered), 1)
+    
+    def test_command_executor(self):
+        finished = []
+        done = threading.Event()
+        release = threading.Event()
+        
+        def on_done(task):
+            finished.append((task.name, task.state, task.result))
+            if len(finished) == 4:
+                done.set()
+        
+        executor = CommandExecutor(lambda callback: callback(), max_workers=1, max_queue=2, timeout=5)
+        blocker = executor.submit("blocker", release.wait, (5,), on_done=on_done)
+        deadline = time.monotonic() + 2
+        while executor.depth() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        
+        # The queue holds two; a more urgent command sheds the newest low-priority one
+        executor.submit("low", lambda: "low", on_done=on_done)
+        executor.submit("later", lambda: "later", on_done=on_done)
+        executor.submit("urgent", lambda: "urgent", priority=1, on_done=on_done)
+        self.assertIsNone(executor.submit("rejected", lambda: None, on_done=on_done))
+        self.assertEqual(finished, [("later", "dropped", None)])
+        
+        # Cancelling the running command frees its worker for the queue, urgent first
+        self.assertTrue(executor.cancel(blocker))
+        self.assertTrue(done.wait(2))
+        self.assertEqual(finished[1:], [("blocker", "cancelled", None), ("urgent", "done", "urgent"),
+                                        ("low", "done", "low")])
+        release.set()
+        
+        # A command past its timeout is reported and its late result dropped
+        timed_out = threading.Event()
+        executor.submit("slow", time.sleep, (0.3,), timeout=0.05, on_done=lambda task: timed_out.set())
+        self.assertTrue(timed_out.wait(2))
+        deadline = time.monotonic() + 2
+        while executor.metrics()["late"] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        
+        metrics = executor.metrics()
+        self.assertEqual({key: metrics[key] for key in ("completed", "cancelled", "dropped", "rejected", "timed_out", "late")},
+                         {"completed": 2, "cancelled": 1, "dropped": 1, "rejected": 1, "timed_out": 1, "late": 2})
+        self.assertEqual(metrics["max_depth"], 2)
+        self.assertEqual(metrics["wait"]["count"], 4)
+    
+    def test_result_cache(self):
+        now = [0.0]
+        refreshes = []
+        cache = ResultCache(max_entries=2, spawn=lambda refresh: refreshes.append(refresh) or refresh,
+                            clock=lambda: now[0])
+        answers = iter(range(100))
+        compute = lambda: next(answers)
+        
+        # Keys ignore slot order, case and spacing
+        key = ResultCache.key("handle_weather", {"location": "New  York"})
+        self.assertEqual(key, ResultCache.key("handle_weather", {"location": "new york"}))
+        self.assertEqual(cache.fetch(key, compute, ttl=10, stale=20), 0)
+        self.assertEqual(cache.fetch(key, compute, ttl=10, stale=20), 0)
+        
+        # Stale answers are served once while a single refresh is started
+        now[0] = 15
+        self.assertEqual(cache.fetch(key, compute, ttl=10, stale=20), 0)
+        self.assertEqual(cache.fetch(key, compute, ttl=10, stale=20), 0)
+        self.assertEqual(len(refreshes), 1)
+        refreshes[0]()
+        self.assertEqual(cache.fetch(key, compute, ttl=10, stale=20), 1)
+        
+        # Past the stale window it is recomputed
+        now[0] = 100
+        self.assertEqual(cache.fetch(key, compute, ttl=10, stale=20), 2)
+        
+        # Least recently used entries go first
+        cache.fetch(("handle_news", ()), compute, ttl=10)
+        cache.fetch(key, compute, ttl=10)
+        cache.fetch(("handle_help", ()), compute, ttl=10)
+        self.assertEqual(list(cache.entries), [key, ("handle_help", ())])
+        self.assertEqual(cache.stats, {"hits": 3, "stale_hits": 2, "misses": 4, "refreshes": 1,
+                                       "refresh_failures": 0, "evictions": 1})
+    
+    def test_stage_timings(self):
+        timings = StageTimings()
+        for milliseconds in range(1, 101):
+            timings.record("handler", milliseconds / 1000.0)
+        timings.record("custom", 0.5)
+        start = timings.since("parse", time.perf_counter())
+        self.assertGreater(start, 0)
+        
+        summary = timings.summary()
+        self.assertEqual(list(summary)[:len(PIPELINE_STAGES)], list(PIPELINE_STAGES))
+        self.assertEqual(summary["handler"]["count"], 100)
+        self.assertLessEqual(summary["handler"]["p50"], summary["handler"]["p95"])
+        self.assertLessEqual(summary["handler"]["p95"], summary["handler"]["p99"])
+        self.assertAlmostEqual(summary["handler"]["p50"], 0.05, delta=0.015)
+        self.assertEqual((summary["custom"]["count"], summary["listen"]["count"]), (1, 0))
+        self.assertIn("handler", timings.report())
+        
+        path = os.path.join(self.test_dir, "logs", "pipeline_timings.json")
+        self.assertTrue(timings.dump(path))
+        with open(path) as f:
+            dumped = json.load(f)
+        self.assertEqual(dumped["stages"]["handler"]["count"], 100)
+        self.assertEqual(dumped["stages"]["parse"]["count"], 1)
+    
+    def test_naive_bayes_backend(self):
+        learning = LearningSystem(data_file=None)
+        for _ in range(20):
+            learning.learn_from_command("open chrome now", "open", True)
+        for _ in range(3):
+            learning.learn_from_command("play music now", "play", True)
+        history = [{"command": "What is the weather tomorrow", "timestamp": "2024-01-01T00:00:00"},
+                   {"command": "blah blah", "timestamp": "2024-01-01T00:01:00"}]
+        
+        classifier = learning.train_classifier([history], keywords=["open", "play", "weather"])
+        self.assertEqual(classifier.type_names, ["open", "play", "weather"])
+        self.assertEqual(learning.predict_command_type("play some music"), "play")
+        self.assertEqual(learning.predict_command_type("weather tomorrow"), "weather")
+        self.assertIsNone(learning.predict_command_type("something unknown"))
+        
+        # A word every type shares is not evidence for any of them
+        self.assertLess(classifier.predict(["now"])[1], 0.9)
+        self.assertGreater(classifier.predict(["music"])[1], 0.5)
+        
+        # Commands learned after training are picked up by a refit
+        self.assertIsNone(learning.predict_command_type("spotify"))
+        for _ in range(5):
+            learning.learn_from_command("spotify", "play", True)
+        self.assertEqual(learning.predict_command_type("spotify"), "play")
+        
+        # Shards serve the global classifier until the profile has enough commands
+        shards = LearningShards(os.path.join(self.test_dir, "learning"), os.path.join(self.test_dir, "global.json"),
+                                profile_name=lambda: "Ann", classify=True)
+        for _ in range(10):
+            shards.learn_from_command("open chrome", "open", True)
+        self.assertTrue(shards.global_system.has_classifier())
+        self.assertTrue(shards.current_shard().has_classifier())
+        self.assertEqual(shards.predict_command_type("chrome please"), "open")
+        self.assertTrue(shards.flush(timeout=5))
+    
+    def test_learning_decay_and_pruning(self):
+        self.assertEqual(normalize_keywords("Please open the E-mail, now!"), ["open", "email", "now"])
+        
+        # Keywords a type stopped using fade against the ones it uses now
+        now = to_micros(datetime.datetime.now())
+        ten_days = 10 * 86400 * 10 ** 6
+        predictions = {}
+        for half_life_days in (1, None):
+            learning = LearningSystem(data_file=None, half_life_days=half_life_days)
+            for _ in range(4):
+                learning.learn_from_command("play jazz", "music", True, now - ten_days)
+                learning.learn_from_command("play rock", "music", True, now)
+            learning.learn_from_command("jazz club", "search", True, now)
+            learning.learn_from_command("club night", "search", True, now)
+            predictions[half_life_days] = learning.predict_command_type("jazz")
+        self.assertEqual(predictions, {1: "search", None: "music"})
+        
+        # Past the cap the lowest-weighted keywords go, and replay prunes the same way
+        data_file = os.path.join(self.test_dir, "learning_data.json")
+        learning = LearningSystem(data_file, max_keywords=10)
+        for i in range(30):
+            learning.learn_from_command(f"open favourite word{i}", "open", True, now + i)
+        self.assertLessEqual(learning.keyword_count, 10)
+        self.assertIn("favourite", learning.command_patterns["open"]["keywords"])
+        self.assertNotIn("word0", learning.command_patterns["open"]["keywords"])
+        self.assertEqual(learning.keyword_index.postings["favourite"],
+                         {0: learning.command_patterns["open"]["keywords"]["favourite"]})
+        
+        reloaded = LearningSystem(data_file, max_keywords=10)
+        self.assertEqual(reloaded.command_patterns, learning.command_patterns)
+    
+    def test_learning_shards(self):
+        current = ["Bob"]
+        directory = os.path.join(self.test_dir, "learning")
+        shards = LearningShards(directory, os.path.join(self.test_dir, "learning_data.json"),
+                                profile_name=lambda: current[0])
+        for _ in range(200):
+            shards.learn_from_command("play jazz", "music", True)
+        current[0] = "Alice"
+        for _ in range(5):
+            shards.learn_from_command("jazz club", "search", True)
+        
+        # Alice's own few commands outweigh Bob's many in the shared prior
+        self.assertEqual(shards.predict_command_type("jazz"), "search")
+        self.assertEqual(shards.get_command_suggestions("jaz"), ["search", "music"])
+        current[0] = "Bob"
+        self.assertEqual(shards.predict_command_type("jazz"), "music")
+        self.assertEqual(shards.shard_name, "Bob")
+        self.assertEqual(set(shards.shard.command_patterns), {"music"})
+        
+        # A new profile starts from the global prior
+        current[0] = "Carol"
+        self.assertEqual(shards.predict_command_type("play jazz"), "music")
+        
+        shards.rename_profile("Alice", "Alicia")
+        self.assertFalse(os.path.exists(os.path.join(directory, "Alice.json.log")))
+        current[0] = "Alicia"
+        self.assertAlmostEqual(shards.current_shard().command_patterns["search"]["total_uses"], 5)
+        shards.delete_profile("Alicia")
+        self.assertEqual(os.listdir(directory), ["Bob.json"])
+        self.assertTrue(shards.flush(timeout=5))
+    
+    def test_replay_trainer(self):
+        manager = ProfileManager(self.test_dir, self.profile_manager.encryption_key, save_delay=0)
+        start = datetime.datetime(2024, 3, 1)
+        for name, commands in (("Ann", ["open chrome", "play jazz music", "open chrome now"]),
+                               ("Ben", ["what is the weather in paris", "weather tomorrow"])):
+            manager.create_profile(name)
+            profile = manager.load_profile(name)
+            for i, command in enumerate(commands):
+                profile._record("history", command, (start + datetime.timedelta(hours=i)).isoformat())
+            manager.save_profile(profile)
+        self.assertTrue(manager.flush(timeout=5))
+        # Saved under some other key, so it is skipped
+        ProfileManager(self.test_dir).create_profile("Zed")
+        
+        log_path = os.path.join(self.test_dir, "jarvis.log")
+        with open(log_path, 'w') as f:
+            f.write("2024-03-02 10:00:00,000 - JarvisAssistant - INFO - Launched application: spotify\n"
+                    "2024-03-02 10:01:00,000 - JarvisAssistant - ERROR - Error processing command: "
+                    "set a timer: no audio\n")
+        
+        directory = os.path.join(self.test_dir, "learning")
+        shards = LearningShards(directory, os.path.join(self.test_dir, "learning_data.json"))
+        trainer = ReplayTrainer(manager.store, shards, engine=BulkProfileEngine(max_workers=1), holdout=0.5)
+        report = trainer.run(log_path=log_path, report_path=os.path.join(self.test_dir, "report.json"))
+        
+        self.assertEqual(report["failed"], [])
+        self.assertEqual(report["unreadable"], ["Zed"])
+        self.assertEqual(report["commands"], 7)
+        self.assertEqual(report["sources"]["Ann"]["tested"], 1)
+        self.assertEqual(report["sources"]["Ann"]["accuracy"], 1.0)
+        self.assertEqual(sorted(shards.global_system.command_patterns), ["music", "open", "timer", "weather"])
+        self.assertEqual(shards.global_system.command_patterns["timer"]["successful_uses"], 0)
+        
+        # Each profile's counts become its shard, without the other profiles' commands
+        ann = LearningSystem(os.path.join(directory, "Ann.json"))
+        self.assertEqual(sorted(ann.command_patterns), ["music", "open"])
+        self.assertAlmostEqual(ann.command_patterns["open"]["keywords"]["chrome"], 2, places=2)
+        
+        # The prior is blended by commands learned, not by snapshot sequence numbers
+        self.assertEqual((ann.seq, ann.learned), (1, 3))
+        self.assertEqual(shards.global_system.learned, 7)
+        with open(os.path.join(self.test_dir, "report.json")) as f:
+            self.assertEqual(json.load(f)["labelled"], 7)
+    
+    def test_intent_router(self):
+        router = IntentRouter(COMMAND_HANDLERS)
+        
+        # Whole words only
+        self.assertIsNone(router.route("restart the computer"))
+        self.assertIsNone(router.route("brunch plans"))
+        self.assertEqual(router.route("show my reminders"), "reminder")
+        
+        # Every match with its span, in text order
+        text = "look up flights in chrome"
+        self.assertEqual(router.matches(text), [("look up", 0, 7), ("chrome", 19, 25)])
+        self.assertEqual(text[0:7], "look up")
+        
+        # Priorities first, then the order of the handler table
+        self.assertEqual(router.route("search for cats in chrome"), "search")
+        self.assertEqual(router.route("open chrome"), "open")
+        self.assertEqual(router.route("send a telegram message to sam"), "message")
+        self.assertEqual(IntentRouter(["telegram", "message"]).route("send a telegram message"), "telegram")
+    
+    def test_command_parser(self):
+        parser = CommandParser(IntentRouter(COMMAND_HANDLERS))
+        
+        # "to" inside "tomorrow" no longer splits the message
+        command = parser.parse("Send a message to John saying see you tomorrow")
+        self.assertEqual(command.intent, "message")
+        self.assertEqual(command.slot("recipient"), "john")
+        self.assertEqual(command.slot("body"), "see you tomorrow")
+        start, end = command.spans["body"]
+        self.assertEqual(command.text[start:end], "see you tomorrow")
+        
+        command = parser.parse("search for python tutorials in chrome")
+        self.assertEqual((command.intent, command.slot("query"), command.slot("app")),
+                         ("search", "python tutorials", "chrome"))
+        
+        # Typed slots
+        self.assertEqual(parser.parse("set a timer for 5 minutes").slot("time")["seconds"], 300)
+        self.assertEqual(parser.parse("set an alarm for 7:30 pm").slot("time")["clock"], (19, 30))
+        self.assertEqual(parser.parse("repeat my last 3 commands").slot("number"), 3)
+        self.assertEqual(parser.parse("go to wikipedia.org in chrome").slot("url"), "wikipedia.org")
+        self.assertEqual(parser.parse("go to youtube in chrome", "chrome").slot("website"), "youtube")
+        
+        # A predicted intent gets that handler's slots
+        command = parser.parse("how hot is it in paris", "weather")
+        self.assertEqual((command.intent, command.slot("location")), ("weather", "paris"))
+        self.assertTrue(command.has("hot", "cold"))
+        self.assertFalse(command.has("is it hot"))
+    
+    def test_repeat_plan(self):
+        parser = CommandParser(IntentRouter(COMMAND_HANDLERS))
+        history = ["open spotify", "exit", "send a message to sam saying hi", "logout", "cancel",
+                   "delete profile", "login", "repeat my last command", "what is the weather"]
+        others, sends = plan_repeats(parser, history)
+        
+        # Exit, logout, cancel, profile and login commands are never replayed; sends need a yes
+        self.assertEqual([parsed.text for parsed in others], ["open spotify", "what is the weather"])
+        self.assertEqual([parsed.text for parsed in sends], ["send a message to sam saying hi"])
+    
+    def test_learning_delta_log(self):
+        data_file = os.path.join(self.test_dir, "learning_data.json")
+        learning = LearningSystem(data_file)
+        
+        # Each command appends one short record; no snapshot is written yet
+        learning.learn_from_command("open chrome", "open", True)
+        size = os.path.getsize(learning.log_path)
+        learning.learn_from_command("open firefox", "open", False)
+        self.assertLess(os.path.getsize(learning.log_path) - size, 100)
+        self.assertFalse(os.path.exists(data_file))
+        
+        # An interrupted append leaves a torn record that replay stops at
+        with open(learning.log_path, 'a') as f:
+            f.write('[3, "sea')
+        reloaded = LearningSystem(data_file)
+        self.assertEqual(reloaded.command_patterns, learning.command_patterns)
+        self.assertEqual(reloaded.seq, 2)
+        self.assertFalse(os.path.exists(learning.log_path))
+        self.assertEqual(reloaded.predict_command_type("open chrome"), "open")
+        
+        # Snapshots move the log aside and drop it once they are on disk
+        reloaded.SNAPSHOT_EVERY = 3
+        for i in range(4):
+            reloaded.learn_from_command(f"search for topic{i}", "search", True)
+        self.assertTrue(reloaded.flush(timeout=5))
+        self.assertFalse(os.path.exists(reloaded.prev_log_path))
+        with open(data_file) as f:
+            self.assertEqual(json.load(f)["seq"], 6)
+        self.assertEqual(LearningSystem(data_file).command_patterns, reloaded.command_patterns)
+        
+        # Learning data written by older versions is the bare patterns
+        with open(data_file, 'w') as f:
+            json.dump({"open": {"keywords": {"chrome": 1}, "total_uses": 1, "successful_uses": 1}}, f)
+        self.assertEqual(LearningSystem(data_file).predict_command_type("chrome"), "open")
+    
     def test_contact_management(self):
         # Create a profile
         self.profile_manager.create_profile("TestUser")
@@ -2726,7 +7232,761 @@ class JarvisTests(unittest.TestCase):
 def run_tests():
     unittest.main(argv=['first-arg-is-ignored'], exit=False)
 
+STARTUP_PROBE_MARKER = "JARVIS_STARTUP_PROBE"
+
+def peak_rss_bytes():
+    # Peak resident set size of the current process, None if it can't be read
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+        return rss if platform.system() == "Darwin" else rss * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss)
+    except Exception:
+        return None
+
+def report_startup_probe(root):
+    # Called once the first frame built by create_widgets has been drawn
+    root.update_idletasks()
+    root.update()
+    report = {
+        "rss_bytes": peak_rss_bytes(),
+        "lazy_modules_loaded": sorted(LazyImport.loaded),
+        "modules": len(sys.modules)
+    }
+    print(f"{STARTUP_PROBE_MARKER} {json.dumps(report)}", flush=True)
+    root.destroy()
+
+def run_startup_benchmark(runs=5):
+    # Wall time and peak RSS from process start to the first drawn frame
+    script = os.path.abspath(__file__)
+    results = []
+    
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, script, "--startup-probe"],
+            stdout=subprocess.PIPE,
+            text=True
+        )
+        report = None
+        for line in proc.stdout:
+            if line.startswith(STARTUP_PROBE_MARKER):
+                wall_time = time.perf_counter() - start
+                report = json.loads(line[len(STARTUP_PROBE_MARKER):])
+                report["wall_time"] = wall_time
+                break
+        proc.wait()
+        
+        if report is None:
+            print(f"Startup probe exited with code {proc.returncode} before the first frame")
+            return None
+        results.append(report)
+    
+    wall_times = sorted(r["wall_time"] for r in results)
+    rss_values = [r["rss_bytes"] for r in results if r["rss_bytes"]]
+    print(f"Startup benchmark ({runs} runs)")
+    print(f"  wall time: min {wall_times[0]:.3f}s, median {wall_times[len(wall_times) // 2]:.3f}s, max {wall_times[-1]:.3f}s")
+    if rss_values:
+        print(f"  peak RSS: {max(rss_values) / (1024 * 1024):.1f} MB")
+    print(f"  modules imported: {results[-1]['modules']}")
+    print(f"  heavy modules loaded before first frame: {', '.join(results[-1]['lazy_modules_loaded']) or 'none'}")
+    return results
+
+def _time_call(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def run_profile_format_benchmark(history_entries=10000, contacts=5000, repeat=5):
+    # Save/load time and file size of the binary profile format against pickle
+    profile = UserProfile("Benchmark", "Nowhere")
+    start_time = datetime.datetime(2024, 1, 1)
+    profile.command_history = CommandHistory(history_entries, [
+        {"command": f"open application number {i % 250}",
+         "timestamp": (start_time + datetime.timedelta(seconds=i * 37)).isoformat()}
+        for i in range(history_entries)
+    ])
+    for i in range(contacts):
+        contact = Contact(f"Contact {i}", f"@user{i}", f"+1555{i:07d}" if i % 2 else None)
+        contact.last_contacted = start_time + datetime.timedelta(minutes=i)
+        contact.contact_frequency = i % 17
+        profile.contacts[contact.name.lower()] = contact
+    
+    cipher_suite = Fernet(Fernet.generate_key())
+    formats = {
+        "pickle + fernet": (
+            lambda: cipher_suite.encrypt(pickle.dumps(profile)),
+            lambda data: pickle.loads(cipher_suite.decrypt(data))
+        ),
+        "binary": (
+            lambda: ProfileCodec.encode(profile, cipher_suite, compress=False),
+            lambda data: ProfileCodec.decode(data, cipher_suite)
+        ),
+        "binary + zlib": (
+            lambda: ProfileCodec.encode(profile, cipher_suite, compress=True),
+            lambda data: ProfileCodec.decode(data, cipher_suite)
+        )
+    }
+    
+    print(f"Profile format benchmark ({history_entries} history entries, {contacts} contacts, best of {repeat})")
+    results = {}
+    for name, (save, load) in formats.items():
+        save_time, data = _time_call(save, repeat)
+        load_time, _ = _time_call(lambda: load(data), repeat)
+        results[name] = {"save": save_time, "load": load_time, "size": len(data)}
+        print(f"  {name:<16} save {save_time * 1000:8.1f} ms  load {load_time * 1000:8.1f} ms  size {len(data) / 1024:8.1f} KB")
+    return results
+
+def _traced_allocation(build):
+    # Bytes still allocated by build() once it returns, with the result kept alive
+    import gc
+    import tracemalloc
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        return tracemalloc.get_traced_memory()[0] - before, result
+    finally:
+        tracemalloc.stop()
+
+def run_memory_benchmark(records=100000):
+    # Bytes per contact, history entry and feedback entry, as plain objects and
+    # dicts (the layout before records were compacted) and as compact records
+    class DictContact:
+        def __init__(self, name, telegram_username=None, phone=None, email=None):
+            self.name = name
+            self.telegram_username = telegram_username
+            self.phone = phone
+            self.email = email
+            self.last_contacted = None
+            self.contact_frequency = 0
+    
+    start_time = datetime.datetime(2024, 1, 1)
+    
+    def contacts(contact_class):
+        def build():
+            built = {}
+            for i in range(records):
+                contact = contact_class(f"Contact {i}", f"@user{i}", f"+1555{i:07d}" if i % 4 == 0 else None)
+                contact.last_contacted = start_time + datetime.timedelta(minutes=i)
+                contact.contact_frequency = i % 17
+                built[contact.name.lower()] = contact
+            return built
+        return build
+    
+    def history_dicts():
+        return [{"command": f"open application number {i % 250}",
+                 "timestamp": (start_time + datetime.timedelta(seconds=i * 37)).isoformat()}
+                for i in range(records)]
+    
+    def history_ring():
+        history = CommandHistory(records)
+        for i in range(records):
+            history.add_micros(f"open application number {i % 250}", to_micros(start_time) + i * 37000000)
+        return history
+    
+    def feedback_dicts():
+        return [{"rating": i % 5 + 1, "comment": "", "timestamp": (start_time + datetime.timedelta(hours=i)).isoformat()}
+                for i in range(records)]
+    
+    def feedback_compact():
+        return [[i % 5 + 1, None, to_micros(start_time) + i * 3600000000] for i in range(records)]
+    
+    cases = [
+        ("contact", contacts(DictContact), contacts(Contact)),
+        ("history entry", history_dicts, history_ring),
+        ("feedback entry", feedback_dicts, feedback_compact)
+    ]
+    
+    print(f"Memory benchmark ({records} records of each kind)")
+    results = {}
+    for name, before, after in cases:
+        before_bytes, _ = _traced_allocation(before)
+        after_bytes, _ = _traced_allocation(after)
+        results[name] = {"before": before_bytes / records, "after": after_bytes / records}
+        print(f"  {name:<15} before {before_bytes / records:7.1f} B  after {after_bytes / records:7.1f} B")
+    return results
+
+def run_contact_lookup_benchmark(contacts=50000, queries=2000):
+    # Recipient resolution time against a large address book
+    rng = random.Random(7)
+    consonants, vowels = "bcdfghjklmnprstvwz", "aeiouy"
+    def make_name(syllables):
+        return "".join(rng.choice(consonants) + rng.choice(vowels) + rng.choice(["", "n", "r", "l", "s"])
+                       for _ in range(syllables))
+    first_names = sorted({make_name(rng.randint(2, 3)) for _ in range(1000)})
+    last_names = sorted({make_name(rng.randint(2, 4)) for _ in range(20000)})
+    
+    profile = UserProfile("Benchmark")
+    now = datetime.datetime.now()
+    while len(profile.contacts) < contacts:
+        contact = Contact(f"{rng.choice(first_names).title()} {rng.choice(last_names).title()}")
+        if rng.random() < 0.3:
+            contact.last_contacted = now - datetime.timedelta(hours=rng.randint(1, 5000))
+            contact.contact_frequency = rng.randint(1, 50)
+        profile.contacts[contact.name.lower()] = contact
+    
+    start = time.perf_counter()
+    profile.find_contacts("warm up")
+    build_time = time.perf_counter() - start
+    
+    names = list(profile.contacts.values())
+    kinds = {
+        "first name": lambda name: name.split()[0],
+        "full name": lambda name: " ".join(name.split()[:2]),
+        "prefix": lambda name: name.split()[1][:3],
+        "misheard": lambda name: name.split()[0][:-1] + "x"
+    }
+    
+    print(f"Contact lookup benchmark ({contacts} contacts, {queries} queries per kind)")
+    print(f"  index build {build_time * 1000:.1f} ms")
+    results = {"build": build_time}
+    for kind, make_query in kinds.items():
+        timings = []
+        for _ in range(queries):
+            query = make_query(rng.choice(names).name.lower())
+            start = time.perf_counter()
+            profile.resolve_contact(query)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        mean = sum(timings) / len(timings)
+        p99 = timings[int(len(timings) * 0.99)]
+        results[kind] = {"mean": mean, "p99": p99}
+        print(f"  {kind:<11} mean {mean * 1e6:7.1f} us  p99 {p99 * 1e6:7.1f} us")
+    return results
+
+def _reference_predict_command_type(command_patterns, command):
+    # The per-type loop predict_command_type used before the keyword index,
+    # kept to check that the index ranks types the same way
+    words = command.lower().split()
+    best_match = None
+    highest_score = 0
+    for cmd_type, data in command_patterns.items():
+        score = 0
+        for word in words:
+            if len(word) > 2 and word in data["keywords"]:
+                score += data["keywords"][word]
+        if data["total_uses"] > 0:
+            score = score / data["total_uses"]
+        if score > highest_score:
+            highest_score = score
+            best_match = cmd_type
+    return best_match if highest_score > 0.1 else None
+
+def _synthetic_command_patterns(types, keywords, keywords_per_type, rng):
+    vocabulary = [f"word{i}" for i in range(keywords)]
+    patterns = {}
+    for i in range(types):
+        chosen = rng.sample(vocabulary, keywords_per_type)
+        patterns[f"type{i}"] = {
+            "keywords": {word: rng.randint(1, 50) for word in chosen},
+            "total_uses": rng.randint(50, 5000),
+            "successful_uses": 0
+        }
+    return vocabulary, patterns
+
+def run_prediction_benchmark(types=200, keywords=50000, keywords_per_type=2000, queries=2000):
+    # predict_command_type with the keyword index against the old per-type loop
+    rng = random.Random(11)
+    vocabulary, patterns = _synthetic_command_patterns(types, keywords, keywords_per_type, rng)
+    commands = [" ".join(rng.choice(vocabulary) for _ in range(rng.randint(2, 8))) for _ in range(queries)]
+    
+    learning = LearningSystem(data_file=None)
+    learning.command_patterns = patterns
+    start = time.perf_counter()
+    learning.rebuild_index()
+    build_time = time.perf_counter() - start
+    
+    reference_time, expected = _time_call(
+        lambda: [_reference_predict_command_type(patterns, command) for command in commands], 1)
+    indexed_time, predicted = _time_call(lambda: [learning.predict_command_type(command) for command in commands], 3)
+    
+    print(f"Prediction benchmark ({types} types, {keywords} keywords, {queries} commands)")
+    print(f"  index build {build_time * 1000:.1f} ms")
+    print(f"  per-type loop  {reference_time / queries * 1e6:8.1f} us per command")
+    print(f"  keyword index  {indexed_time / queries * 1e6:8.1f} us per command")
+    print(f"  same predictions: {predicted == expected}")
+    
+    prefixes = [rng.choice(vocabulary)[:rng.randint(1, 7)] for _ in range(queries)]
+    trie_time, _ = _time_call(learning._get_suggestion_trie, 1)
+    suggest_time, _ = _time_call(lambda: [learning.get_command_suggestions(prefix) for prefix in prefixes], 3)
+    print(f"  suggestion trie build {trie_time * 1000:.1f} ms, {suggest_time / queries * 1e6:.1f} us per keystroke")
+    return {"build": build_time, "reference": reference_time / queries, "indexed": indexed_time / queries,
+            "matches": predicted == expected, "trie_build": trie_time, "suggest": suggest_time / queries}
+
+def _synthetic_command_corpus(types, commands, rng):
+    # Labelled commands where every type draws from its own topic words plus
+    # filler words shared by all types, and a few types make up most traffic
+    consonants, vowels = "bcdfghjklmnprstvwz", "aeiou"
+    vocabulary = sorted({"".join(rng.choice(consonants) + rng.choice(vowels) for _ in range(rng.randint(2, 4)))
+                         for _ in range(types * 150)})
+    filler = vocabulary[:40]
+    topics = [rng.sample(vocabulary[40:], 120) for _ in range(types)]
+    type_weights = [1.0 / (i + 1) for i in range(types)]
+    word_weights = [1.0 / (i + 1) ** 0.8 for i in range(120)]
+    
+    corpus = []
+    for _ in range(commands):
+        type_id = rng.choices(range(types), type_weights)[0]
+        words = rng.sample(filler, rng.randint(1, 3)) + rng.choices(topics[type_id], word_weights, k=rng.randint(1, 3))
+        rng.shuffle(words)
+        corpus.append((" ".join(words), f"type{type_id}"))
+    return corpus
+
+def run_classifier_benchmark(types=40, commands=50000, holdout=0.2):
+    # Accuracy and latency of the naive Bayes backend against keyword scoring,
+    # replaying a corpus into LearningSystem and predicting the held-out tail
+    rng = random.Random(17)
+    corpus = _synthetic_command_corpus(types, commands, rng)
+    split = int(len(corpus) * (1 - holdout))
+    train, test = corpus[:split], corpus[split:]
+    
+    learning = LearningSystem(data_file=None)
+    for command, command_type in train:
+        learning.learn_from_command(command, command_type, True)
+    
+    def evaluate():
+        start = time.perf_counter()
+        predictions = [learning.predict_command_type(command) for command, _ in test]
+        elapsed = (time.perf_counter() - start) / len(test)
+        correct = sum(prediction == command_type for prediction, (_, command_type) in zip(predictions, test))
+        answered = sum(prediction is not None for prediction in predictions)
+        return {"accuracy": correct / len(test), "coverage": answered / len(test), "latency": elapsed}
+    
+    results = {"keyword": evaluate()}
+    train_time, classifier = _time_call(learning.train_classifier, 1)
+    results["naive bayes"] = evaluate()
+    results["naive bayes"].update({"train": train_time, "bytes": classifier.nbytes()})
+    
+    print(f"Classifier benchmark ({types} types, {len(train)} training and {len(test)} held-out commands)")
+    print(f"  naive bayes trained in {train_time * 1000:.1f} ms, {classifier.nbytes() / 1024:.1f} KB of arrays")
+    for name, result in results.items():
+        print(f"  {name:<12} accuracy {result['accuracy'] * 100:5.1f}%  coverage {result['coverage'] * 100:5.1f}%"
+              f"  {result['latency'] * 1e6:6.1f} us per command")
+    return results
+
+def run_learning_decay_benchmark(types=40, phases=4, commands_per_phase=15000, max_keywords=2000,
+                                 half_life_days=7, holdout=0.1):
+    # Model size and accuracy on recent commands when what each type is used for
+    # drifts every month, without decay, with decay, and with decay under a cap
+    rng = random.Random(18)
+    corpus = []
+    start = to_micros(datetime.datetime(2024, 1, 1))
+    step = 30 * 86400 * 10 ** 6 // commands_per_phase
+    for phase in range(phases):
+        for i, (command, command_type) in enumerate(_synthetic_command_corpus(types, commands_per_phase, rng)):
+            corpus.append((command, command_type, start + (phase * commands_per_phase + i) * step))
+    split = len(corpus) - int(commands_per_phase * holdout)
+    train, test = corpus[:split], corpus[split:]
+    
+    configs = {
+        "unbounded": {"half_life_days": None, "max_keywords": None},
+        "decay": {"half_life_days": half_life_days, "max_keywords": None},
+        "decay + cap": {"half_life_days": half_life_days, "max_keywords": max_keywords}
+    }
+    print(f"Learning decay benchmark ({types} types, {phases} monthly phases of {commands_per_phase} commands, "
+          f"half-life {half_life_days} days, cap {max_keywords} keywords)")
+    results = {}
+    for name, config in configs.items():
+        learning = LearningSystem(data_file=None, **config)
+        learn_start = time.perf_counter()
+        for command, command_type, micros in train:
+            learning.learn_from_command(command, command_type, True, micros)
+        learn_time = (time.perf_counter() - learn_start) / len(train)
+        correct = sum(learning.predict_command_type(command) == command_type for command, command_type, _ in test)
+        size = len(json.dumps(learning._snapshot_data()))
+        results[name] = {"keywords": learning.keyword_count, "bytes": size,
+                         "accuracy": correct / len(test), "learn": learn_time}
+        print(f"  {name:<12} {learning.keyword_count:6d} keywords  {size / 1024:7.1f} KB  "
+              f"recent accuracy {correct / len(test) * 100:5.1f}%  {learn_time * 1e6:5.1f} us per command")
+    return results
+
+UTTERANCE_TEMPLATES = [
+    "open {app}", "launch {app} please", "what is the weather in {place}", "weather tomorrow in {place}",
+    "play some {genre} music", "search for {topic}", "google {topic} tutorials", "set a timer for {n} minutes",
+    "remind me to call {name}", "message {name} about dinner", "read me the news about {topic}"
+]
+UTTERANCE_FILLERS = {
+    "app": ["chrome", "spotify", "notepad", "calculator", "vscode", "telegram"],
+    "place": ["london", "paris", "bangalore", "tokyo", "toronto"],
+    "genre": ["jazz", "rock", "lofi", "classical"],
+    "topic": ["python", "cricket", "stocks", "recipes", "space", "elections"],
+    "name": ["john", "priya", "amit", "sara"],
+    "n": [str(n) for n in (5, 10, 15, 25)]
+}
+
+def _synthetic_utterances(count, rng):
+    return [rng.choice(UTTERANCE_TEMPLATES).format(**{key: rng.choice(values) for key, values in UTTERANCE_FILLERS.items()})
+            for _ in range(count)]
+
+def _substring_route(text, keywords):
+    # How process_command routed before IntentRouter: the first keyword found anywhere in the text
+    for keyword in keywords:
+        if keyword in text:
+            return keyword
+    return None
+
+def run_routing_benchmark(utterances=20000, handler_counts=(31, 100, 300, 1000, 3000)):
+    # Per-utterance routing cost of IntentRouter against the substring scan as handlers are added
+    rng = random.Random(21)
+    # A quarter are small talk, which no keyword routes
+    chat = ["how are you today", "tell me a joke", "thank you so much", "good morning jarvis", "who made you"]
+    corpus = [rng.choice(chat) if rng.random() < 0.25 else text for text in _synthetic_utterances(utterances, rng)]
+    consonants, vowels = "bcdfghjklmnprstvwz", "aeiou"
+    extra = []
+    while len(COMMAND_HANDLERS) + len(extra) < max(handler_counts):
+        word = "".join(rng.choice(consonants) + rng.choice(vowels) for _ in range(3))
+        if word not in extra:
+            extra.append(word)
+    
+    print(f"Routing benchmark ({utterances} utterances)")
+    results = {}
+    for count in handler_counts:
+        keywords = list(COMMAND_HANDLERS) + extra[:max(count - len(COMMAND_HANDLERS), 0)]
+        build_time, router = _time_call(lambda: IntentRouter(keywords), 1)
+        scan_time, _ = _time_call(lambda: [_substring_route(text, keywords) for text in corpus], 3)
+        route_time, _ = _time_call(lambda: [router.route(text) for text in corpus], 3)
+        results[count] = {"build": build_time, "substring": scan_time / utterances, "router": route_time / utterances}
+        print(f"  {len(keywords):5d} keywords  substring scan {scan_time / utterances * 1e6:7.2f} us  "
+              f"router {route_time / utterances * 1e6:5.2f} us  (compiled in {build_time * 1000:.1f} ms)")
+    return results
+
+def run_parsing_benchmark(utterances=100000):
+    # CommandParser throughput: tokenizing, routing and slot filling per utterance
+    rng = random.Random(22)
+    corpus = _synthetic_utterances(utterances, rng)
+    router = IntentRouter(COMMAND_HANDLERS)
+    parser = CommandParser(router)
+    
+    route_time, _ = _time_call(lambda: [router.route(text) for text in corpus], 3)
+    parse_time, commands = _time_call(lambda: [parser.parse(text) for text in corpus], 3)
+    handler_slots = {slot for rules in COMMAND_SLOTS.values() for slot, _, _ in rules}
+    filled = sum(1 for command in commands if handler_slots & command.slots.keys())
+    
+    print(f"Parsing benchmark ({utterances} utterances)")
+    print(f"  routing only   {route_time / utterances * 1e6:6.2f} us per utterance")
+    print(f"  full parse     {parse_time / utterances * 1e6:6.2f} us per utterance, "
+          f"{utterances / parse_time:,.0f} utterances/s")
+    print(f"  {filled / utterances * 100:.1f}% of commands had a handler slot filled")
+    return {"route": route_time / utterances, "parse": parse_time / utterances, "filled": filled / utterances}
+
+def run_executor_benchmark(commands=300, interval=0.01, slow_share=0.05, slow_seconds=0.5, fast_seconds=0.002):
+    # Reply latency for a burst of input where some handlers block (a Telegram
+    # send, a browser launch), run inline on the input thread and through the CommandExecutor
+    rng = random.Random(23)
+    durations = [slow_seconds if rng.random() < slow_share else fast_seconds for _ in range(commands)]
+    
+    def percentile(values, percent):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * percent / 100))]
+    
+    print(f"Executor benchmark ({commands} commands {interval * 1000:.0f} ms apart, "
+          f"{sum(1 for duration in durations if duration == slow_seconds)} blocking for {slow_seconds}s)")
+    results = {}
+    
+    # Inline: each command holds the input thread until its handler returns
+    start = time.monotonic()
+    latencies, stall = [], 0.0
+    for index, duration in enumerate(durations):
+        arrival = start + index * interval
+        now = time.monotonic()
+        if now < arrival:
+            time.sleep(arrival - now)
+        time.sleep(duration)
+        stall = max(stall, duration)
+        if duration != slow_seconds:
+            latencies.append(time.monotonic() - arrival)
+    results["inline"] = {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95), "stall": stall}
+    
+    # Queued: the input thread only submits, and replies arrive as handlers finish
+    executor = CommandExecutor(lambda callback: callback(), max_workers=4, max_queue=64)
+    latencies, stall = [], 0.0
+    finished = threading.Semaphore(0)
+    
+    def on_done(task):
+        if task.args[0] != slow_seconds:
+            latencies.append(time.monotonic() - task.submitted)
+        finished.release()
+    
+    start = time.monotonic()
+    submitted = 0
+    for index, duration in enumerate(durations):
+        arrival = start + index * interval
+        now = time.monotonic()
+        if now < arrival:
+            time.sleep(arrival - now)
+        before = time.monotonic()
+        submitted += executor.submit(index, time.sleep, (duration,), on_done=on_done) is not None
+        stall = max(stall, time.monotonic() - before)
+    for _ in range(submitted):
+        finished.acquire()
+    metrics = executor.metrics()
+    results["executor"] = {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95), "stall": stall,
+                           "max_depth": metrics["max_depth"], "wait_p95": metrics["wait"]["p95"],
+                           "rejected": metrics["rejected"]}
+    
+    for mode, result in results.items():
+        print(f"  {mode:8s}  fast replies p50 {result['p50'] * 1000:7.1f} ms  p95 {result['p95'] * 1000:7.1f} ms  "
+              f"longest input stall {result['stall'] * 1000:6.1f} ms")
+    print(f"  queue depth peaked at {metrics['max_depth']}, p95 queue wait {metrics['wait']['p95'] * 1000:.1f} ms, "
+          f"{metrics['rejected']} rejected")
+    return results
+
+def run_result_cache_benchmark(requests=400, locations=20, spacing=3.0, round_trip=0.02):
+    # Answer latency for weather, news and help requests when each answer costs
+    # a network round trip, recomputed every time and through the ResultCache.
+    # Requests are `spacing` simulated seconds apart, so TTLs expire during the run.
+    rng = random.Random(24)
+    places = [f"city{i}" for i in range(locations)]
+    weights = [1.0 / (rank + 1) for rank in range(locations)]
+    workload = []
+    for _ in range(requests):
+        handler = rng.choice(["handle_weather", "handle_weather", "handle_news", "handle_help"])
+        if handler == "handle_weather":
+            slots = {"location": rng.choices(places, weights)[0]}
+        elif handler == "handle_news":
+            slots = {"topic": rng.choice(["general", "sports", "technology"])}
+        else:
+            slots = {}
+        workload.append((handler, slots))
+    
+    def answer(handler, slots):
+        time.sleep(round_trip)
+        return f"{handler} {slots}"
+    
+    def percentile(values, percent):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(len(values) * percent / 100))]
+    
+    now = [0.0]
+    threads = []
+    cache = ResultCache(spawn=lambda refresh: threads.append(ResultCache._spawn_thread(refresh)) or threads[-1],
+                        clock=lambda: now[0])
+    results = {}
+    for mode in ("uncached", "cached"):
+        latencies = []
+        for index, (handler, slots) in enumerate(workload):
+            now[0] = index * spacing
+            start = time.perf_counter()
+            if mode == "cached":
+                ttl, stale = HANDLER_CACHE_TTLS[handler]
+                cache.fetch(ResultCache.key(handler, slots), lambda: answer(handler, slots), ttl, stale)
+            else:
+                answer(handler, slots)
+            latencies.append(time.perf_counter() - start)
+        results[mode] = {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+                         "total": sum(latencies)}
+    for thread in threads:
+        thread.join()
+    
+    stats = cache.stats
+    print(f"Result cache benchmark ({requests} requests over {requests * spacing / 60:.0f} simulated minutes, "
+          f"{round_trip * 1000:.0f} ms per lookup)")
+    for mode, result in results.items():
+        print(f"  {mode:8s}  p50 {result['p50'] * 1000:7.3f} ms  p95 {result['p95'] * 1000:7.3f} ms  "
+              f"total {result['total']:.2f}s")
+    print(f"  {stats['hits']} fresh hits, {stats['stale_hits']} stale hits refreshed in the background, "
+          f"{stats['misses']} misses ({(stats['hits'] + stats['stale_hits']) / requests * 100:.1f}% answered from memory)")
+    results["stats"] = dict(stats)
+    return results
+
+def run_pipeline_timings_benchmark(utterances=20000, trained=5000):
+    # The non-audio stages of the command pipeline timed through StageTimings,
+    # and what recording a duration costs
+    import tempfile
+    import shutil
+    
+    rng = random.Random(25)
+    directory = tempfile.mkdtemp(prefix="jarvis_timings_")
+    try:
+        router = IntentRouter(COMMAND_HANDLERS)
+        parser = CommandParser(router)
+        learning = LearningSystem(os.path.join(directory, "learning_data.json"), snapshot_delay=60)
+        for text in _synthetic_utterances(trained, rng):
+            intent = router.route(text)
+            if intent:
+                learning.learn_from_command(text, intent, True)
+        cache = ResultCache(spawn=lambda refresh: None)
+        timings = StageTimings()
+        # Small talk and keyword-free phrasings go through prediction
+        chat = ["how are you today", "tell me a joke", "play something relaxing", "is it going to rain"]
+        corpus = [rng.choice(chat) if rng.random() < 0.2 else text for text in _synthetic_utterances(utterances, rng)]
+        
+        for text in corpus:
+            received = start = time.perf_counter()
+            command = parser.parse(text)
+            start = timings.since("parse", start)
+            if not command.intent:
+                predicted = learning.predict_command_type(text)
+                if predicted:
+                    command = parser.parse(text, predicted)
+                start = timings.since("predict", start)
+            if command.intent:
+                handler = COMMAND_HANDLERS.get(command.intent)
+                if handler in HANDLER_CACHE_TTLS:
+                    ttl, stale = HANDLER_CACHE_TTLS[handler]
+                    cache.fetch(ResultCache.key(handler, command.slots), lambda: str(command), ttl, stale)
+                start = timings.since("handler", start)
+                learning.learn_from_command(text, command.intent, True)
+                timings.since("learn", start)
+            timings.since("response", received)
+        
+        probe = StageTimings(("probe",))
+        overhead, _ = _time_call(lambda: [probe.record("probe", 0.001) for _ in range(100000)], 3)
+        print(f"Pipeline timings benchmark ({utterances} utterances)")
+        for line in timings.report().splitlines():
+            if not line.split()[1] == "0":
+                print(f"  {line}")
+        print(f"  recording one duration costs {overhead / 100000 * 1e6:.2f} us")
+        learning.flush(timeout=5)
+        return {"stages": timings.summary(), "record": overhead / 100000}
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def run_replay_training_benchmark(profiles=20, days=365, commands_per_day=20):
+    # ReplayTrainer over a year of archived history for many profiles, serially and across a process pool
+    import tempfile
+    import shutil
+    
+    rng = random.Random(20)
+    directory = tempfile.mkdtemp(prefix="jarvis_replay_")
+    try:
+        store = FileProfileStore(os.path.join(directory, "profiles"), Fernet.generate_key())
+        start = to_micros(datetime.datetime(2024, 1, 1))
+        spacing = 86400 * 10 ** 6 // commands_per_day
+        build_start = time.perf_counter()
+        for i in range(profiles):
+            profile = UserProfile(f"user{i}")
+            store.write_snapshot(profile)
+            store._archive(profile.name).append(
+                [(start + j * spacing, command)
+                 for j, command in enumerate(_synthetic_utterances(days * commands_per_day, rng))], store.cipher_suite)
+        print(f"Replay training benchmark ({profiles} profiles, {days * commands_per_day} commands each, "
+              f"built in {time.perf_counter() - build_start:.1f}s)")
+        
+        results = {}
+        for workers in sorted({1, os.cpu_count() or 1}):
+            learning = LearningShards(os.path.join(directory, f"learning{workers}"),
+                                      os.path.join(directory, f"learning{workers}.json"))
+            trainer = ReplayTrainer(store, learning, engine=BulkProfileEngine(max_workers=workers, serial_threshold=0))
+            report = trainer.run()
+            results[workers] = report
+            print(f"  {workers} worker(s): {report['total_seconds']:.2f}s, "
+                  f"{report['commands'] / report['total_seconds']:.0f} commands/s, "
+                  f"held-out accuracy {report['accuracy'] * 100:.1f}%")
+        return results
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def run_key_rotation_benchmark(profiles=1000, history_entries=100):
+    # Key rotation time for many profiles, serially and across a process pool
+    import tempfile
+    import shutil
+    
+    profiles_dir = tempfile.mkdtemp(prefix="jarvis_rotation_")
+    try:
+        manager = ProfileManager(profiles_dir, save_delay=0)
+        for i in range(profiles):
+            profile = UserProfile(f"user{i}")
+            profile.command_history = [{"command": f"open app {j}", "timestamp": "2024-01-01T00:00:00"}
+                                       for j in range(history_entries)]
+            manager.store.write_snapshot(profile)
+        
+        print(f"Key rotation benchmark ({profiles} profiles)")
+        results = {}
+        for workers in sorted({1, os.cpu_count() or 1}):
+            manager.store.bulk_engine = BulkProfileEngine(max_workers=workers, serial_threshold=0)
+            start = time.perf_counter()
+            if not manager.rotate_encryption_key(Fernet.generate_key()):
+                print("  rotation failed, see jarvis.log")
+                return None
+            results[workers] = time.perf_counter() - start
+            print(f"  {workers} worker(s): {results[workers]:.2f}s")
+        return results
+    finally:
+        shutil.rmtree(profiles_dir, ignore_errors=True)
+
+BENCHMARKS = {
+    "startup": run_startup_benchmark,
+    "profile_format": run_profile_format_benchmark,
+    "key_rotation": run_key_rotation_benchmark,
+    "memory": run_memory_benchmark,
+    "contact_lookup": run_contact_lookup_benchmark,
+    "prediction": run_prediction_benchmark,
+    "classifier": run_classifier_benchmark,
+    "learning_decay": run_learning_decay_benchmark,
+    "replay_training": run_replay_training_benchmark,
+    "routing": run_routing_benchmark,
+    "parsing": run_parsing_benchmark,
+    "executor": run_executor_benchmark,
+    "result_cache": run_result_cache_benchmark,
+    "pipeline_timings": run_pipeline_timings_benchmark
+}
+
+def run_benchmark(name):
+    if name not in BENCHMARKS:
+        print(f"Unknown benchmark '{name}'. Available: {', '.join(sorted(BENCHMARKS))}")
+        return None
+    return BENCHMARKS[name]()
+
+def run_retrain(profile_backend="file", key_path=None):
+    # Rebuilds learning_data.json and the profile learning shards from saved history.
+    # Profiles are only readable with the key they were saved under (Export Encryption Key in settings).
+    encryption_key = None
+    if key_path:
+        with open(key_path, 'rb') as f:
+            encryption_key = f.read().strip()
+    manager = ProfileManager(encryption_key=encryption_key, backend=profile_backend)
+    trainer = ReplayTrainer(manager.store, LearningShards())
+    report = trainer.run(log_path="jarvis.log", report_path="learning_report.json")
+    print(f"Retrained on {report['commands']} commands ({report['labelled']} labelled) "
+          f"from {len(report['sources'])} sources in {report['total_seconds']:.2f}s")
+    if report["unreadable"]:
+        print(f"  skipped {len(report['unreadable'])} profiles not readable with "
+              f"{'this key' if key_path else 'a new key; pass --key with the exported key'}")
+    if report["accuracy"] is not None:
+        print(f"  held-out accuracy {report['accuracy'] * 100:.1f}% over {report['tested']} commands")
+    print("  report written to learning_report.json")
+    return report
+
 def main():
+    if "--test" in sys.argv:
+        run_tests()
+        return
+    
+    # --store sqlite keeps profiles in profiles/profiles.db instead of one file each
+    profile_backend = "file"
+    if "--store" in sys.argv:
+        index = sys.argv.index("--store")
+        profile_backend = sys.argv[index + 1] if index + 1 < len(sys.argv) else ""
+        if profile_backend not in ("file", "sqlite"):
+            print(f"Unknown profile store '{profile_backend}'. Available: file, sqlite")
+            return
+    
+    if "--retrain" in sys.argv:
+        key_path = None
+        if "--key" in sys.argv:
+            index = sys.argv.index("--key")
+            key_path = sys.argv[index + 1] if index + 1 < len(sys.argv) else None
+        run_retrain(profile_backend, key_path)
+        return
+    
+    if "--benchmark" in sys.argv:
+        index = sys.argv.index("--benchmark")
+        run_benchmark(sys.argv[index + 1] if index + 1 < len(sys.argv) else "")
+        return
+    
     # Create necessary directories
     if not os.path.exists("profiles"):
         os.makedirs("profiles")
@@ -2740,8 +8000,15 @@ def main():
     
     # Create and run the application
     root = tk.Tk()
-    app = JarvisAssistant(root)
+    app = JarvisAssistant(root, profile_backend)
+    if "--startup-probe" in sys.argv:
+        root.after_idle(lambda: report_startup_probe(root))
     root.mainloop()
+    
+    # Closing the window skips handle_exit, so write out any saves still queued
+    app.profile_manager.flush(timeout=5)
+    app.learning_system.flush(timeout=5)
+    app.timings.dump(os.path.join("logs", "pipeline_timings.json"))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()